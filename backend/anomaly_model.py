@@ -0,0 +1,206 @@
+import glob
+import os
+import re
+import threading
+import time
+
+import numpy as np
+
+try:
+    import joblib
+    from sklearn.ensemble import IsolationForest
+    from sklearn.preprocessing import StandardScaler
+    SKLEARN_AVAILABLE = True
+except ImportError:
+    SKLEARN_AVAILABLE = False
+
+FEATURES = ('size', 'protocol', 'interarrival')
+MODEL_FILE_PATTERN = re.compile(r'anomaly_model_v(\d+)\.joblib$')
+
+
+def packet_features(timestamps, protocols, sizes):
+    """Feature matrix (size, protocol, seconds since the previous packet) for packets in arrival order"""
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    interarrival = np.diff(timestamps, prepend=timestamps[:1]) if len(timestamps) else timestamps
+    return np.column_stack((np.asarray(sizes, dtype=np.float64),
+                            np.asarray(protocols, dtype=np.float64),
+                            np.maximum(interarrival, 0.0)))
+
+
+def history_features(rows):
+    """Feature matrix for rows of a PacketRingBuffer"""
+    return packet_features(rows['timestamp'], rows['protocol'], rows['size'])
+
+
+def database_features(partitions, limit=50000):
+    """Feature matrix for the newest limit packet rows stored by a PacketPartitionRouter"""
+    rows = partitions.fetch(limit=limit, columns=('timestamp', 'protocol', 'size'))
+    if not rows:
+        return packet_features([], [], [])
+    timestamps, protocols, sizes = zip(*reversed(rows))
+    return packet_features(timestamps, protocols, sizes)
+
+
+class AnomalyModel:
+    """A fitted scaler and IsolationForest, with the version and training data they came from.
+
+    Never modified after training, so the stats loop can score with
+    whatever model it picked up while a newer one is being swapped in.
+    """
+
+    def __init__(self, version, scaler, forest, source, rows, trained_at=None):
+        self.version = version
+        self.scaler = scaler
+        self.forest = forest
+        self.source = source
+        self.rows = rows
+        self.trained_at = trained_at or time.time()
+
+    def score(self, features):
+        """Anomaly scores for a feature matrix; negative scores are anomalies"""
+        return self.forest.decision_function(self.scaler.transform(features))
+
+    def info(self):
+        return {
+            'version': self.version,
+            'trained_at': self.trained_at,
+            'source': self.source,
+            'rows': self.rows,
+            'features': list(FEATURES)
+        }
+
+
+class AnomalyModelTrainer:
+    """Trains IsolationForest models in a background thread and persists each version to model_dir.
+
+    load_features() returns the training feature matrix (from the packet
+    history or the database). A new model is trained every
+    retrain_interval seconds, or sooner after retrain(); until the first
+    model exists training is retried every poll_interval seconds. Each
+    model is written to anomaly_model_v<version>.joblib (via a temporary
+    file and rename), the newest keep_versions files are kept, and the
+    newest loadable one is picked up at startup. A new model replaces the
+    current one with a single reference assignment, so readers of .model
+    always see a complete model.
+    """
+
+    def __init__(self, load_features, model_dir='models', source='history', min_rows=1000,
+                 retrain_interval=900, poll_interval=10, keep_versions=3, n_estimators=100):
+        self.load_features = load_features
+        self.model_dir = model_dir
+        self.source = source
+        self.min_rows = min_rows
+        self.retrain_interval = retrain_interval
+        self.poll_interval = poll_interval
+        self.keep_versions = keep_versions
+        self.n_estimators = n_estimators
+        self.model = None
+        self.thread = None
+        self.running = False
+        self.wake = threading.Event()
+        self.train_lock = threading.Lock()
+
+        # Counters exposed through the stats API
+        self.trainings = 0
+        self.last_training_seconds = 0.0
+        self.last_error = None
+
+    def start(self):
+        """Start the training thread"""
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name='anomaly-model-trainer')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self, timeout=5):
+        """Stop the training thread"""
+        self.running = False
+        self.wake.set()
+        if self.thread:
+            self.thread.join(timeout)
+            self.thread = None
+
+    def retrain(self):
+        """Ask the training thread to train a new model now"""
+        self.wake.set()
+
+    def load_latest(self):
+        """Load the newest persisted model that can be read; returns it or None"""
+        for version, path in sorted(self._model_files(), reverse=True):
+            try:
+                model = joblib.load(path)
+            except Exception as e:
+                print(f"Error loading anomaly model {path}: {e}")
+                continue
+            if isinstance(model, AnomalyModel):
+                self.model = model
+                return model
+        return None
+
+    def train(self):
+        """Train, persist and swap in a new model; returns it, or None if there is too little data"""
+        with self.train_lock:
+            started = time.time()
+            features = self.load_features()
+            if len(features) < self.min_rows:
+                return None
+            scaler = StandardScaler().fit(features)
+            forest = IsolationForest(n_estimators=self.n_estimators, contamination='auto', random_state=42)
+            forest.fit(scaler.transform(features))
+            versions = [version for version, _ in self._model_files()]
+            if self.model is not None:
+                versions.append(self.model.version)
+            model = AnomalyModel(max(versions, default=0) + 1, scaler, forest, self.source, len(features))
+            self._save(model)
+            self.model = model
+            self.trainings += 1
+            self.last_training_seconds = time.time() - started
+            return model
+
+    def get_stats(self):
+        """Current model and training counters"""
+        return {
+            'running': self.running,
+            'model': self.model.info() if self.model else None,
+            'trainings': self.trainings,
+            'last_training_seconds': self.last_training_seconds,
+            'retrain_interval': self.retrain_interval,
+            'last_error': self.last_error
+        }
+
+    def _run(self):
+        while self.running:
+            self.wake.wait(self.retrain_interval if self.model else self.poll_interval)
+            self.wake.clear()
+            if not self.running:
+                break
+            try:
+                self.train()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"Error training anomaly model: {e}")
+
+    def _model_files(self):
+        """(version, path) for every persisted model"""
+        files = []
+        for path in glob.glob(os.path.join(self.model_dir, 'anomaly_model_v*.joblib')):
+            match = MODEL_FILE_PATTERN.search(path)
+            if match:
+                files.append((int(match.group(1)), path))
+        return files
+
+    def _save(self, model):
+        """Write a model atomically and drop the oldest versions"""
+        os.makedirs(self.model_dir, exist_ok=True)
+        path = os.path.join(self.model_dir, f'anomaly_model_v{model.version}.joblib')
+        temporary = path + '.tmp'
+        joblib.dump(model, temporary)
+        os.replace(temporary, path)
+        for version, old_path in sorted(self._model_files())[:-self.keep_versions]:
+            try:
+                os.remove(old_path)
+            except OSError as e:
+                print(f"Error removing old anomaly model {old_path}: {e}")
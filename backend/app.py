@@ -1,8 +1,8 @@
 import os
-import json
 import time
 import threading
 from collections import defaultdict
+from itertools import islice
 from datetime import datetime
 import sqlite3
 from flask import Flask, render_template, request, jsonify, send_from_directory, Response
@@ -10,12 +10,32 @@ from flask_socketio import SocketIO, emit
 import psutil
 import numpy as np
 import requests
-import csv
-from io import StringIO
+from threat_enrichment import ThreatIntelEnricher
+from geoip_db import GeoIPDatabase
+from bpf_filter import compile_bpf_filter, record_matches_filters
+from fast_decode import RawSniffer, scapy_packet_to_record, frame_bytes
+from capture_workers import CaptureWorkerPool, start_worker_launcher
+from ring_buffer import PacketRingBuffer
+from flow_table import FlowTable
+from port_stats import PortStats
+from geo_rollups import GeoRollups
+from heavy_hitters import HeavyHitters
+from cardinality import DistinctCounters
+from ip_table import IPSpillWriter, IPStatsTable
+from prefix_trie import PrefixIndex
+from streaming_detectors import StreamingDetectors
+from rate_meters import RateMeters
+from rollup_store import PROTOCOL_COLUMNS, RollupStore, create_rollup_tables
+from anomaly_model import AnomalyModelTrainer, database_features, history_features
+from db_maintenance import SCHEMA_VERSION, RetentionJob, migrate_database
+from packet_partitions import PacketPartitionRouter, PartitionedPacketWriter
+from session_store import SessionPacketStore
+from session_file import SessionFileWriter, session_file_path
+from replay import PacketReplayer
 
 # Try to import scapy, but handle if it's not available
 try:
-    from scapy.all import sniff
+    from scapy.all import sniff, AsyncSniffer
     from scapy.layers.inet import IP, TCP, UDP, ICMP
     SCAPY_AVAILABLE = True
 except ImportError:
@@ -30,6 +50,7 @@ except ImportError:
     class ICMP:
         pass
     sniff = None
+    AsyncSniffer = None
     print("Scapy not available, packet capture will not work")
 
 # Try to import scikit-learn for anomaly detection
@@ -56,6 +77,46 @@ try:
 except (ImportError, Exception):
     print("ipinfo not available, GeoIP tracking will not work")
 
+# Multiprocess capture forks its workers from a helper process, which has to be forked here,
+# before the writer, rollup and retention threads below start
+CAPTURE_WORKERS_ENABLED = os.environ.get('NTA_CAPTURE_WORKERS', '1') == '1'
+worker_launcher = start_worker_launcher() if CAPTURE_WORKERS_ENABLED else None
+
+# Offline GeoIP/ASN range database (build it with generate_geoip_data.py)
+GEOIP_DB_PATH = os.environ.get('GEOIP_DB_PATH', 'geoip.ntadb')
+geoip_db = None
+
+try:
+    if os.path.exists(GEOIP_DB_PATH):
+        geoip_db = GeoIPDatabase(GEOIP_DB_PATH)
+        print(f"Offline GeoIP database loaded: {GEOIP_DB_PATH} ({geoip_db.record_count} ranges)")
+except Exception as e:
+    print(f"Error loading offline GeoIP database {GEOIP_DB_PATH}: {e}")
+    geoip_db = None
+
+def cache_geoip_info(ip, geo_info):
+    """Cache GeoIP info for an IP and move its traffic totals into the matching geo rollups"""
+    with stats_lock:
+        packet_stats['geoip_data'][ip] = geo_info
+        ip_stats = packet_stats['ips'].get(ip)
+        if ip_stats:
+            packet_stats['geo'].assign(ip, geo_info, ip_stats['sent'] + ip_stats['received'], ip_stats['bytes'])
+        else:
+            packet_stats['geo'].assign(ip, geo_info)
+
+def get_network_type(org):
+    """Classify an organization name as Hosting, VPN, Tor, Proxy or Residential"""
+    org = org.lower()
+    if 'cloudflare' in org or 'amazon' in org or 'aws' in org or 'microsoft' in org:
+        return 'Hosting'
+    elif 'vpn' in org or 'nordvpn' in org or 'expressvpn' in org:
+        return 'VPN'
+    elif 'tor' in org:
+        return 'Tor'
+    elif 'proxy' in org:
+        return 'Proxy'
+    return 'Residential'
+
 # Add some mock GeoIP data for demonstration purposes
 def add_mock_geoip_data():
     """Add mock GeoIP data for demonstration"""
@@ -112,13 +173,15 @@ def add_mock_geoip_data():
     }
     
     with stats_lock:
-        # Add mock GeoIP data
         for ip, geo_info in mock_geo_data.items():
-            packet_stats['geoip_data'][ip] = geo_info
-            
             # Add mock traffic data
             if ip in mock_traffic_data:
-                packet_stats['ips'][ip] = mock_traffic_data[ip]
+                traffic = packet_stats['ips'][ip] = mock_traffic_data[ip]
+                packet_stats['prefixes'].add(ip, traffic['sent'] + traffic['received'], traffic['bytes'])
+                packet_stats['heavy_hitters'].add_ip(ip, traffic['sent'] + traffic['received'], traffic['bytes'])
+            
+            # Add mock GeoIP data
+            cache_geoip_info(ip, geo_info)
                 
     print("Mock GeoIP data added for demonstration")
 
@@ -127,14 +190,44 @@ app = Flask(__name__)
 app.config['SECRET_KEY'] = 'network-traffic-analyzer-secret'
 socketio = SocketIO(app, cors_allowed_origins="*")
 
+# Number of recent packets kept in the packet history ring buffer
+PACKET_HISTORY_CAPACITY = int(os.environ.get('NTA_HISTORY_CAPACITY', 100000))
+
+# Flow table limits: flows end after FLOW_IDLE_TIMEOUT seconds without packets or FLOW_ACTIVE_TIMEOUT seconds in total
+FLOW_IDLE_TIMEOUT = float(os.environ.get('NTA_FLOW_IDLE_TIMEOUT', 60))
+FLOW_ACTIVE_TIMEOUT = float(os.environ.get('NTA_FLOW_ACTIVE_TIMEOUT', 1800))
+MAX_FLOWS = int(os.environ.get('NTA_MAX_FLOWS', 100000))
+HEAVY_HITTER_CAPACITY = int(os.environ.get('NTA_HEAVY_HITTER_CAPACITY', 1000))  # Keys tracked per top-K summary
+
+# Per-IP table limits: cold IPs are evicted ('lru' or 'lfu') and, if enabled, their counters spilled to SQLite
+MAX_IPS = int(os.environ.get('NTA_MAX_IPS', 200000))
+IP_EVICTION_POLICY = os.environ.get('NTA_IP_EVICTION_POLICY', 'lru')
+IP_SPILL_ENABLED = os.environ.get('NTA_IP_SPILL', '1') == '1'
+ip_spill_writer = IPSpillWriter('nta_data.db', batch_size=1000, flush_interval=1.0)
+
+def forget_evicted_ip(ip):
+    """Drop the per-IP state kept outside the IP table when an IP is evicted from it"""
+    packet_stats['prefixes'].remove(ip)
+    packet_stats['geoip_data'].pop(ip, None)
+    packet_stats['geo'].forget(ip)
+
 # Global variables for packet capture and statistics
 packet_stats = {
     'total_packets': 0,
     'total_bytes': 0,
     'protocols': defaultdict(int),
-    'ips': defaultdict(lambda: {'sent': 0, 'received': 0, 'bytes': 0}),
+    'ips': IPStatsTable(MAX_IPS, IP_EVICTION_POLICY, ip_spill_writer.submit if IP_SPILL_ENABLED else None,
+                        on_evict=forget_evicted_ip),
+    'prefixes': PrefixIndex(),  # Radix tries of the addresses in 'ips', for subnet clustering at any prefix length
     'top_talkers': [],
-    'packet_history': [],
+    'packet_history': PacketRingBuffer(PACKET_HISTORY_CAPACITY),  # Also feeds anomaly detection
+    'flows': FlowTable(FLOW_IDLE_TIMEOUT, FLOW_ACTIVE_TIMEOUT, MAX_FLOWS),  # Bidirectional 5-tuple flows
+    'ports': PortStats(lambda port: is_unusual_port(port)),  # Port/protocol aggregates for port intelligence
+    'heavy_hitters': HeavyHitters(HEAVY_HITTER_CAPACITY),  # Bounded top-K of IPs, destination ports and subnets
+    'distinct': DistinctCounters(),  # HyperLogLog distinct counts per subnet/country/ASN/port/minute
+    'geo': GeoRollups(lambda org: get_network_type(org)),  # Country/ASN/ISP/timezone/network type rollups
+    'detectors': StreamingDetectors(),  # EWMA/CUSUM rate detectors for total traffic and per IP/port/protocol
+    'rates': RateMeters(),  # pps/bps over 1s-1h windows, globally and per interface, protocol and top IP
     'filtered_packets': [],  # For storing filtered packets
     'anomalies': [],  # For storing detected anomalies
     'geoip_data': {}  # For storing GeoIP information
@@ -143,9 +236,19 @@ packet_stats = {
 # Anomaly detection model
 anomaly_detector = None
 anomaly_scaler = None
-anomaly_data_buffer = []
 anomaly_detection_enabled = True
 
+# 'trained': score new packets with a model retrained in the background; 'refit': refit on the last 100 packets every tick
+ANOMALY_MODEL_MODE = os.environ.get('NTA_ANOMALY_MODE', 'trained')
+ANOMALY_MODEL_DIR = os.environ.get('NTA_ANOMALY_MODEL_DIR', 'models')
+ANOMALY_TRAINING_SOURCE = os.environ.get('NTA_ANOMALY_TRAINING_SOURCE', 'history')  # 'history' or 'database'
+ANOMALY_TRAINING_ROWS = int(os.environ.get('NTA_ANOMALY_TRAINING_ROWS', 50000))
+ANOMALY_RETRAIN_INTERVAL = float(os.environ.get('NTA_ANOMALY_RETRAIN_INTERVAL', 900))
+ANOMALY_SCORE_BATCH_SIZE = 10000  # Newest unscored packets scored per tick
+MAX_AI_ANOMALIES_PER_TICK = 20
+anomaly_trainer = None
+anomaly_scored_sequence = 0  # packet_history sequence number scored up to
+
 # Packet filtering configuration
 packet_filters = {
     'ip_filter': None,  # Filter by specific IP
@@ -154,31 +257,53 @@ packet_filters = {
     'size_filter': {'min': 0, 'max': float('inf')}  # Filter by packet size
 }
 
+# Filters pushed into the kernel as a BPF expression on the running sniffers
+bpf_filter_state = {
+    'expression': None,  # Expression compiled from packet_filters
+    'kernel_filters': [],  # Filters covered by the compiled expression
+    'python_filters': [],  # Filters that can only be checked in Python
+    'active_expression': None,  # Expression the running sniffers were started with
+    'active_kernel_filters': []  # Filters the running sniffers apply in the kernel
+}
+
 # Alert configuration
 alerts_config = {
     'high_traffic_threshold': 1000,  # packets per second
     'suspicious_ips': set(),  # Set of IPs to watch
     'enabled': True
 }
+packet_stats['detectors'].configure({'global': {'max_rate': alerts_config['high_traffic_threshold']}})
+alerts_config['detectors'] = packet_stats['detectors'].get_config()  # Streaming detector parameters per scope
+suspicious_ip_alerts = {}  # ip -> packets seen when it was last alerted on
 
 # Threat intelligence configuration
 THREAT_INTEL_CONFIG = {
     'abuseipdb_api_key': os.environ.get('ABUSEIPDB_API_KEY', ''),
     'virustotal_api_key': os.environ.get('VIRUSTOTAL_API_KEY', ''),
     'otx_api_key': os.environ.get('OTX_API_KEY', ''),
+    'abuseipdb_url': os.environ.get('ABUSEIPDB_URL', 'https://api.abuseipdb.com/api/v2/check'),
+    'otx_url': os.environ.get('OTX_URL', 'https://otx.alienvault.com/api/v1/indicators/IPv4/{ip}/general'),
     'enabled': True,
-    'cache_duration': 3600  # 1 hour
+    'cache_duration': 3600,  # 1 hour
+    'enrichment_workers': int(os.environ.get('THREAT_INTEL_WORKERS', 4)),
+    'enrichment_queue_size': int(os.environ.get('THREAT_INTEL_QUEUE_SIZE', 10000))
 }
 
 # Threat intelligence cache
 threat_intel_cache = {}
 
+# THREAT_INTEL anomalies raised by enrichment workers, drained by the stats loop
+pending_threat_anomalies = []
+
 # IP reputation data structure
 ip_reputation_data = {}
 
 # Database setup
+db_schema_version = 0  # PRAGMA user_version after migrations
+
 def init_database():
     """Initialize SQLite database for historical data storage"""
+    global db_schema_version
     conn = sqlite3.connect('nta_data.db')
     cursor = conn.cursor()
     
@@ -195,16 +320,8 @@ def init_database():
         )
     ''')
     
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS statistics (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp REAL,
-            total_packets INTEGER,
-            total_bytes INTEGER,
-            protocols TEXT,
-            top_talkers TEXT
-        )
-    ''')
+    # Traffic deltas per second, minute and hour (replaces the old statistics snapshots)
+    create_rollup_tables(cursor)
     
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS alerts (
@@ -216,8 +333,23 @@ def init_database():
         )
     ''')
     
+    # Counters of IPs evicted from the in-memory IP table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ip_stats_spill (
+            ip TEXT PRIMARY KEY,
+            sent INTEGER,
+            received INTEGER,
+            bytes INTEGER,
+            last_evicted REAL
+        )
+    ''')
+    
     conn.commit()
     conn.close()
+    
+    # WAL journal, indexes and later schema changes, also for databases created by older versions
+    db_schema_version = migrate_database('nta_data.db', rebuild=os.environ.get('NTA_DB_REBUILD', '0') == '1')
+    print(f"Database schema version {db_schema_version}")
 
 # Initialize anomaly detection model
 def init_anomaly_detector():
@@ -232,25 +364,159 @@ def init_anomaly_detector():
         anomaly_scaler = None
         print("Scikit-learn not available, anomaly detection disabled")
 
+def load_anomaly_training_features():
+    """Training features for the anomaly model: the newest packets from the history buffer or the packet partitions"""
+    if ANOMALY_TRAINING_SOURCE == 'database':
+        return database_features(packet_partitions, ANOMALY_TRAINING_ROWS)
+    with stats_lock:
+        rows = packet_stats['packet_history'].last(ANOMALY_TRAINING_ROWS).copy()
+    return history_features(rows)
+
+def init_anomaly_trainer():
+    """Load the newest persisted anomaly model and start background retraining"""
+    global anomaly_trainer
+    if not SKLEARN_AVAILABLE or ANOMALY_MODEL_MODE != 'trained':
+        return
+    anomaly_trainer = AnomalyModelTrainer(load_anomaly_training_features, ANOMALY_MODEL_DIR, ANOMALY_TRAINING_SOURCE,
+                                          retrain_interval=ANOMALY_RETRAIN_INTERVAL)
+    model = anomaly_trainer.load_latest()
+    if model:
+        print(f"Loaded anomaly model version {model.version} ({model.rows} training rows)")
+    anomaly_trainer.start()
+
 # Initialize database on startup
 init_database()
 init_anomaly_detector()
 
+# Packet rows go to one database per hour or day, so retention deletes whole files
+packet_partitions = PacketPartitionRouter(
+    os.environ.get('NTA_PACKET_PARTITION_DIR', 'packet_partitions'),
+    os.environ.get('NTA_PACKET_PARTITION', 'hour'),  # 'hour' or 'day'
+    legacy_db='nta_data.db'  # Rows stored before partitioning, until retention empties the table
+)
+
+# Background writer for the packet partitions (batched inserts, one transaction per partition)
+packet_db_writer = PartitionedPacketWriter(
+    packet_partitions,
+    max_queue_size=int(os.environ.get('NTA_DB_QUEUE_SIZE', 50000)),
+    batch_size=int(os.environ.get('NTA_DB_BATCH_SIZE', 1000)),
+    flush_interval=float(os.environ.get('NTA_DB_FLUSH_INTERVAL', 0.5))
+)
+packet_db_writer.start()
+if IP_SPILL_ENABLED:
+    ip_spill_writer.start()
+
 # Lock for thread-safe operations
-stats_lock = threading.Lock()
+stats_lock = threading.RLock()  # Re-entrant: GeoIP caching takes it from inside the packet handler too
 
 # Add mock GeoIP data for demonstration - moved here after stats_lock is defined
 add_mock_geoip_data()
 
+# Trained anomaly model (reads the packet history under stats_lock)
+init_anomaly_trainer()
+
+# Per-second/minute/hour traffic history, fed by the rate meter clock
+ROLLUP_RETENTION = {
+    1: int(os.environ.get('NTA_ROLLUP_1S_RETENTION', 86400)),  # Seconds kept at each resolution
+    60: int(os.environ.get('NTA_ROLLUP_1M_RETENTION', 30 * 86400)),
+    3600: int(os.environ.get('NTA_ROLLUP_1H_RETENTION', 365 * 86400))
+}
+rollup_store = RollupStore('nta_data.db', ROLLUP_RETENTION)
+rollup_store.start()
+
+# Chunked expiry of old packet and alert rows (a retention of 0 keeps them forever)
+retention_job = RetentionJob(
+    'nta_data.db',
+    packet_retention=int(os.environ.get('NTA_PACKET_RETENTION', 7 * 86400)),
+    alert_retention=int(os.environ.get('NTA_ALERT_RETENTION', 30 * 86400)),
+    mode=os.environ.get('NTA_PACKET_RETENTION_MODE', 'downsample'),  # 'downsample' (to packets_hourly) or 'delete'
+    interval=float(os.environ.get('NTA_RETENTION_INTERVAL', 300)),
+    chunk_size=int(os.environ.get('NTA_RETENTION_CHUNK', 5000)),
+    partitions=packet_partitions
+)
+retention_job.start()
+
+def rate_meter_clock():
+    """Roll the rate meters and detector bins over at the start of every second and record the closed second"""
+    while True:
+        time.sleep(1 - time.time() % 1)
+        with stats_lock:
+            now = time.time()
+            packet_stats['rates'].tick(now)
+            packet_stats['detectors'].tick(now)  # Scores seconds without packets too
+            closed = packet_stats['rates'].closed_second()
+        if closed:
+            rollup_store.add_second(*closed)
+
+def stop_storage_writers():
+    """Flush and stop every background thread that writes to nta_data.db, the packet partitions or models"""
+    if anomaly_trainer:
+        anomaly_trainer.stop()
+    retention_job.stop()
+    packet_db_writer.stop()
+    ip_spill_writer.stop()
+    rollup_store.stop()
+
+rate_meter_thread = threading.Thread(target=rate_meter_clock, name='rate-meter-clock')
+rate_meter_thread.daemon = True
+rate_meter_thread.start()
+
 # Flag to control packet capture
 capture_running = False
 capture_thread = None
 capture_interfaces = []  # For multi-interface capture
+active_sniffers = []  # Running AsyncSniffer/RawSniffer instances
+capture_engine = 'scapy'  # 'scapy' (full dissection) or 'raw' (fixed-offset header decode)
+capture_pcap_file = None  # pcap/pcapng file read by the raw engine instead of a live interface
+capture_mode = 'threaded'  # 'threaded' (sniffer threads) or 'multiprocess' (worker processes)
+capture_workers_per_interface = 1  # Worker processes per interface in multiprocess mode (PACKET_FANOUT)
+sniffer_lock = threading.Lock()
 
 # Session capture variables
 capture_sessions = {}
 current_session = None
-session_packets = []
+SESSION_SNAPLEN = int(os.environ.get('NTA_SESSION_SNAPLEN', 65535))  # Bytes of each frame kept for export
+SESSION_SPOOL_SIZE = int(os.environ.get('NTA_SESSION_SPOOL_SIZE', 16 * 1024 * 1024))  # Kept in memory before spilling to disk
+session_packets = SessionPacketStore(SESSION_SNAPLEN, SESSION_SPOOL_SIZE)
+SESSION_DIR = os.environ.get('NTA_SESSION_DIR', '.')
+SESSION_COMPRESSION = os.environ.get('NTA_SESSION_COMPRESSION') or None  # None, 'gzip' or 'zstd'
+SESSION_FSYNC_INTERVAL = float(os.environ.get('NTA_SESSION_FSYNC_INTERVAL', 5.0))
+session_file_writer = None  # Appends the current session to an NDJSON file as packets arrive
+active_replay = None  # PacketReplayer feeding a capture file through handle_packet_record
+REPLAY_DIR = os.path.realpath(os.environ.get('NTA_REPLAY_DIR', 'captures'))  # Capture files the API may read
+
+def resolve_capture_file(name):
+    """Path of a file in REPLAY_DIR, or None when name is empty, leads out of it or is not a file"""
+    # Relative to the capture directory, and no way out of it (.., absolute paths, symlinks)
+    path = os.path.realpath(os.path.join(REPLAY_DIR, name)) if name else None
+    if not path or os.path.commonpath([path, REPLAY_DIR]) != REPLAY_DIR or not os.path.isfile(path):
+        return None
+    return path
+
+def start_session_file(session_info, compression):
+    """Start appending a new session to its NDJSON file"""
+    global session_file_writer
+    stop_session_file()
+    writer = SessionFileWriter(session_file_path(SESSION_DIR, session_info, compression), session_info,
+                               compression=compression, fsync_interval=SESSION_FSYNC_INTERVAL)
+    writer.start()
+    session_file_writer = writer
+    return writer.path
+
+def stop_session_file(end_info=None):
+    """Detach the session file writer and let it finish the file in the background"""
+    global session_file_writer
+    writer = session_file_writer
+    session_file_writer = None
+    if writer:
+        writer.stop(end_info)
+    return writer
+
+def new_session_store(snaplen=None):
+    """Replace the session packet store with an empty one"""
+    global session_packets
+    session_packets.close()
+    session_packets = SessionPacketStore(snaplen or SESSION_SNAPLEN, SESSION_SPOOL_SIZE)
 
 def get_network_interfaces():
     """Get list of available network interfaces"""
@@ -259,58 +525,40 @@ def get_network_interfaces():
         interfaces.append(interface)
     return interfaces
 
-def packet_matches_filters(packet):
-    """Check if a packet matches the current filters"""
-    if not packet_filters.get('enabled', False):
-        return True  # No filtering enabled
-    
-    # Size filter
-    packet_size = len(packet)
-    size_filter = packet_filters.get('size_filter', {'min': 0, 'max': float('inf')})
-    if not (size_filter['min'] <= packet_size <= size_filter['max']):
-        return False
-    
-    # IP filter
-    ip_filter = packet_filters.get('ip_filter')
-    if ip_filter and IP in packet:
-        src_ip = packet[IP].src
-        dst_ip = packet[IP].dst
-        if ip_filter not in [src_ip, dst_ip]:
-            return False
-    
-    # Protocol filter
-    protocol_filter = packet_filters.get('protocol_filter')
-    if protocol_filter and IP in packet:
-        protocol = packet[IP].proto
-        # Map protocol names to numbers (simplified)
-        protocol_map = {'TCP': 6, 'UDP': 17, 'ICMP': 1}
-        if protocol_filter in protocol_map:
-            if protocol != protocol_map[protocol_filter]:
-                return False
-        elif isinstance(protocol_filter, int) and protocol != protocol_filter:
-            return False
-    
-    # Port filter (for TCP/UDP)
-    port_filter = packet_filters.get('port_filter')
-    if port_filter and IP in packet:
-        if TCP in packet and (packet[TCP].sport == port_filter or packet[TCP].dport == port_filter):
-            return True
-        elif UDP in packet and (packet[UDP].sport == port_filter or packet[UDP].dport == port_filter):
-            return True
-        else:
-            return False
-    
-    return True
+def packet_matches_filters(record):
+    """Check if a packet record matches the current filters"""
+    # Filters already applied by the running sniffers' BPF program are skipped
+    return record_matches_filters(record, packet_filters, bpf_filter_state['active_kernel_filters'])
+
+def update_bpf_filter():
+    """Recompile the BPF expression and restart the sniffers if it changed"""
+    expression, kernel_filters, python_filters = compile_bpf_filter(packet_filters)
+    bpf_filter_state['expression'] = expression
+    bpf_filter_state['kernel_filters'] = kernel_filters
+    bpf_filter_state['python_filters'] = python_filters
+    
+    if capture_running and expression != bpf_filter_state['active_expression']:
+        restart_sniffers()
+    
+    return get_bpf_filter_status()
+
+def get_bpf_filter_status():
+    """Get which filters run in the kernel and which in Python"""
+    return {
+        'bpf_filter': bpf_filter_state['expression'],
+        'active_bpf_filter': bpf_filter_state['active_expression'],
+        'kernel_filters': bpf_filter_state['kernel_filters'],
+        'python_filters': bpf_filter_state['python_filters'],
+        'active_kernel_filters': bpf_filter_state['active_kernel_filters']
+    }
 
 def check_ip_threat_intel(ip):
     """Check if an IP is flagged in threat intelligence feeds"""
     global threat_intel_cache
     
     # Check cache first
-    if ip in threat_intel_cache:
-        cached_entry = threat_intel_cache[ip]
-        if time.time() - cached_entry['timestamp'] < THREAT_INTEL_CONFIG['cache_duration']:
-            return cached_entry['threat_info']
+    if is_threat_intel_cached(ip):
+        return threat_intel_cache[ip]['threat_info']
     
     # If not in cache or expired, check threat feeds
     threat_info = {
@@ -339,7 +587,7 @@ def check_ip_threat_intel(ip):
                 'ipAddress': ip,
                 'maxAgeInDays': 90
             }
-            response = requests.get('https://api.abuseipdb.com/api/v2/check', 
+            response = requests.get(THREAT_INTEL_CONFIG['abuseipdb_url'],
                                   headers=headers, params=params, timeout=5)
             
             if response.status_code == 200:
@@ -365,7 +613,7 @@ def check_ip_threat_intel(ip):
             headers = {
                 'X-OTX-API-KEY': THREAT_INTEL_CONFIG['otx_api_key']
             }
-            response = requests.get(f'https://otx.alienvault.com/api/v1/indicators/IPv4/{ip}/general', 
+            response = requests.get(THREAT_INTEL_CONFIG['otx_url'].format(ip=ip),
                                   headers=headers, timeout=5)
             
             if response.status_code == 200:
@@ -404,6 +652,38 @@ def check_ip_threat_intel(ip):
     
     return threat_info
 
+def is_threat_intel_cached(ip):
+    """Check if an IP has a fresh threat intelligence verdict in the cache"""
+    cached_entry = threat_intel_cache.get(ip)
+    if cached_entry is None or 'threat_info' not in cached_entry:
+        return False
+    return time.time() - cached_entry['timestamp'] < THREAT_INTEL_CONFIG['cache_duration']
+
+def handle_threat_verdict(ip, threat_info):
+    """Raise a THREAT_INTEL anomaly when an enrichment worker flags an IP"""
+    if not threat_info['is_malicious']:
+        return
+    
+    anomaly = {
+        'type': 'THREAT_INTEL',
+        'message': f'Malicious IP detected: {ip} - {threat_info["threat_type"]}',
+        'severity': 'CRITICAL',
+        'timestamp': time.time(),
+        'ip': ip,
+        'threat_info': threat_info
+    }
+    with stats_lock:
+        pending_threat_anomalies.append(anomaly)
+
+# Enrichment workers resolve new source IPs without blocking the sniffer
+threat_enricher = ThreatIntelEnricher(
+    check_ip_threat_intel,
+    on_result=handle_threat_verdict,
+    num_workers=THREAT_INTEL_CONFIG['enrichment_workers'],
+    max_queue_size=THREAT_INTEL_CONFIG['enrichment_queue_size']
+)
+threat_enricher.start()
+
 def check_vpn_proxy_tor(ip):
     """Check if an IP belongs to a VPN, Proxy, or Tor network"""
     global threat_intel_cache
@@ -584,19 +864,36 @@ def get_privacy_masked_ips():
     except Exception as e:
         return jsonify({'status': 'error', 'message': f'Error retrieving privacy masked IPs: {str(e)}'})
 
+def geoip_lookup_available():
+    """Check if any GeoIP source (offline database or ipinfo) is configured"""
+    return geoip_db is not None or (IPINFO_AVAILABLE and ipinfo_handler is not None)
+
 def get_geoip_info(ip):
     """Get GeoIP information for an IP address"""
     global ipinfo_handler
     
+    # Offline database entries never expire, so the cached copy is always valid
+    cached = packet_stats['geoip_data'].get(ip)
+    if cached is not None and cached.get('source') == 'local':
+        return cached
+    
+    # Resolve locally first; the mmap lookup needs no network
+    if geoip_db is not None:
+        geo_info = geoip_db.lookup(ip)
+        if geo_info is not None:
+            geo_info['source'] = 'local'
+            cache_geoip_info(ip, geo_info)
+            return geo_info
+    
     if not IPINFO_AVAILABLE or ipinfo_handler is None:
         return None
     
     try:
         # Check if we already have this IP's info cached
-        if ip in packet_stats['geoip_data']:
+        if cached is not None:
             # Check if cache is still valid (1 hour)
-            if time.time() - packet_stats['geoip_data'][ip].get('last_updated', 0) < 3600:
-                return packet_stats['geoip_data'][ip]
+            if time.time() - cached.get('last_updated', 0) < 3600:
+                return cached
         
         # Get GeoIP info
         details = ipinfo_handler.getDetails(ip)
@@ -617,129 +914,199 @@ def get_geoip_info(ip):
         }
         
         # Cache the info
-        packet_stats['geoip_data'][ip] = geo_info
+        cache_geoip_info(ip, geo_info)
         return geo_info
     except Exception as e:
         print(f"Error getting GeoIP info for {ip}: {e}")
         return None
 
-def packet_handler(packet):
-    """Handle captured packets and update statistics"""
-    global packet_stats, anomaly_data_buffer, session_packets, current_session
-    
+def packet_handler(packet, interface=None):
+    """Handle packets captured by scapy and update statistics"""
     # Only process if scapy is available
     if not SCAPY_AVAILABLE:
         return
     
+    handle_packet_record(scapy_packet_to_record(packet), interface)
+
+def handle_packet_record(record, interface=None):
+    """Update statistics from a decoded packet record (shared by all capture engines)"""
+    global packet_stats, session_packets, current_session
+    
     # Check if packet matches filters
-    if not packet_matches_filters(packet):
+    if not packet_matches_filters(record):
         return
     
-    # Store packet for session if capture is active
+    if interface is None:
+        interface = capture_interfaces[0] if capture_interfaces else 'default'
+    
+    # Store packet for session if capture is active (raw bytes, spilled to disk when large)
     if current_session:
-        packet_info = {
-            'timestamp': time.time(),
-            'src': packet[IP].src if IP in packet else 'Unknown',
-            'dst': packet[IP].dst if IP in packet else 'Unknown',
-            'protocol': packet[IP].proto if IP in packet else 0,
-            'size': len(packet),
-            'raw': str(packet)  # Store raw packet data
-        }
-        session_packets.append(packet_info)
-        
-        # Limit session packets to 10000 to prevent memory issues
-        if len(session_packets) > 10000:
-            session_packets = session_packets[-10000:]
+        session_packets.append(
+            record.timestamp,
+            record.src if record.src is not None else 'Unknown',
+            record.dst if record.dst is not None else 'Unknown',
+            record.protocol,
+            record.size,
+            frame_bytes(record),
+            record.linktype
+        )
+        writer = session_file_writer
+        if writer:
+            writer.submit((record.timestamp, record.src, record.dst, record.protocol, record.size,
+                           record.src_port, record.dst_port, record.tcp_flags))
     
     with stats_lock:
         # Update total packet count
         packet_stats['total_packets'] += 1
-        packet_size = len(packet)
+        packet_size = record.size
         packet_stats['total_bytes'] += packet_size
+        packet_stats['rates'].add(interface, record.protocol if record.src is not None else None,
+                                  record.src, record.dst, packet_size)
         
         # Extract IP information if available
-        if IP in packet:
-            src_ip = packet[IP].src
-            dst_ip = packet[IP].dst
-            protocol = packet[IP].proto
+        if record.src is not None:
+            src_ip = record.src
+            dst_ip = record.dst
+            protocol = record.protocol
             
             # Update protocol statistics
             packet_stats['protocols'][protocol] += 1
             
+            # Update the flow this packet belongs to
+            packet_stats['flows'].update(record.timestamp, src_ip, dst_ip, protocol, record.src_port,
+                                         record.dst_port, packet_size, record.tcp_flags)
+            
             # Update IP statistics
-            packet_stats['ips'][src_ip]['sent'] += 1
-            packet_stats['ips'][src_ip]['bytes'] += packet_size
-            packet_stats['ips'][dst_ip]['received'] += 1
-            packet_stats['ips'][dst_ip]['bytes'] += packet_size
+            packet_stats['ips'].add(src_ip, 1, 0, packet_size, record.timestamp)
+            packet_stats['ips'].add(dst_ip, 0, 1, packet_size, record.timestamp)
+            packet_stats['prefixes'].add(src_ip, 1, packet_size)
+            packet_stats['prefixes'].add(dst_ip, 1, packet_size)
+            packet_stats['geo'].add(src_ip, 1, packet_size)
+            packet_stats['geo'].add(dst_ip, 1, packet_size)
+            packet_stats['heavy_hitters'].add_packet(src_ip, dst_ip, record.dst_port, packet_size)
+            packet_stats['detectors'].observe_packet(record.timestamp, src_ip, record.dst_port, protocol)
             
-            # Check threat intelligence for source IP
-            if THREAT_INTEL_CONFIG['enabled']:
-                threat_info = check_ip_threat_intel(src_ip)
-                if threat_info['is_malicious']:
-                    # Add to anomalies
-                    anomaly = {
-                        'type': 'THREAT_INTEL',
-                        'message': f'Malicious IP detected: {src_ip} - {threat_info["threat_type"]}',
-                        'severity': 'CRITICAL',
-                        'timestamp': time.time(),
-                        'ip': src_ip,
-                        'threat_info': threat_info
-                    }
-                    packet_stats['anomalies'].append(anomaly)
+            # Queue unseen source IPs for threat intelligence enrichment
+            if THREAT_INTEL_CONFIG['enabled'] and not is_threat_intel_cached(src_ip):
+                threat_enricher.submit(src_ip)
             
             # Get GeoIP info for source IP
-            if IPINFO_AVAILABLE and ipinfo_handler:
+            if geoip_lookup_available():
                 get_geoip_info(src_ip)
             
-            # Store packet information for history
-            packet_info = {
-                'timestamp': time.time(),
-                'src': src_ip,
-                'dst': dst_ip,
-                'protocol': protocol,
-                'size': packet_size
-            }
-            packet_stats['packet_history'].append(packet_info)
+            # Update port/protocol aggregates (countries use the GeoIP cache)
+            geoip_data = packet_stats['geoip_data']
+            src_geo = geoip_data.get(src_ip)
+            dst_geo = geoip_data.get(dst_ip)
+            if record.src_port or record.dst_port:
+                packet_stats['ports'].add(protocol, packet_size, record.src_port, record.dst_port,
+                                          src_geo.get('country') if src_geo else None,
+                                          dst_geo.get('country') if dst_geo else None)
+            else:
+                packet_stats['ports'].add(protocol, packet_size)
             
-            # Add to anomaly detection buffer
-            anomaly_data_buffer.append([
-                packet_size,
-                protocol,
-                time.time()
-            ])
+            # Distinct IP counts per subnet, country, ASN, destination port and minute
+            packet_stats['distinct'].add_packet(record.timestamp, src_ip, dst_ip, record.dst_port, src_geo, dst_geo)
             
-            # Keep only last 1000 packets in history
-            if len(packet_stats['packet_history']) > 1000:
-                packet_stats['packet_history'] = packet_stats['packet_history'][-1000:]
+            # Store packet information for history and anomaly detection
+            append_packet_history(record.timestamp, src_ip, dst_ip, protocol, packet_size,
+                                  record.src_port, record.dst_port, record.tcp_flags)
             
-            # Keep only last 1000 data points for anomaly detection
-            if len(anomaly_data_buffer) > 1000:
-                anomaly_data_buffer = anomaly_data_buffer[-1000:]
+            # Queue for the background database writer (dropped if the queue is full)
+            packet_db_writer.submit((record.timestamp, src_ip, dst_ip, protocol, packet_size, interface))
+
+def append_packet_history(timestamp, src_ip, dst_ip, protocol, packet_size, src_port=None, dst_port=None, tcp_flags=None):
+    """Append a packet to the history ring buffer (caller holds stats_lock)"""
+    packet_stats['packet_history'].append(timestamp, src_ip, dst_ip, protocol, packet_size,
+                                          src_port, dst_port, tcp_flags)
+
+def merge_worker_delta(delta):
+    """Merge a counter delta from a capture worker process into packet_stats"""
+    new_sources = []
+    
+    with stats_lock:
+        packet_stats['total_packets'] += delta['packets']
+        packet_stats['total_bytes'] += delta['bytes']
+        
+        # Deltas cover the last fraction of a second, so detectors bin them at arrival time
+        now = time.time()
+        detectors = packet_stats['detectors']
+        detectors.observe('global', 'all', now, delta['packets'])
+        rates = packet_stats['rates']
+        rates.add_interface(delta.get('iface', 'default'), delta['packets'], delta['bytes'])
+        for protocol, count in delta['protocols'].items():
+            packet_stats['protocols'][protocol] += count
+            detectors.observe('protocol', protocol, now, count)
+        
+        heavy_hitters = packet_stats['heavy_hitters']
+        for ip, (sent, received, total_bytes) in delta['ips'].items():
+            packet_stats['ips'].add(ip, sent, received, total_bytes)
+            packet_stats['prefixes'].add(ip, sent + received, total_bytes)
+            packet_stats['geo'].add(ip, sent + received, total_bytes)
+            heavy_hitters.add_ip(ip, sent + received, total_bytes)
+            rates.add_ip(ip, sent + received, total_bytes)
+            if sent:
+                detectors.observe('ip', ip, now, sent)
+                new_sources.append(ip)
+        
+        flows = packet_stats['flows']
+        ports = packet_stats['ports']
+        distinct = packet_stats['distinct']
+        geoip_data = packet_stats['geoip_data']
+        for key, counters in delta.get('flows', {}).items():
+            flows.merge(key, *counters)
             
-            # Store in database for historical data
-            try:
-                conn = sqlite3.connect('nta_data.db')
-                cursor = conn.cursor()
-                cursor.execute('''
-                    INSERT INTO packets (timestamp, src_ip, dst_ip, protocol, size, interface)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                ''', (time.time(), src_ip, dst_ip, protocol, packet_size, 
-                      capture_interfaces[0] if capture_interfaces else 'default'))
-                conn.commit()
-                conn.close()
-            except Exception as e:
-                print(f"Error storing packet in database: {e}")
+            # Port/protocol aggregates for both directions of the flow
+            a_ip, b_ip, protocol, a_port, b_port = key
+            a_geo = geoip_data.get(a_ip)
+            b_geo = geoip_data.get(b_ip)
+            a_country = a_geo.get('country') if a_geo else None
+            b_country = b_geo.get('country') if b_geo else None
+            last_seen = counters[1]
+            fwd_packets, fwd_bytes, rev_packets, rev_bytes = counters[2:6]
+            rates.add_protocol(protocol, fwd_packets + rev_packets, fwd_bytes + rev_bytes)
+            if fwd_packets:
+                ports.add(protocol, fwd_bytes, a_port, b_port, a_country, b_country, fwd_packets)
+                distinct.add_packet(last_seen, a_ip, b_ip, b_port, a_geo, b_geo)
+                if b_port:
+                    heavy_hitters.add('dst_ports', b_port, fwd_packets, fwd_bytes)
+                    detectors.observe('port', b_port, now, fwd_packets)
+            if rev_packets:
+                ports.add(protocol, rev_bytes, b_port, a_port, b_country, a_country, rev_packets)
+                distinct.add_packet(last_seen, b_ip, a_ip, a_port, b_geo, a_geo)
+                if a_port:
+                    heavy_hitters.add('dst_ports', a_port, rev_packets, rev_bytes)
+                    detectors.observe('port', a_port, now, rev_packets)
+        
+        # Workers only ship a sample of recent packets for the history buffers
+        for timestamp, src_ip, dst_ip, protocol, packet_size, src_port, dst_port, tcp_flags in delta['recent']:
+            append_packet_history(timestamp, src_ip, dst_ip, protocol, packet_size, src_port, dst_port, tcp_flags)
+    
+    # Enrich source IPs seen in this delta
+    for src_ip in new_sources:
+        if THREAT_INTEL_CONFIG['enabled'] and not is_threat_intel_cached(src_ip):
+            threat_enricher.submit(src_ip)
+        if geoip_lookup_available():
+            get_geoip_info(src_ip)
 
 def detect_anomalies_with_ai():
     """Detect anomalies using AI model"""
-    global anomaly_detector, anomaly_scaler, anomaly_data_buffer, packet_stats
+    global anomaly_detector, anomaly_scaler, packet_stats
+    
+    if ANOMALY_MODEL_MODE == 'trained':
+        return score_new_packets()
     
-    if not anomaly_detection_enabled or not SKLEARN_AVAILABLE or anomaly_detector is None or anomaly_scaler is None or len(anomaly_data_buffer) < 10:
+    history = packet_stats['packet_history']
+    if not anomaly_detection_enabled or not SKLEARN_AVAILABLE or anomaly_detector is None or anomaly_scaler is None or len(history) < 10:
         return []
     
     try:
-        # Convert buffer to numpy array
-        data = np.array(anomaly_data_buffer[-100:])  # Use last 100 packets
+        # Copy the last 100 packets out of the ring so capture can keep writing
+        with stats_lock:
+            rows = history.last(100).copy()
+        
+        # Feature columns straight from the structured array
+        data = np.column_stack((rows['size'], rows['protocol'], rows['timestamp'])).astype(np.float64)
         
         # Scale the data
         scaled_data = anomaly_scaler.fit_transform(data)
@@ -747,49 +1114,96 @@ def detect_anomalies_with_ai():
         # Predict anomalies
         predictions = anomaly_detector.fit_predict(scaled_data)
         
-        # Find anomalous packets
+        # Find anomalous packets (dicts are only built for the flagged rows)
         anomalies = []
-        for i, pred in enumerate(predictions):
-            if pred == -1:  # Anomaly detected
-                packet_idx = len(anomaly_data_buffer) - len(predictions) + i
-                if packet_idx >= 0 and packet_idx < len(packet_stats['packet_history']):
-                    packet = packet_stats['packet_history'][packet_idx]
-                    anomalies.append({
-                        'type': 'AI_ANOMALY',
-                        'message': f'Anomalous traffic detected from {packet.get("src", "Unknown")} to {packet.get("dst", "Unknown")}',
-                        'severity': 'WARNING',
-                        'timestamp': packet.get('timestamp', time.time()),
-                        'packet_info': packet
-                    })
+        for i in np.flatnonzero(predictions == -1):
+            row = rows[i]
+            packet = {
+                'timestamp': float(row['timestamp']),
+                'src': row['src'].decode(),
+                'dst': row['dst'].decode(),
+                'protocol': int(row['protocol']),
+                'size': int(row['size'])
+            }
+            anomalies.append({
+                'type': 'AI_ANOMALY',
+                'message': f'Anomalous traffic detected from {packet["src"]} to {packet["dst"]}',
+                'severity': 'WARNING',
+                'timestamp': packet['timestamp'],
+                'packet_info': packet
+            })
         
         return anomalies
     except Exception as e:
         print(f"Error in AI anomaly detection: {e}")
         return []
 
-def detect_simple_anomalies():
-    """Simple anomaly detection based on traffic patterns"""
-    anomalies = []
+def score_new_packets():
+    """Score packets added since the last tick with the current trained model"""
+    global anomaly_scored_sequence
+    
+    # One reference read: a model swapped in meanwhile is used from the next tick
+    model = anomaly_trainer.model if anomaly_trainer else None
+    if not anomaly_detection_enabled or model is None:
+        return []
     
+    try:
+        # Copy the unscored rows, plus the one before them for its inter-arrival time
+        with stats_lock:
+            history = packet_stats['packet_history']
+            start = max(anomaly_scored_sequence, history.total - ANOMALY_SCORE_BATCH_SIZE)
+            context = 1 if 0 < start and history.total - start < len(history) else 0
+            rows = history.last(history.total - start + context).copy()
+            anomaly_scored_sequence = history.total
+        
+        features = history_features(rows)[context:]
+        rows = rows[context:]
+        if len(rows) == 0:
+            return []
+        scores = model.score(features)
+        
+        # Most anomalous first (dicts are only built for the flagged rows)
+        flagged = np.flatnonzero(scores < 0)
+        flagged = flagged[np.argsort(scores[flagged], kind='stable')[:MAX_AI_ANOMALIES_PER_TICK]]
+        anomalies = []
+        for i in flagged.tolist():
+            row = rows[i]
+            packet = {
+                'timestamp': float(row['timestamp']),
+                'src': row['src'].decode(),
+                'dst': row['dst'].decode(),
+                'protocol': int(row['protocol']),
+                'size': int(row['size'])
+            }
+            anomalies.append({
+                'type': 'AI_ANOMALY',
+                'message': f'Anomalous traffic detected from {packet["src"]} to {packet["dst"]}',
+                'severity': 'WARNING',
+                'timestamp': packet['timestamp'],
+                'score': float(scores[i]),
+                'model_version': model.version,
+                'packet_info': packet
+            })
+        
+        return anomalies
+    except Exception as e:
+        print(f"Error in AI anomaly scoring: {e}")
+        return []
+
+def detect_simple_anomalies():
+    """Collect streaming detector alerts and suspicious IPs with new traffic"""
     with stats_lock:
-        # Check for high traffic rate
-        if len(packet_stats['packet_history']) >= 2:
-            recent_packets = packet_stats['packet_history'][-10:]  # Last 10 packets
-            if len(recent_packets) >= 2:
-                time_diff = recent_packets[-1]['timestamp'] - recent_packets[0]['timestamp']
-                if time_diff > 0:
-                    pps = len(recent_packets) / time_diff
-                    if pps > alerts_config['high_traffic_threshold']:
-                        anomalies.append({
-                            'type': 'HIGH_TRAFFIC',
-                            'message': f'High traffic detected: {pps:.2f} packets/second',
-                            'severity': 'WARNING',
-                            'timestamp': time.time()
-                        })
-        
-        # Check for suspicious IPs
+        # Rate spikes, level shifts and high traffic, raised as packets arrive
+        anomalies = packet_stats['detectors'].drain()
+        
+        # Suspicious IPs are reported again only once they have sent or received more packets
         for ip in alerts_config['suspicious_ips']:
-            if ip in packet_stats['ips']:
+            ip_stats = packet_stats['ips'].get(ip)
+            if ip_stats is None:
+                continue
+            packets = ip_stats['sent'] + ip_stats['received']
+            if packets > suspicious_ip_alerts.get(ip, 0):
+                suspicious_ip_alerts[ip] = packets
                 anomalies.append({
                     'type': 'SUSPICIOUS_IP',
                     'message': f'Suspicious IP activity detected: {ip}',
@@ -802,15 +1216,22 @@ def detect_simple_anomalies():
 def periodic_stats_update():
     """Periodically send updated statistics to clients"""
     last_packet_count = 0
-    last_time = time.time()
     
     while capture_running:
         update_top_talkers()
         
+        # Expire idle flows even when no packets arrive, and fold new traffic into the prefix tries
+        with stats_lock:
+            packet_stats['flows'].advance_clock(time.time())
+            packet_stats['prefixes'].flush()
+        
         # Detect anomalies
         simple_anomalies = detect_simple_anomalies()
         ai_anomalies = detect_anomalies_with_ai() if SKLEARN_AVAILABLE else []
-        all_anomalies = simple_anomalies + ai_anomalies
+        with stats_lock:
+            threat_anomalies = pending_threat_anomalies[:]
+            del pending_threat_anomalies[:]
+        all_anomalies = simple_anomalies + ai_anomalies + threat_anomalies
         
         # Update anomalies in packet_stats
         with stats_lock:
@@ -835,22 +1256,17 @@ def periodic_stats_update():
             except Exception as e:
                 print(f"Error handling alerts: {e}")
         
-        # Store statistics in database every 10 seconds
-        current_time = time.time()
-        if current_time - last_time >= 10:
-            store_statistics()
-            last_time = current_time
-        
         with stats_lock:
             # Create a copy of stats to send
             stats_copy = {
                 'total_packets': packet_stats['total_packets'],
                 'total_bytes': packet_stats['total_bytes'],
                 'protocols': dict(packet_stats['protocols']),
-                'ips': dict(list(packet_stats['ips'].items())[:50]),  # Limit to 50 IPs
+                'ips': dict(islice(packet_stats['ips'].items(), 50)),  # Limit to 50 IPs
                 'top_talkers': packet_stats['top_talkers'],  # This is now in the correct format
-                'packet_history': packet_stats['packet_history'][-50:],  # Last 50 packets
-                'anomalies': packet_stats['anomalies'][-20:]  # Last 20 anomalies
+                'packet_history': packet_stats['packet_history'].to_dicts(50),  # Last 50 packets
+                'anomalies': packet_stats['anomalies'][-20:],  # Last 20 anomalies
+                'rates': packet_stats['rates'].get_rates()  # pps/bps over 1s/10s/1m/5m/1h windows
             }
         
         # Emit stats to all connected clients
@@ -858,43 +1274,114 @@ def periodic_stats_update():
         time.sleep(2)  # Update every 2 seconds
 
 def update_top_talkers():
-    """Calculate and update top talkers based on byte count"""
+    """Update top talkers by byte count from the heavy-hitter summary"""
     with stats_lock:
-        # Sort IPs by total bytes
-        sorted_ips = sorted(
-            packet_stats['ips'].items(), 
-            key=lambda x: x[1]['bytes'], 
-            reverse=True
-        )
-        # Get top 10 talkers
-        packet_stats['top_talkers'] = sorted_ips[:10]
+        # Only the summary's leaders are ranked, not every IP seen
+        ips = packet_stats['ips']
+        top_talkers = []
+        for ip, _, _ in packet_stats['heavy_hitters'].top('ips', 10):
+            ip_stats = ips.get(ip)
+            if ip_stats:
+                top_talkers.append((ip, ip_stats))
+        packet_stats['top_talkers'] = top_talkers
+        packet_stats['rates'].track_ips([ip for ip, _ in top_talkers])
+
+def bpf_filter_supported(expression, interfaces):
+    """Check that libpcap can compile the expression for every capture interface"""
+    try:
+        from scapy.arch.common import compile_filter
+        for iface in (interfaces or [None]):
+            compile_filter(expression, iface=iface)
+        return True
+    except Exception as e:
+        print(f"Cannot apply BPF filter '{expression}', falling back to Python filtering: {e}")
+        return False
 
-def store_statistics():
-    """Store current statistics in database"""
-    with stats_lock:
+def start_sniffers(interfaces):
+    """Start the capture engine on the interfaces (the default interface if none are given)"""
+    global active_sniffers
+    
+    expression = bpf_filter_state['expression']
+    if capture_engine == 'raw' and capture_pcap_file:
+        expression = None  # Offline files are filtered in Python
+    elif expression and not bpf_filter_supported(expression, interfaces):
+        expression = None
+    
+    sniffers = []
+    if capture_mode == 'multiprocess':
+        # Worker processes capture and count locally; deltas are merged by merge_worker_delta
+        sniffers.append(CaptureWorkerPool(
+            interfaces, merge_worker_delta,
+            engine=capture_engine,
+            workers_per_interface=capture_workers_per_interface,
+            bpf_expression=expression,
+            filters=packet_filters,
+            kernel_filters=bpf_filter_state['kernel_filters'] if expression else [],
+            partition_dir=packet_partitions.directory,
+            partition_granularity=packet_partitions.granularity
+        ))
+    elif capture_engine == 'raw' and capture_pcap_file:
+        # Raw engine reading frames from a pcap/pcapng file
+        sniffers.append(RawSniffer(handle_packet_record, offline=capture_pcap_file))
+    elif capture_engine == 'raw':
+        # Raw engine decoding AF_PACKET frames without scapy dissection
+        sniffers = [RawSniffer(lambda record, iface=iface: handle_packet_record(record, iface or 'default'),
+                               iface=iface, filter=expression)
+                    for iface in (interfaces or [None])]
+    else:
+        sniffers = [AsyncSniffer(iface=iface, prn=lambda packet, iface=iface: packet_handler(packet, iface or 'default'),
+                                 store=0, filter=expression)
+                    for iface in (interfaces or [None])]
+    for sniffer in sniffers:
+        sniffer.start()
+    
+    bpf_filter_state['active_expression'] = expression
+    bpf_filter_state['active_kernel_filters'] = list(bpf_filter_state['kernel_filters']) if expression else []
+    active_sniffers = sniffers
+
+def stop_sniffer_list(sniffers):
+    """Stop a list of sniffers, ignoring ones that never started"""
+    for sniffer in sniffers:
         try:
-            conn = sqlite3.connect('nta_data.db')
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO statistics (timestamp, total_packets, total_bytes, protocols, top_talkers)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (
-                time.time(),
-                packet_stats['total_packets'],
-                packet_stats['total_bytes'],
-                json.dumps(dict(packet_stats['protocols'])),
-                json.dumps(packet_stats['top_talkers'])
-            ))
-            conn.commit()
-            conn.close()
+            if sniffer.running:
+                sniffer.stop()
         except Exception as e:
-            print(f"Error storing statistics in database: {e}")
+            print(f"Error stopping sniffer: {e}")
+
+def stop_sniffers():
+    """Stop all running sniffers"""
+    global active_sniffers
+    
+    with sniffer_lock:
+        stop_sniffer_list(active_sniffers)
+        active_sniffers = []
+        bpf_filter_state['active_expression'] = None
+        bpf_filter_state['active_kernel_filters'] = []
+
+def get_capture_worker_stats():
+    """Get per-worker rates when capturing in multiprocess mode"""
+    worker_stats = []
+    for sniffer in list(active_sniffers):
+        if isinstance(sniffer, CaptureWorkerPool):
+            worker_stats.extend(sniffer.get_worker_stats())
+    return worker_stats
+
+def restart_sniffers():
+    """Restart the sniffers so they pick up the current BPF expression"""
+    with sniffer_lock:
+        if not active_sniffers:
+            return
+        stop_sniffer_list(active_sniffers)
+        try:
+            start_sniffers(capture_interfaces)
+        except Exception as e:
+            print(f"Error restarting packet capture: {e}")
 
 def start_packet_capture(interfaces=None):
     """Start packet capture on specified interface(s)"""
     global capture_running, capture_thread, capture_interfaces
     
-    if not SCAPY_AVAILABLE or sniff is None:
+    if capture_engine == 'scapy' and (not SCAPY_AVAILABLE or AsyncSniffer is None):
         print("Scapy not available, cannot start packet capture")
         return
     
@@ -906,30 +1393,19 @@ def start_packet_capture(interfaces=None):
     stats_thread.daemon = True
     stats_thread.start()
     
-    # Start packet capture
+    # Start packet capture (multi-interface capture uses one sniffer per interface)
     try:
-        if interfaces and len(interfaces) > 0:
-            # Multi-interface capture
-            from scapy.all import AsyncSniffer
-            sniffers = []
-            for interface in interfaces:
-                sniffer = AsyncSniffer(
-                    iface=interface,
-                    prn=packet_handler,
-                    store=0
-                )
-                sniffer.start()
-                sniffers.append(sniffer)
-            
-            # Wait for all sniffers
-            for sniffer in sniffers:
-                sniffer.join()
-        else:
-            # Single interface capture (default)
-            sniff(prn=packet_handler, store=0)
+        with sniffer_lock:
+            start_sniffers(capture_interfaces)
+        
+        # Sniffers run in their own threads; wait here until capture is stopped
+        while capture_running:
+            time.sleep(0.5)
     except Exception as e:
         print(f"Error starting packet capture: {e}")
         capture_running = False
+    finally:
+        stop_sniffers()
 
 # Check if frontend build exists, if so, serve it
 frontend_build_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'frontend', 'dist'))
@@ -1015,7 +1491,10 @@ def set_filters():
     packet_filters.update(data)
     packet_filters['enabled'] = True
     
-    return jsonify({'status': 'success', 'message': 'Filters updated', 'filters': packet_filters})
+    # Push what we can into the kernel as a BPF expression
+    bpf_status = update_bpf_filter()
+    
+    return jsonify({'status': 'success', 'message': 'Filters updated', 'filters': packet_filters, 'bpf': bpf_status})
 
 @app.route('/api/disable_filters', methods=['POST'])
 def disable_filters():
@@ -1023,13 +1502,14 @@ def disable_filters():
     global packet_filters
     
     packet_filters['enabled'] = False
+    update_bpf_filter()
     
     return jsonify({'status': 'success', 'message': 'Filters disabled'})
 
 @app.route('/api/get_filters', methods=['GET'])
 def get_filters():
     """API endpoint to get current filter settings"""
-    return jsonify({'status': 'success', 'filters': packet_filters})
+    return jsonify({'status': 'success', 'filters': packet_filters, 'bpf': get_bpf_filter_status()})
 
 @app.route('/api/set_alerts_config', methods=['POST'])
 def set_alerts_config():
@@ -1040,6 +1520,19 @@ def set_alerts_config():
     if not data:
         return jsonify({'status': 'error', 'message': 'No alert configuration provided'})
     
+    # Streaming detector parameters: {param: value} for every scope and/or {scope: {param: value}}
+    settings = dict(data.pop('detectors', None) or {})
+    if 'high_traffic_threshold' in data:
+        global_settings = dict(settings.get('global') or {})
+        global_settings['max_rate'] = data['high_traffic_threshold']
+        settings['global'] = global_settings
+    try:
+        with stats_lock:
+            packet_stats['detectors'].configure(settings)
+            alerts_config['detectors'] = packet_stats['detectors'].get_config()
+    except (TypeError, ValueError) as e:
+        return jsonify({'status': 'error', 'message': f'Invalid detector configuration: {str(e)}'})
+    
     # Update alerts config
     alerts_config.update(data)
     
@@ -1054,18 +1547,11 @@ def get_alerts_config():
 def get_historical_data():
     """API endpoint to get historical packet data"""
     try:
-        conn = sqlite3.connect('nta_data.db')
-        cursor = conn.cursor()
-        
-        # Get packets from last 24 hours
-        twenty_four_hours_ago = time.time() - (24 * 60 * 60)
-        cursor.execute('''
-            SELECT timestamp, src_ip, dst_ip, protocol, size FROM packets
-            WHERE timestamp > ? ORDER BY timestamp DESC LIMIT 1000
-        ''', (twenty_four_hours_ago,))
-        
-        packets = cursor.fetchall()
-        conn.close()
+        # Last 24 hours by default; only the partitions overlapping the range are read
+        end = float(request.args.get('end', time.time()))
+        start = float(request.args.get('start', end - 24 * 60 * 60))
+        limit = min(int(request.args.get('limit', 1000)), 100000)
+        packets = packet_partitions.fetch(start, end, limit, ('timestamp', 'src_ip', 'dst_ip', 'protocol', 'size'))
         
         # Format packets for JSON response
         packet_list = []
@@ -1086,34 +1572,47 @@ def get_historical_data():
 def get_statistics_history():
     """API endpoint to get historical statistics"""
     try:
-        conn = sqlite3.connect('nta_data.db')
-        cursor = conn.cursor()
-        
-        # Get statistics from last 24 hours
-        twenty_four_hours_ago = time.time() - (24 * 60 * 60)
-        cursor.execute('''
-            SELECT timestamp, total_packets, total_bytes, protocols, top_talkers FROM statistics
-            WHERE timestamp > ? ORDER BY timestamp DESC LIMIT 100
-        ''', (twenty_four_hours_ago,))
-        
-        stats = cursor.fetchall()
-        conn.close()
+        # Last 24 hours in up to 100 intervals, newest first; totals are per interval
+        now = time.time()
+        resolution, step, rows = rollup_store.query(now - 24 * 60 * 60, now, max_points=100)
         
-        # Format statistics for JSON response
         stats_list = []
-        for stat in stats:
+        for row in reversed(rows):
+            protocols = {number: row[f'{name}_packets'] for number, name in PROTOCOL_COLUMNS.items()
+                         if row[f'{name}_packets']}
+            if row['other_packets']:
+                protocols['other'] = row['other_packets']
             stats_list.append({
-                'timestamp': stat[0],
-                'total_packets': stat[1],
-                'total_bytes': stat[2],
-                'protocols': json.loads(stat[3]) if stat[3] else {},
-                'top_talkers': json.loads(stat[4]) if stat[4] else []
+                'timestamp': row['timestamp'],
+                'interval': step,
+                'total_packets': row['packets'],
+                'total_bytes': row['bytes'],
+                'protocols': protocols
             })
         
         return jsonify({'status': 'success', 'statistics': stats_list})
     except Exception as e:
         return jsonify({'status': 'error', 'message': f'Error retrieving statistics history: {str(e)}'})
 
+@app.route('/api/timeseries', methods=['GET'])
+def get_timeseries():
+    """API endpoint to get traffic deltas over a time range at the resolution it needs"""
+    try:
+        end = float(request.args.get('end', time.time()))
+        start = float(request.args.get('start', end - 3600))
+        max_points = min(int(request.args.get('points', 500)), 10000)
+        resolution = request.args.get('resolution')
+        resolution = {'1s': 1, '1m': 60, '1h': 3600}.get(resolution, resolution)
+        if start >= end:
+            return jsonify({'status': 'error', 'message': 'start must be before end'})
+        
+        resolution, step, rows = rollup_store.query(start, end, max_points, int(resolution) if resolution else None)
+        return jsonify({'status': 'success', 'resolution': resolution, 'step': step, 'points': rows})
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': f'Invalid time series query: {str(e)}'})
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': f'Error retrieving time series: {str(e)}'})
+
 @app.route('/api/get_alerts', methods=['GET'])
 def get_alerts():
     """API endpoint to get recent alerts"""
@@ -1148,7 +1647,8 @@ def get_alerts():
 @app.route('/api/start_capture', methods=['POST'])
 def start_capture():
     """API endpoint to start packet capture"""
-    global capture_thread, capture_running, current_session, session_packets
+    global capture_thread, capture_running, current_session, session_packets, capture_engine, capture_pcap_file
+    global capture_mode, capture_workers_per_interface
     
     print(f"DEBUG: start_capture called. Current capture_running state: {capture_running}")
     
@@ -1156,6 +1656,45 @@ def start_capture():
     interfaces = data.get('interfaces', None)  # Support for multiple interfaces
     interface = data.get('interface', None)  # Backward compatibility
     session_name = data.get('session_name', f'NTA-Session-{int(time.time())}')
+    engine = data.get('engine', 'scapy')
+    pcap_file = data.get('pcap_file', None)  # Raw engine only
+    try:
+        snaplen = int(data.get('snaplen', SESSION_SNAPLEN))
+    except (TypeError, ValueError):
+        return jsonify({'status': 'error', 'message': 'snaplen must be an integer'})
+    if snaplen <= 0:
+        return jsonify({'status': 'error', 'message': 'snaplen must be positive'})
+    session_compression = data.get('session_compression', SESSION_COMPRESSION) or None
+    if session_compression not in (None, 'gzip', 'zstd'):
+        return jsonify({'status': 'error', 'message': f'Unknown session compression: {session_compression}'})
+    
+    if engine not in ('scapy', 'raw'):
+        return jsonify({'status': 'error', 'message': f'Unknown capture engine: {engine}'})
+    if pcap_file and engine != 'raw':
+        return jsonify({'status': 'error', 'message': 'pcap_file requires the raw capture engine'})
+    if pcap_file:
+        path = resolve_capture_file(pcap_file)
+        if not path:
+            return jsonify({'status': 'error', 'message': f'pcap file not found in {REPLAY_DIR}: {pcap_file}'})
+        pcap_file = path
+    
+    mode = data.get('mode', 'threaded')
+    try:
+        workers_per_interface = int(data.get('workers_per_interface', 1))
+    except (TypeError, ValueError):
+        return jsonify({'status': 'error', 'message': 'workers_per_interface must be an integer'})
+    
+    if mode not in ('threaded', 'multiprocess'):
+        return jsonify({'status': 'error', 'message': f'Unknown capture mode: {mode}'})
+    if mode == 'multiprocess' and worker_launcher is None:
+        return jsonify({'status': 'error', 'message': 'Multiprocess capture is disabled (NTA_CAPTURE_WORKERS=0) or needs the fork start method'})
+    if mode == 'multiprocess' and pcap_file:
+        return jsonify({'status': 'error', 'message': 'pcap_file is not supported in multiprocess mode'})
+    if workers_per_interface > 1 and (mode != 'multiprocess' or engine != 'raw'):
+        return jsonify({'status': 'error', 'message': 'workers_per_interface > 1 requires multiprocess mode with the raw engine'})
+    
+    if active_replay and active_replay.running:
+        return jsonify({'status': 'error', 'message': 'Stop the replay before starting a capture'})
     
     # If capture is already running, automatically stop it first
     if capture_running:
@@ -1168,15 +1707,26 @@ def start_capture():
         
         # Reset session data
         current_session = None
-        session_packets = []
     
     # Initialize new session
     current_session = {
         'name': session_name,
         'start_time': time.time(),
-        'packets': []
+        'snaplen': snaplen
     }
-    session_packets = []
+    session_file = None
+    if mode != 'multiprocess':  # Worker processes only send counter deltas, not packets
+        new_session_store(snaplen)
+        try:
+            session_file = start_session_file(current_session, session_compression)
+        except Exception as e:
+            print(f"Error creating session file: {e}")
+            current_session = None
+            return jsonify({'status': 'error', 'message': f'Error creating session file: {str(e)}'})
+    else:
+        stop_session_file()
+    current_session['session_file'] = session_file
+    current_session['recording'] = mode != 'multiprocess'
     
     # Handle both single interface and multiple interfaces
     capture_interfaces = []
@@ -1185,6 +1735,11 @@ def start_capture():
     elif interface:
         capture_interfaces = [interface]
     
+    capture_engine = engine
+    capture_pcap_file = pcap_file
+    capture_mode = mode
+    capture_workers_per_interface = max(1, workers_per_interface)
+    
     # Start capture in a separate thread
     capture_thread = threading.Thread(target=start_packet_capture, args=(capture_interfaces,))
     capture_thread.daemon = True
@@ -1194,7 +1749,11 @@ def start_capture():
     capture_running = True
     print(f"DEBUG: Capture started. New capture_running state: {capture_running}")
     
-    return jsonify({'status': 'success', 'message': 'Packet capture started', 'session_name': session_name})
+    response = {'status': 'success', 'message': 'Packet capture started', 'session_name': session_name,
+                'engine': engine, 'mode': mode, 'session_file': current_session['session_file']}
+    if not current_session['recording']:
+        response['note'] = 'Session recording is not available in multiprocess mode'
+    return jsonify(response)
 
 @app.route('/api/stop_capture', methods=['POST'])
 def stop_capture():
@@ -1205,25 +1764,17 @@ def stop_capture():
     capture_running = False
     print(f"DEBUG: capture_running state after setting to False: {capture_running}")
     
-    # Save session data
+    # Close the session; packets are already on disk, the writer only appends the footer
     if current_session:
         current_session['end_time'] = time.time()
         current_session['duration'] = current_session['end_time'] - current_session['start_time']
-        current_session['packet_count'] = len(session_packets)
+        current_session['packet_count'] = len(session_packets) if current_session['recording'] else None
         
-        # Save session to file
-        session_filename = f"session_{current_session['name'].replace(' ', '_')}_{int(current_session['start_time'])}.json"
-        try:
-            with open(session_filename, 'w') as f:
-                json.dump({
-                    'session_info': current_session,
-                    'packets': session_packets
-                }, f, indent=2)
-            print(f"DEBUG: Session saved to {session_filename}")
-        except Exception as e:
-            print(f"Error saving session: {e}")
+        if stop_session_file({'end_time': current_session['end_time'], 'duration': current_session['duration']}):
+            print(f"DEBUG: Session saved to {current_session.get('session_file')}")
     
-    return jsonify({'status': 'success', 'message': 'Packet capture stopped'})
+    return jsonify({'status': 'success', 'message': 'Packet capture stopped',
+                    'session_file': current_session.get('session_file') if current_session else None})
 
 @app.route('/api/force_reset', methods=['POST'])
 def force_reset():
@@ -1234,7 +1785,8 @@ def force_reset():
     capture_running = False
     capture_thread = None
     current_session = None
-    session_packets = []
+    stop_session_file()
+    new_session_store()
     print(f"DEBUG: capture state after force reset: capture_running={capture_running}, capture_thread={capture_thread}")
     
     return jsonify({'status': 'success', 'message': 'Capture state force reset'})
@@ -1246,70 +1798,88 @@ def export_session():
     
     format_type = request.args.get('format', 'pcap')
     
+    if current_session and not current_session['recording']:
+        return jsonify({'status': 'error', 'message': 'Session recording is not available in multiprocess mode'})
     if not current_session or len(session_packets) == 0:
         return jsonify({'status': 'error', 'message': 'No session data available'})
     
+    name = current_session['name']
     try:
+        # Every format is streamed from the session store, so memory use does not grow with the session
         if format_type == 'csv':
-            # Export as CSV
-            output = StringIO()
-            writer = csv.writer(output)
-            
-            # Write header
-            writer.writerow(['Timestamp', 'Source IP', 'Destination IP', 'Protocol', 'Size'])
-            
-            # Write packet data
-            for packet in session_packets:
-                writer.writerow([
-                    datetime.fromtimestamp(packet['timestamp']).strftime('%Y-%m-%d %H:%M:%S'),
-                    packet['src'],
-                    packet['dst'],
-                    packet['protocol'],
-                    packet['size']
-                ])
-            
-            # Return CSV response
-            csv_data = output.getvalue()
-            output.close()
-            
             return Response(
-                csv_data,
+                session_packets.iter_csv(),
                 mimetype='text/csv',
-                headers={'Content-Disposition': f'attachment; filename={current_session["name"]}.csv'}
+                headers={'Content-Disposition': f'attachment; filename={name}.csv'}
             )
         
         elif format_type == 'json':
-            # Export as JSON
-            data = {
-                'session_info': current_session,
-                'packets': session_packets
-            }
-            
             return Response(
-                json.dumps(data, indent=2),
+                session_packets.iter_json(dict(current_session)),
                 mimetype='application/json',
-                headers={'Content-Disposition': f'attachment; filename={current_session["name"]}.json'}
+                headers={'Content-Disposition': f'attachment; filename={name}.json'}
+            )
+        
+        elif format_type == 'pcapng':
+            return Response(
+                session_packets.iter_pcapng(),
+                mimetype='application/x-pcapng',
+                headers={'Content-Disposition': f'attachment; filename={name}.pcapng'}
             )
         
         else:
-            # For PCAP, we would need to reconstruct the packets
-            # This is a simplified version - in a real implementation, you would use scapy to write actual PCAP files
-            pcap_data = "# This is a simplified PCAP export\n"
-            pcap_data += f"# Session: {current_session['name']}\n"
-            pcap_data += f"# Packets: {len(session_packets)}\n\n"
-            
-            for packet in session_packets:
-                pcap_data += f"{datetime.fromtimestamp(packet['timestamp'])} {packet['src']} -> {packet['dst']} (Protocol: {packet['protocol']}, Size: {packet['size']} bytes)\n"
-            
+            # Classic pcap holds a single link-layer type
+            if len(session_packets.linktypes) > 1:
+                return jsonify({'status': 'error', 'message': 'Session mixes link-layer types, export it as pcapng'})
             return Response(
-                pcap_data,
-                mimetype='application/octet-stream',
-                headers={'Content-Disposition': f'attachment; filename={current_session["name"]}.txt'}
+                session_packets.iter_pcap(),
+                mimetype='application/vnd.tcpdump.pcap',
+                headers={'Content-Disposition': f'attachment; filename={name}.pcap'}
             )
     
     except Exception as e:
         return jsonify({'status': 'error', 'message': f'Error exporting session: {str(e)}'})
 
+@app.route('/api/replay', methods=['POST'])
+def start_replay():
+    """API endpoint to replay a pcap/pcapng or saved session file through the packet pipeline"""
+    global active_replay
+    
+    data = request.get_json() or {}
+    name = data.get('file')
+    path = resolve_capture_file(name)
+    if not path:
+        return jsonify({'status': 'error', 'message': f'Replay file not found in {REPLAY_DIR}: {name}'})
+    try:
+        speed = float(data.get('speed', 0) or 0)
+        limit = int(data['limit']) if data.get('limit') else None
+    except (TypeError, ValueError):
+        return jsonify({'status': 'error', 'message': 'speed must be a number and limit an integer'})
+    if speed < 0:
+        return jsonify({'status': 'error', 'message': 'speed must be 0 (maximum) or positive'})
+    if active_replay and active_replay.running:
+        return jsonify({'status': 'error', 'message': 'A replay is already running'})
+    if capture_running:
+        # Live and replayed packets would share the flow table and detectors with two different clocks
+        return jsonify({'status': 'error', 'message': 'Stop the packet capture before starting a replay'})
+    
+    active_replay = PacketReplayer(path, handle_packet_record, speed, limit)
+    active_replay.start()
+    return jsonify({'status': 'success', 'message': 'Replay started', 'replay': active_replay.get_stats()})
+
+@app.route('/api/replay', methods=['GET'])
+def get_replay_status():
+    """API endpoint to get replay progress and ingest rate"""
+    return jsonify({'status': 'success', 'replay': active_replay.get_stats() if active_replay else None})
+
+@app.route('/api/stop_replay', methods=['POST'])
+def stop_replay():
+    """API endpoint to stop a running replay"""
+    if not active_replay or not active_replay.running:
+        return jsonify({'status': 'error', 'message': 'No replay running'})
+    active_replay.stop()
+    return jsonify({'status': 'success', 'message': 'Replay stopped', 'replay': active_replay.get_stats()})
+
 @app.route('/api/stats')
 def get_stats():
     """API endpoint to get current statistics"""
@@ -1319,12 +1889,164 @@ def get_stats():
             'total_packets': packet_stats['total_packets'],
             'total_bytes': packet_stats['total_bytes'],
             'protocols': dict(packet_stats['protocols']),
-            'ips': dict(list(packet_stats['ips'].items())[:50]),
+            'ips': dict(islice(packet_stats['ips'].items(), 50)),
             'top_talkers': packet_stats['top_talkers'],
-            'packet_history': packet_stats['packet_history'][-50:]
+            'packet_history': packet_stats['packet_history'].to_dicts(50),
+            'rates': packet_stats['rates'].get_rates()
         }
+    stats_copy['db_writer'] = packet_db_writer.get_stats()
+    with stats_lock:
+        stats_copy['flow_table'] = packet_stats['flows'].get_stats()
+        stats_copy['ip_table'] = packet_stats['ips'].get_stats()
+        stats_copy['prefix_index'] = packet_stats['prefixes'].get_stats()
+    stats_copy['rollups'] = rollup_store.get_stats()
+    stats_copy['ip_spill_writer'] = ip_spill_writer.get_stats() if IP_SPILL_ENABLED else None
+    writer = session_file_writer
+    stats_copy['session_file'] = writer.get_stats() if writer else None
+    stats_copy['capture_mode'] = capture_mode
+    stats_copy['workers'] = get_capture_worker_stats()
     return jsonify(stats_copy)
 
+@app.route('/api/flows', methods=['GET'])
+def get_flows():
+    """API endpoint to list active (or recently finished) flows"""
+    state = request.args.get('state', 'active')
+    ip = request.args.get('ip')
+    try:
+        limit = int(request.args.get('limit', 100))
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'limit must be an integer'})
+    if state not in ('active', 'expired'):
+        return jsonify({'status': 'error', 'message': f'Unknown flow state: {state}'})
+    
+    with stats_lock:
+        flow_table = packet_stats['flows']
+        if state == 'active':
+            flows = flow_table.active_flows(limit, ip)
+        else:
+            flows = flow_table.expired_flows(limit, ip)
+        stats = flow_table.get_stats()
+    
+    return jsonify({'status': 'success', 'state': state, 'flows': flows, 'stats': stats})
+
+@app.route('/api/top_flows', methods=['GET'])
+def get_top_flows():
+    """API endpoint to get the largest active flows by bytes, packets or duration"""
+    by = request.args.get('by', 'bytes')
+    try:
+        n = int(request.args.get('n', 10))
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'n must be an integer'})
+    if by not in ('bytes', 'packets', 'duration'):
+        return jsonify({'status': 'error', 'message': f'Unknown sort key: {by}'})
+    
+    with stats_lock:
+        flows = packet_stats['flows'].top_flows(n, by)
+    
+    return jsonify({'status': 'success', 'by': by, 'top_flows': flows})
+
+@app.route('/api/ip_stats', methods=['GET'])
+def get_ip_stats():
+    """API endpoint to get an IP's counters, including those spilled to the database when it was evicted"""
+    ip = request.args.get('ip')
+    if not ip:
+        return jsonify({'status': 'error', 'message': 'ip is required'})
+    
+    with stats_lock:
+        ip_stats = packet_stats['ips'].get(ip)
+        ip_stats = dict(ip_stats) if ip_stats else None
+    
+    spilled = None
+    try:
+        conn = sqlite3.connect('nta_data.db')
+        row = conn.execute('SELECT sent, received, bytes, last_evicted FROM ip_stats_spill WHERE ip = ?', (ip,)).fetchone()
+        conn.close()
+        if row:
+            spilled = {'sent': row[0], 'received': row[1], 'bytes': row[2], 'last_evicted': row[3]}
+    except Exception as e:
+        print(f"Error reading spilled IP stats: {e}")
+    
+    total = {key: (ip_stats or {}).get(key, 0) + (spilled or {}).get(key, 0) for key in ('sent', 'received', 'bytes')}
+    return jsonify({'status': 'success', 'ip': ip, 'in_memory': ip_stats, 'spilled': spilled, 'total': total,
+                    'ip_table': packet_stats['ips'].get_stats()})
+
+@app.route('/api/heavy_hitters', methods=['GET'])
+def get_heavy_hitters():
+    """API endpoint to get the top IPs, destination ports or subnets by bytes or packets"""
+    dimension = request.args.get('dimension', 'ips')
+    by = request.args.get('by', 'bytes')
+    try:
+        n = int(request.args.get('n', 10))
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'n must be an integer'})
+    if dimension not in ('ips', 'dst_ports', 'subnets'):
+        return jsonify({'status': 'error', 'message': f'Unknown dimension: {dimension}'})
+    if by not in ('bytes', 'packets'):
+        return jsonify({'status': 'error', 'message': f'Unknown sort key: {by}'})
+    
+    with stats_lock:
+        heavy_hitters = packet_stats['heavy_hitters']
+        top = heavy_hitters.top(dimension, n, by)
+        summary = heavy_hitters.get_stats()[f'{dimension}_{by}']
+    
+    # Each estimate overcounts by at most its error
+    entries = [{'key': key, by: count, 'error': error, 'guaranteed': count - error} for key, count, error in top]
+    return jsonify({'status': 'success', 'dimension': dimension, 'by': by, 'heavy_hitters': entries, 'summary': summary})
+
+@app.route('/api/distinct_counts', methods=['GET'])
+def get_distinct_counts():
+    """API endpoint to get distinct IP counts overall, for one key, or over a recent time window"""
+    family = request.args.get('family')
+    key = request.args.get('key')
+    dst_port = request.args.get('dst_port')
+    try:
+        window = int(request.args.get('window', 60))
+        dst_port = int(dst_port) if dst_port else None
+        if family == 'dst_port' and key is not None:
+            key = int(key)
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'window, dst_port and port keys must be integers'})
+    if family and family not in ('subnet', 'network', 'country', 'asn', 'dst_port'):
+        return jsonify({'status': 'error', 'message': f'Unknown family: {family}'})
+    
+    with stats_lock:
+        distinct = packet_stats['distinct']
+        if family:
+            if key is None:
+                return jsonify({'status': 'error', 'message': 'key is required with family'})
+            return jsonify({'status': 'success', 'family': family, 'key': key, 'distinct': distinct.distinct(family, key)})
+        counts = distinct.window(window, dst_port)
+        totals = distinct.get_stats()
+    
+    return jsonify({'status': 'success', 'window': window, 'dst_port': dst_port, 'counts': counts, 'totals': totals})
+
+@app.route('/api/anomaly_model', methods=['GET'])
+def get_anomaly_model():
+    """API endpoint to get the current anomaly model version and training counters"""
+    if anomaly_trainer is None:
+        return jsonify({'status': 'error', 'message': f'Trained anomaly model not in use (mode: {ANOMALY_MODEL_MODE})'})
+    return jsonify({'status': 'success', 'mode': ANOMALY_MODEL_MODE, 'trainer': anomaly_trainer.get_stats()})
+
+@app.route('/api/anomaly_model/retrain', methods=['POST'])
+def retrain_anomaly_model():
+    """API endpoint to train a new anomaly model now (in the background)"""
+    if anomaly_trainer is None:
+        return jsonify({'status': 'error', 'message': f'Trained anomaly model not in use (mode: {ANOMALY_MODEL_MODE})'})
+    anomaly_trainer.retrain()
+    return jsonify({'status': 'success', 'message': 'Anomaly model retraining started'})
+
+@app.route('/api/db_writer_stats', methods=['GET'])
+def get_db_writer_stats():
+    """API endpoint to get database writer counters"""
+    return jsonify({'status': 'success', 'db_writer': packet_db_writer.get_stats()})
+
+@app.route('/api/db_maintenance', methods=['GET'])
+def get_db_maintenance():
+    """API endpoint to get the schema version and retention job counters"""
+    return jsonify({'status': 'success', 'schema_version': db_schema_version,
+                    'latest_schema_version': SCHEMA_VERSION, 'retention': retention_job.get_stats(),
+                    'partitions': packet_partitions.get_stats()})
+
 @app.route('/api/get_geoip_data', methods=['GET'])
 def get_geoip_data():
     """API endpoint to get GeoIP data"""
@@ -1344,6 +2066,13 @@ def get_geoip_data():
     except Exception as e:
         return jsonify({'status': 'error', 'message': f'Error retrieving GeoIP data: {str(e)}'})
 
+@app.route('/api/geoip_db_status', methods=['GET'])
+def geoip_db_status():
+    """API endpoint to get offline GeoIP database status"""
+    if geoip_db is None:
+        return jsonify({'status': 'success', 'loaded': False, 'path': GEOIP_DB_PATH})
+    return jsonify({'status': 'success', 'loaded': True, 'geoip_db': geoip_db.get_stats()})
+
 @app.route('/api/threat_intel_status', methods=['GET'])
 def threat_intel_status():
     """API endpoint to get threat intelligence status"""
@@ -1352,7 +2081,8 @@ def threat_intel_status():
             'abuseipdb_enabled': bool(THREAT_INTEL_CONFIG['abuseipdb_api_key']),
             'virustotal_enabled': bool(THREAT_INTEL_CONFIG['virustotal_api_key']),
             'cache_size': len(threat_intel_cache),
-            'cached_ips': list(threat_intel_cache.keys())[:10]  # First 10 cached IPs
+            'cached_ips': list(threat_intel_cache.keys())[:10],  # First 10 cached IPs
+            'enrichment': threat_enricher.get_stats()
         }
         return jsonify({'status': 'success', 'threat_intel_status': status})
     except Exception as e:
@@ -1372,7 +2102,7 @@ def check_ip():
         threat_info = check_ip_threat_intel(ip)
         
         # Also get GeoIP info for this IP and store it in packet_stats
-        if IPINFO_AVAILABLE and ipinfo_handler:
+        if geoip_lookup_available():
             geo_info = get_geoip_info(ip)
             # Update packet stats with this IP's traffic data for GeoIP visualization
             with stats_lock:
@@ -1381,6 +2111,9 @@ def check_ip():
                 # Add some traffic data for visualization
                 packet_stats['ips'][ip]['sent'] += 1
                 packet_stats['ips'][ip]['bytes'] += 1000  # Simulate 1KB traffic
+                packet_stats['geo'].add(ip, 1, 1000)
+                packet_stats['prefixes'].add(ip, 1, 1000)
+                packet_stats['heavy_hitters'].add_ip(ip, 1, 1000)
         
         return jsonify({'status': 'success', 'threat_info': threat_info})
     except Exception as e:
@@ -1421,42 +2154,9 @@ def get_vpn_ips():
 def get_country_analytics():
     """API endpoint to get country-wise traffic analytics"""
     try:
-        country_data = {}
-        
-        # Aggregate data by country
-        for ip, geo_info in packet_stats.get('geoip_data', {}).items():
-            country = geo_info.get('country', 'Unknown')
-            country_code = geo_info.get('country_code', 'XX')
-            
-            if country not in country_data:
-                country_data[country] = {
-                    'country': country,
-                    'country_code': country_code,
-                    'packets': 0,
-                    'bytes': 0,
-                    'unique_ips': 0,
-                    'latitude': geo_info.get('latitude', 0),
-                    'longitude': geo_info.get('longitude', 0),
-                    'isp_list': set()
-                }
-            
-            # Get traffic data for this IP
-            ip_traffic = packet_stats['ips'].get(ip, {'sent': 0, 'received': 0, 'bytes': 0})
-            country_data[country]['packets'] += (ip_traffic['sent'] + ip_traffic['received'])
-            country_data[country]['bytes'] += ip_traffic['bytes']
-            country_data[country]['unique_ips'] += 1
-            
-            # Add ISP to list
-            isp = geo_info.get('isp', 'Unknown')
-            if isp and isp != 'Unknown':
-                country_data[country]['isp_list'].add(isp)
-        
-        # Convert sets to lists for JSON serialization
-        for country in country_data:
-            country_data[country]['isp_list'] = list(country_data[country]['isp_list'])
-        
-        # Sort by bytes transferred
-        sorted_countries = sorted(country_data.values(), key=lambda x: x['bytes'], reverse=True)
+        # Read the rollup maintained as packets are counted
+        with stats_lock:
+            sorted_countries = packet_stats['geo'].countries()
         
         return jsonify({'status': 'success', 'country_data': sorted_countries})
     except Exception as e:
@@ -1472,21 +2172,18 @@ def filter_country_traffic():
         
         filtered_ips = {}
         
-        for ip, geo_info in packet_stats.get('geoip_data', {}).items():
-            country = geo_info.get('country', 'Unknown')
-            
-            include_ip = False
+        with stats_lock:
+            geoip_data = packet_stats['geoip_data']
             if filter_type == 'all':
-                include_ip = True
+                filtered_ips = dict(geoip_data)
             elif filter_type == 'non_local':
                 # This would need to be configured based on the local country
-                local_country = os.environ.get('LOCAL_COUNTRY', 'India')
-                include_ip = country != local_country
+                local_ips = packet_stats['geo'].ips_in_country(os.environ.get('LOCAL_COUNTRY', 'India'))
+                filtered_ips = {ip: geo_info for ip, geo_info in geoip_data.items() if ip not in local_ips}
             elif filter_type == 'specific' and country_filter:
-                include_ip = country == country_filter
-            
-            if include_ip:
-                filtered_ips[ip] = geo_info
+                # Only the IPs indexed under this country are visited
+                filtered_ips = {ip: geoip_data[ip] for ip in packet_stats['geo'].ips_in_country(country_filter)
+                                if ip in geoip_data}
         
         return jsonify({'status': 'success', 'filtered_ips': filtered_ips})
     except Exception as e:
@@ -1496,68 +2193,14 @@ def filter_country_traffic():
 def get_asn_isp_insights():
     """API endpoint to get ASN and ISP insights"""
     try:
-        asn_data = {}
-        isp_data = {}
-        network_type_data = {}
-        
-        # Aggregate data by ASN and ISP
-        for ip, geo_info in packet_stats.get('geoip_data', {}).items():
-            # Get traffic data for this IP
-            ip_traffic = packet_stats['ips'].get(ip, {'sent': 0, 'received': 0, 'bytes': 0})
-            
-            # Process ASN data
-            asn = geo_info.get('asn', 'Unknown')
-            if asn not in asn_data:
-                asn_data[asn] = {
-                    'asn': asn,
-                    'packets': 0,
-                    'bytes': 0,
-                    'unique_ips': 0
-                }
-            asn_data[asn]['packets'] += (ip_traffic['sent'] + ip_traffic['received'])
-            asn_data[asn]['bytes'] += ip_traffic['bytes']
-            asn_data[asn]['unique_ips'] += 1
-            
-            # Process ISP data
-            isp = geo_info.get('isp', 'Unknown')
-            if isp not in isp_data:
-                isp_data[isp] = {
-                    'isp': isp,
-                    'packets': 0,
-                    'bytes': 0,
-                    'unique_ips': 0
-                }
-            isp_data[isp]['packets'] += (ip_traffic['sent'] + ip_traffic['received'])
-            isp_data[isp]['bytes'] += ip_traffic['bytes']
-            isp_data[isp]['unique_ips'] += 1
-            
-            # Determine network type
-            org = geo_info.get('org', 'Unknown').lower()
-            network_type = 'Residential'
-            if 'cloudflare' in org or 'amazon' in org or 'aws' in org or 'microsoft' in org:
-                network_type = 'Hosting'
-            elif 'vpn' in org or 'nordvpn' in org or 'expressvpn' in org:
-                network_type = 'VPN'
-            elif 'tor' in org:
-                network_type = 'Tor'
-            elif 'proxy' in org:
-                network_type = 'Proxy'
-                
-            if network_type not in network_type_data:
-                network_type_data[network_type] = {
-                    'type': network_type,
-                    'packets': 0,
-                    'bytes': 0,
-                    'unique_ips': 0
-                }
-            network_type_data[network_type]['packets'] += (ip_traffic['sent'] + ip_traffic['received'])
-            network_type_data[network_type]['bytes'] += ip_traffic['bytes']
-            network_type_data[network_type]['unique_ips'] += 1
-        
-        # Convert to lists and sort
-        asn_list = sorted(asn_data.values(), key=lambda x: x['bytes'], reverse=True)
-        isp_list = sorted(isp_data.values(), key=lambda x: x['bytes'], reverse=True)
-        network_type_list = sorted(network_type_data.values(), key=lambda x: x['bytes'], reverse=True)
+        with stats_lock:
+            rollups = packet_stats['geo']
+            asn_list = [{'asn': asn, 'packets': packets, 'bytes': size, 'unique_ips': unique_ips}
+                        for asn, packets, size, unique_ips in rollups.rollup('asn')]
+            isp_list = [{'isp': isp, 'packets': packets, 'bytes': size, 'unique_ips': unique_ips}
+                        for isp, packets, size, unique_ips in rollups.rollup('isp')]
+            network_type_list = [{'type': network_type, 'packets': packets, 'bytes': size, 'unique_ips': unique_ips}
+                                 for network_type, packets, size, unique_ips in rollups.rollup('network_type')]
         
         return jsonify({
             'status': 'success',
@@ -1585,6 +2228,40 @@ def detect_suspicious_traffic():
     except Exception as e:
         return jsonify({'status': 'error', 'message': f'Error detecting suspicious traffic: {str(e)}'})
 
+def top_prefix_clusters(prefixes, length_v4, length_v6, n, within=None):
+    """The n busiest IPv4 /length_v4 and IPv6 /length_v6 clusters by bytes, optionally inside a network"""
+    if within is not None:
+        version = 6 if ':' in within else 4
+        return prefixes.top(length_v6 if version == 6 else length_v4, n, 'bytes', within, version)
+    clusters = prefixes.top(length_v4, n) + prefixes.top(length_v6, n, version=6)
+    clusters.sort(key=lambda cluster: cluster['bytes'], reverse=True)
+    return clusters[:n]
+
+@app.route('/api/prefix_clusters', methods=['GET'])
+def get_prefix_clusters():
+    """API endpoint to get the busiest clusters at any prefix length, optionally drilling down into a network"""
+    try:
+        within = request.args.get('within')
+        version = 6 if ':' in (within or '') or request.args.get('version') == '6' else 4
+        bits = 128 if version == 6 else 32
+        length = int(request.args.get('length', 64 if version == 6 else 24))
+        n = min(int(request.args.get('n', 20)), 1000)
+        by = request.args.get('by', 'bytes')
+        if by not in ('bytes', 'packets', 'ips'):
+            return jsonify({'status': 'error', 'message': f'Unknown metric: {by}'})
+        if not 1 <= length <= bits:
+            return jsonify({'status': 'error', 'message': f'Prefix length must be between 1 and {bits}'})
+        if within is not None and int(within.partition('/')[2] or bits) > length:
+            return jsonify({'status': 'error', 'message': 'within must be a shorter prefix than length'})
+        
+        with stats_lock:
+            clusters = packet_stats['prefixes'].top(length, n, by, within, version)
+        return jsonify({'status': 'success', 'length': length, 'within': within, 'by': by, 'clusters': clusters})
+    except (ValueError, OSError) as e:
+        return jsonify({'status': 'error', 'message': f'Invalid prefix query: {str(e)}'})
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': f'Error retrieving prefix clusters: {str(e)}'})
+
 @app.route('/api/get_ip_clustering', methods=['GET'])
 def get_ip_clustering():
     """API endpoint to get IP clustering and grouping data"""
@@ -1594,70 +2271,25 @@ def get_ip_clustering():
         network_data = {}  # Group by /16 networks
         cluster_stats = {}  # Statistics for each cluster
         
-        # Process all IP addresses
-        for ip_str, ip_stats in packet_stats.get('ips', {}).items():
-            try:
-                # Parse IP address
-                from ipaddress import ip_network, ip_address
-                ip = ip_address(ip_str)
-                
-                # Get /24 subnet (x.x.x.0/24)
-                subnet_prefix = ip_network(f"{ip}/24", strict=False)
-                subnet_str = str(subnet_prefix)
-                
-                # Get /16 network (x.x.0.0/16)
-                network_prefix = ip_network(f"{ip}/16", strict=False)
-                network_str = str(network_prefix)
-                
-                # Initialize subnet data if not exists
-                if subnet_str not in subnet_data:
-                    subnet_data[subnet_str] = {
-                        'subnet': subnet_str,
-                        'ips': set(),
-                        'packets': 0,
-                        'bytes': 0,
-                        'unique_ips': 0
-                    }
-                
-                # Initialize network data if not exists
-                if network_str not in network_data:
-                    network_data[network_str] = {
-                        'network': network_str,
-                        'subnets': set(),
-                        'ips': set(),
-                        'packets': 0,
-                        'bytes': 0,
-                        'unique_ips': 0
-                    }
-                
-                # Update subnet data
-                subnet_data[subnet_str]['ips'].add(ip_str)
-                subnet_data[subnet_str]['packets'] += (ip_stats['sent'] + ip_stats['received'])
-                subnet_data[subnet_str]['bytes'] += ip_stats['bytes']
-                subnet_data[subnet_str]['unique_ips'] = len(subnet_data[subnet_str]['ips'])
-                
-                # Update network data
-                network_data[network_str]['subnets'].add(subnet_str)
-                network_data[network_str]['ips'].add(ip_str)
-                network_data[network_str]['packets'] += (ip_stats['sent'] + ip_stats['received'])
-                network_data[network_str]['bytes'] += ip_stats['bytes']
-                network_data[network_str]['unique_ips'] = len(network_data[network_str]['ips'])
-                
-            except Exception as e:
-                # Skip invalid IP addresses
-                continue
-        
-        # Convert sets to lists for JSON serialization
-        for subnet in subnet_data.values():
-            subnet['ips'] = list(subnet['ips'])
+        with stats_lock:
+            # /24 subnets and /16 networks (/64 and /48 for IPv6), read from the prefix tries
+            prefixes = packet_stats['prefixes']
+            top_subnets = [{
+                'subnet': cluster['network'],
+                'ips': prefixes.members(cluster['network']),
+                'packets': cluster['packets'],
+                'bytes': cluster['bytes'],
+                'unique_ips': cluster['unique_ips']
+            } for cluster in top_prefix_clusters(prefixes, 24, 64, 20)]
             
-        for network in network_data.values():
-            network['subnets'] = list(network['subnets'])
-            network['ips'] = list(network['ips'])
-        
-        # Sort and get top clusters
-        top_subnets = sorted(subnet_data.values(), key=lambda x: x['bytes'], reverse=True)[:20]
-        top_networks = sorted(network_data.values(), key=lambda x: x['bytes'], reverse=True)[:10]
+            top_networks = [{
+                'network': cluster['network'],
+                'subnets': [subnet['network'] for subnet in top_prefix_clusters(prefixes, 24, 64, 256, cluster['network'])],
+                'ips': prefixes.members(cluster['network']),
+                'packets': cluster['packets'],
+                'bytes': cluster['bytes'],
+                'unique_ips': cluster['unique_ips']
+            } for cluster in top_prefix_clusters(prefixes, 16, 48, 10)]
         
         # Identify suspicious clusters (sudden appearance of new IP ranges)
         suspicious_clusters = []
@@ -1678,44 +2310,33 @@ def get_ip_grouping_by_activity():
     try:
         ip_activity_data = {}
         
-        # Process all IP addresses and their activity
-        for ip_str, ip_stats in packet_stats.get('ips', {}).items():
-            total_packets = ip_stats['sent'] + ip_stats['received']
-            total_bytes = ip_stats['bytes']
-            
-            # Categorize by activity level
-            if total_packets > 10000:
-                activity_level = 'High'
-            elif total_packets > 1000:
-                activity_level = 'Medium'
-            elif total_packets > 100:
-                activity_level = 'Low'
-            else:
-                activity_level = 'Very Low'
-            
-            if activity_level not in ip_activity_data:
-                ip_activity_data[activity_level] = {
-                    'level': activity_level,
-                    'ip_count': 0,
-                    'total_packets': 0,
-                    'total_bytes': 0,
-                    'ips': []
-                }
+        # Categorize every IP by activity level at once over the IP table's columns
+        with stats_lock:
+            ips = packet_stats['ips']
+            data = ips.snapshot()
+            names = list(ips.names)
+        
+        levels = ['Very Low', 'Low', 'Medium', 'High']
+        level_index = np.digitize(data['packets'], [101, 1001, 10001])  # > 100, > 1000, > 10000 packets
+        for index, activity_level in enumerate(levels):
+            members = np.flatnonzero(level_index == index)
+            if len(members) == 0:
+                continue
             
-            ip_activity_data[activity_level]['ip_count'] += 1
-            ip_activity_data[activity_level]['total_packets'] += total_packets
-            ip_activity_data[activity_level]['total_bytes'] += total_bytes
-            ip_activity_data[activity_level]['ips'].append({
-                'ip': ip_str,
-                'packets': total_packets,
-                'bytes': total_bytes
-            })
-        
-        # Sort IPs within each activity level by traffic
-        for level_data in ip_activity_data.values():
-            level_data['ips'].sort(key=lambda x: x['bytes'], reverse=True)
-            # Limit to top 10 IPs per level
-            level_data['ips'] = level_data['ips'][:10]
+            # Top 10 IPs of this level by traffic
+            member_bytes = data['bytes'][members]
+            top = members[np.argsort(-member_bytes, kind='stable')[:10]]
+            ip_activity_data[activity_level] = {
+                'level': activity_level,
+                'ip_count': int(len(members)),
+                'total_packets': int(data['packets'][members].sum()),
+                'total_bytes': int(member_bytes.sum()),
+                'ips': [{
+                    'ip': names[row],
+                    'packets': int(data['packets'][i]),
+                    'bytes': int(data['bytes'][i])
+                } for i, row in zip(top.tolist(), data['row'][top].tolist())]
+            }
         
         # Convert to list and sort by activity level
         activity_list = sorted(ip_activity_data.values(), key=lambda x: ['Very Low', 'Low', 'Medium', 'High'].index(x['level']))
@@ -1764,98 +2385,58 @@ COMMON_PORTS = {
     8443: {'name': 'HTTPS Alt', 'description': 'Alternative HTTPS', 'risk': 'Low'}
 }
 
+def get_port_info(port):
+    """Get name, description and risk for a port"""
+    return COMMON_PORTS.get(port, {'name': f'Port {port}', 'description': 'Unknown', 'risk': 'Low'})
+
 @app.route('/api/get_port_protocol_intelligence', methods=['GET'])
 def get_port_protocol_intelligence():
     """API endpoint to get port and protocol intelligence"""
     try:
-        port_data = {}
-        protocol_data = {}
-        unusual_ports = []
-        
-        # Aggregate data by port and protocol
-        for packet_info in packet_stats.get('packet_history', []):
-            # Process protocol data
-            protocol = packet_info.get('protocol', 0)
-            size = packet_info.get('size', 0)
-            
-            if protocol not in protocol_data:
-                protocol_data[protocol] = {
-                    'protocol': protocol,
-                    'name': get_protocol_name(protocol),
-                    'packets': 0,
-                    'bytes': 0
-                }
-            protocol_data[protocol]['packets'] += 1
-            protocol_data[protocol]['bytes'] += size
-            
-            # Process port data (for TCP/UDP packets)
-            src_port = packet_info.get('src_port')
-            dst_port = packet_info.get('dst_port')
-            
-            # Check source port
-            if src_port:
-                if src_port not in port_data:
-                    port_info = COMMON_PORTS.get(src_port, {'name': f'Port {src_port}', 'description': 'Unknown', 'risk': 'Low'})
-                    port_data[src_port] = {
-                        'port': src_port,
-                        'name': port_info['name'],
-                        'description': port_info['description'],
-                        'risk': port_info['risk'],
-                        'packets': 0,
-                        'bytes': 0,
-                        'direction': 'source'
-                    }
-                port_data[src_port]['packets'] += 1
-                port_data[src_port]['bytes'] += size
-                
-                # Check if port is unusual
-                if is_unusual_port(src_port):
-                    unusual_ports.append({
-                        'port': src_port,
-                        'name': port_data[src_port]['name'],
-                        'packets': port_data[src_port]['packets'],
-                        'bytes': port_data[src_port]['bytes'],
-                        'direction': 'source'
-                    })
-            
-            # Check destination port
-            if dst_port:
-                if dst_port not in port_data:
-                    port_info = COMMON_PORTS.get(dst_port, {'name': f'Port {dst_port}', 'description': 'Unknown', 'risk': 'Low'})
-                    port_data[dst_port] = {
-                        'port': dst_port,
-                        'name': port_info['name'],
-                        'description': port_info['description'],
-                        'risk': port_info['risk'],
-                        'packets': 0,
-                        'bytes': 0,
-                        'direction': 'destination'
-                    }
-                port_data[dst_port]['packets'] += 1
-                port_data[dst_port]['bytes'] += size
-                
-                # Check if port is unusual
-                if is_unusual_port(dst_port):
-                    unusual_ports.append({
-                        'port': dst_port,
-                        'name': port_data[dst_port]['name'],
-                        'packets': port_data[dst_port]['packets'],
-                        'bytes': port_data[dst_port]['bytes'],
-                        'direction': 'destination'
-                    })
-        
-        # Convert to lists and sort
-        port_list = sorted(port_data.values(), key=lambda x: x['packets'], reverse=True)
-        protocol_list = sorted(protocol_data.values(), key=lambda x: x['packets'], reverse=True)
+        # Read the live aggregates maintained at capture time
+        with stats_lock:
+            port_stats = packet_stats['ports']
+            top_ports = [(port, list(counters)) for port, counters in port_stats.ports.top(20)]
+            protocols = port_stats.protocol_totals()
+            unusual = [(key, list(counters)) for key, counters in port_stats.unusual.top(10)]
+        
+        port_list = []
+        for port, (packets, size, src_packets, src_bytes, dst_packets, dst_bytes) in top_ports:
+            port_info = get_port_info(port)
+            port_list.append({
+                'port': port,
+                'name': port_info['name'],
+                'description': port_info['description'],
+                'risk': port_info['risk'],
+                'packets': packets,
+                'bytes': size,
+                'direction': 'source' if src_packets > dst_packets else 'destination',
+                'source_packets': src_packets,
+                'source_bytes': src_bytes,
+                'destination_packets': dst_packets,
+                'destination_bytes': dst_bytes
+            })
         
-        # Get top ports
-        top_ports = port_list[:20]
+        protocol_list = [{
+            'protocol': protocol,
+            'name': get_protocol_name(protocol),
+            'packets': packets,
+            'bytes': size
+        } for protocol, packets, size in protocols]
+        
+        unusual_ports = [{
+            'port': port,
+            'name': get_port_info(port)['name'],
+            'packets': packets,
+            'bytes': size,
+            'direction': direction
+        } for (port, direction), (packets, size) in unusual]
         
         return jsonify({
             'status': 'success',
-            'port_data': top_ports,
+            'port_data': port_list,
             'protocol_data': protocol_list,
-            'unusual_ports': unusual_ports[:10]  # Limit to top 10 unusual ports
+            'unusual_ports': unusual_ports
         })
     except Exception as e:
         return jsonify({'status': 'error', 'message': f'Error retrieving port/protocol intelligence: {str(e)}'})
@@ -1889,58 +2470,20 @@ def is_unusual_port(port):
 def get_port_country_correlation():
     """API endpoint to get port-country correlation data"""
     try:
-        port_country_data = {}
-        
-        # Aggregate data by port and country
-        for ip, geo_info in packet_stats.get('geoip_data', {}).items():
-            country = geo_info.get('country', 'Unknown')
-            
-            # Get traffic data for this IP
-            ip_traffic = packet_stats['ips'].get(ip, {'sent': 0, 'received': 0, 'bytes': 0})
-            
-            # Get port data for packets from this IP
-            ip_packets = [p for p in packet_stats.get('packet_history', []) if p.get('src') == ip or p.get('dst') == ip]
-            
-            for packet in ip_packets:
-                src_port = packet.get('src_port')
-                dst_port = packet.get('dst_port')
-                
-                # Process source port
-                if src_port:
-                    key = f"{src_port}_{country}"
-                    if key not in port_country_data:
-                        port_info = COMMON_PORTS.get(src_port, {'name': f'Port {src_port}', 'description': 'Unknown', 'risk': 'Low'})
-                        port_country_data[key] = {
-                            'port': src_port,
-                            'port_name': port_info['name'],
-                            'country': country,
-                            'packets': 0,
-                            'bytes': 0
-                        }
-                    port_country_data[key]['packets'] += 1
-                    port_country_data[key]['bytes'] += packet.get('size', 0)
-                
-                # Process destination port
-                if dst_port:
-                    key = f"{dst_port}_{country}"
-                    if key not in port_country_data:
-                        port_info = COMMON_PORTS.get(dst_port, {'name': f'Port {dst_port}', 'description': 'Unknown', 'risk': 'Low'})
-                        port_country_data[key] = {
-                            'port': dst_port,
-                            'port_name': port_info['name'],
-                            'country': country,
-                            'packets': 0,
-                            'bytes': 0
-                        }
-                    port_country_data[key]['packets'] += 1
-                    port_country_data[key]['bytes'] += packet.get('size', 0)
+        with stats_lock:
+            top_pairs = [(key, list(counters)) for key, counters in packet_stats['ports'].port_countries.top(50)]
         
-        # Convert to list and sort
-        correlation_list = sorted(port_country_data.values(), key=lambda x: x['packets'], reverse=True)
+        correlation_list = [{
+            'port': port,
+            'port_name': get_port_info(port)['name'],
+            'country': country,
+            'packets': packets,
+            'bytes': size
+        } for (port, country), (packets, size) in top_pairs]
         
         return jsonify({
             'status': 'success',
-            'correlation_data': correlation_list[:50]  # Top 50 correlations
+            'correlation_data': correlation_list  # Top 50 correlations
         })
     except Exception as e:
         return jsonify({'status': 'error', 'message': f'Error retrieving port-country correlation: {str(e)}'})
@@ -1949,86 +2492,25 @@ def get_port_country_correlation():
 def get_geo_time_correlation():
     """API endpoint to get geo-time correlation data"""
     try:
-        time_zone_data = {}
-        activity_patterns = {}
-        
-        # Process all IP addresses for geo-time correlation
-        for ip_str, geo_info in packet_stats.get('geoip_data', {}).items():
-            try:
-                # Get timezone information
-                timezone = geo_info.get('timezone', 'Unknown')
-                country = geo_info.get('country', 'Unknown')
-                
-                # Get traffic data for this IP
-                ip_stats = packet_stats['ips'].get(ip_str, {'sent': 0, 'received': 0, 'bytes': 0})
-                packets = ip_stats['sent'] + ip_stats['received']
-                bytes_transferred = ip_stats['bytes']
-                
-                # Initialize timezone data if not exists
-                if timezone not in time_zone_data:
-                    time_zone_data[timezone] = {
-                        'timezone': timezone,
-                        'countries': set(),
-                        'packets': 0,
-                        'bytes': 0,
-                        'unique_ips': 0,
-                        'ips': set()
-                    }
-                
-                # Update timezone data
-                time_zone_data[timezone]['countries'].add(country)
-                time_zone_data[timezone]['packets'] += packets
-                time_zone_data[timezone]['bytes'] += bytes_transferred
-                time_zone_data[timezone]['ips'].add(ip_str)
-                
-                # Activity pattern analysis
-                # Get current UTC time
-                import datetime
-                utc_now = datetime.datetime.utcnow()
-                utc_hour = utc_now.hour
-                
-                # Determine if this is off-hour activity (simplified)
-                # Assuming local business hours are 9 AM to 5 PM in each timezone
-                local_hour = utc_hour  # Simplified - in reality would convert UTC to local time
-                
-                is_off_hour = local_hour < 9 or local_hour > 17
-                
-                if is_off_hour:
-                    if timezone not in activity_patterns:
-                        activity_patterns[timezone] = {
-                            'timezone': timezone,
-                            'off_hour_packets': 0,
-                            'off_hour_bytes': 0,
-                            'normal_hour_packets': 0,
-                            'normal_hour_bytes': 0
-                        }
-                    activity_patterns[timezone]['off_hour_packets'] += packets
-                    activity_patterns[timezone]['off_hour_bytes'] += bytes_transferred
-                else:
-                    if timezone not in activity_patterns:
-                        activity_patterns[timezone] = {
-                            'timezone': timezone,
-                            'off_hour_packets': 0,
-                            'off_hour_bytes': 0,
-                            'normal_hour_packets': 0,
-                            'normal_hour_bytes': 0
-                        }
-                    activity_patterns[timezone]['normal_hour_packets'] += packets
-                    activity_patterns[timezone]['normal_hour_bytes'] += bytes_transferred
-                    
-            except Exception as e:
-                continue
+        with stats_lock:
+            top_timezones = packet_stats['geo'].timezones(20)
+            timezone_totals = packet_stats['geo'].rollup('timezone')
         
-        # Convert sets to counts/lists for JSON serialization
-        for tz_data in time_zone_data.values():
-            tz_data['unique_ips'] = len(tz_data['ips'])
-            tz_data['countries'] = list(tz_data['countries'])
-            # Keep top 5 countries
-            tz_data['countries'] = tz_data['countries'][:5]
-            del tz_data['ips']  # Remove IPs for privacy
+        # Activity pattern analysis
+        # Determine if this is off-hour activity (simplified)
+        # Assuming local business hours are 9 AM to 5 PM in each timezone
+        local_hour = datetime.utcnow().hour  # Simplified - in reality would convert UTC to local time
+        is_off_hour = local_hour < 9 or local_hour > 17
         
-        # Sort and get top timezones
-        top_timezones = sorted(time_zone_data.values(), key=lambda x: x['bytes'], reverse=True)[:20]
+        activity_patterns = {}
+        for timezone, packets, bytes_transferred, _ in timezone_totals:
+            activity_patterns[timezone] = {
+                'timezone': timezone,
+                'off_hour_packets': packets if is_off_hour else 0,
+                'off_hour_bytes': bytes_transferred if is_off_hour else 0,
+                'normal_hour_packets': 0 if is_off_hour else packets,
+                'normal_hour_bytes': 0 if is_off_hour else bytes_transferred
+            }
         
         # Identify suspicious time patterns
         suspicious_patterns = []
@@ -2069,39 +2551,19 @@ def get_geo_time_correlation():
 def get_world_map_bubbles():
     """API endpoint to get data for world map bubbles visualization"""
     try:
-        bubble_data = []
-        
-        # Process all IP addresses for bubble visualization
-        for ip_str, geo_info in packet_stats.get('geoip_data', {}).items():
-            try:
-                # Get geolocation data
-                latitude = geo_info.get('latitude', 0)
-                longitude = geo_info.get('longitude', 0)
-                country = geo_info.get('country', 'Unknown')
-                
-                # Get traffic data for this IP
-                ip_stats = packet_stats['ips'].get(ip_str, {'sent': 0, 'received': 0, 'bytes': 0})
-                packets = ip_stats['sent'] + ip_stats['received']
-                bytes_transferred = ip_stats['bytes']
-                
-                # Only include entries with valid coordinates
-                if latitude != 0 and longitude != 0:
-                    bubble_data.append({
-                        'ip': ip_str,
-                        'latitude': latitude,
-                        'longitude': longitude,
-                        'country': country,
-                        'packets': packets,
-                        'bytes': bytes_transferred,
-                        'radius': max(5, min(50, bytes_transferred / 1000000))  # Scale radius based on traffic
-                    })
-                    
-            except Exception as e:
-                continue
-        
-        # Sort by traffic volume and limit to top 100
-        bubble_data.sort(key=lambda x: x['bytes'], reverse=True)
-        bubble_data = bubble_data[:100]
+        # The busiest IPs with coordinates are ranked as traffic is counted
+        with stats_lock:
+            top_bubbles = packet_stats['geo'].top_bubbles(100)
+        
+        bubble_data = [{
+            'ip': ip_str,
+            'latitude': latitude,
+            'longitude': longitude,
+            'country': country,
+            'packets': packets,
+            'bytes': bytes_transferred,
+            'radius': max(5, min(50, bytes_transferred / 1000000))  # Scale radius based on traffic
+        } for ip_str, latitude, longitude, country, packets, bytes_transferred in top_bubbles]
         
         return jsonify({
             'status': 'success',
@@ -2412,3 +2874,6 @@ if __name__ == '__main__':
         print(f"Error starting server: {e}")
         import traceback
         traceback.print_exc()
+    finally:
+        # Flush queued rows before exiting
+        stop_storage_writers()
@@ -0,0 +1,111 @@
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+from fast_decode import decode_frame, read_pcap
+
+
+def generate_pcap(path, count=50000, seed=42):
+    """Write a synthetic Ethernet/IPv4/IPv6 TCP/UDP/ICMP capture to benchmark against"""
+    from scapy.all import Ether, IP, IPv6, TCP, UDP, ICMP, Raw, wrpcap
+
+    rng = random.Random(seed)
+    ether = Ether(src='02:00:00:00:00:01', dst='02:00:00:00:00:02')
+    packets = []
+    for i in range(count):
+        kind = rng.random()
+        payload = Raw(b'x' * rng.choice([0, 64, 512, 1400]))
+        if kind < 0.1:
+            packet = ether / IPv6(src=f'2001:db8::{rng.randint(1, 500):x}', dst='2001:db8::1') / TCP(sport=rng.randint(1024, 65535), dport=443) / payload
+        elif kind < 0.6:
+            packet = ether / IP(src=f'10.0.{rng.randint(0, 20)}.{rng.randint(1, 254)}', dst='93.184.216.34') / TCP(sport=rng.randint(1024, 65535), dport=rng.choice([80, 443, 22])) / payload
+        elif kind < 0.95:
+            packet = ether / IP(src=f'10.0.{rng.randint(0, 20)}.{rng.randint(1, 254)}', dst='8.8.8.8') / UDP(sport=rng.randint(1024, 65535), dport=53) / payload
+        else:
+            packet = ether / IP(src='10.0.0.1', dst='1.1.1.1') / ICMP()
+        packet.time = 1700000000 + i * 0.001
+        packets.append(packet)
+    wrpcap(path, packets)
+    return count
+
+
+def benchmark_scapy_decode(path):
+    """Read the pcap and fully dissect every frame with scapy"""
+    from scapy.all import Ether
+    from scapy.layers.inet import IP
+
+    frames = [frame for _, frame, _, _ in read_pcap(path)]
+    started = time.perf_counter()
+    ip_packets = 0
+    for frame in frames:
+        packet = Ether(frame)
+        if IP in packet:
+            packet[IP].src, packet[IP].dst, packet[IP].proto, len(packet)
+            ip_packets += 1
+    elapsed = time.perf_counter() - started
+    return len(frames), elapsed
+
+
+def benchmark_raw_decode(path):
+    """Read the pcap and decode headers at fixed offsets"""
+    frames = [(ts, frame, origlen, linktype) for ts, frame, origlen, linktype in read_pcap(path)]
+    started = time.perf_counter()
+    for ts, frame, origlen, linktype in frames:
+        decode_frame(frame, ts, linktype, origlen)
+    elapsed = time.perf_counter() - started
+    return len(frames), elapsed
+
+
+def benchmark_pipeline(path):
+    """Feed the same pcap through packet_handler (scapy) and handle_packet_record (raw)"""
+    from scapy.all import Ether
+    from replay import scratch_app
+
+    frames = list(read_pcap(path))
+    results = {}
+    # Benchmark packets, sessions and models go to a temporary directory, not the real database
+    with scratch_app() as app:
+        app.THREAT_INTEL_CONFIG['enabled'] = False
+
+        packets = [Ether(frame) for _, frame, _, _ in frames]
+        started = time.perf_counter()
+        for packet in packets:
+            app.packet_handler(packet)
+        results['scapy_handler_pps'] = len(packets) / (time.perf_counter() - started)
+
+        started = time.perf_counter()
+        for ts, frame, origlen, linktype in frames:
+            app.handle_packet_record(decode_frame(frame, ts, linktype, origlen))
+        results['raw_handler_pps'] = len(frames) / (time.perf_counter() - started)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compare scapy dissection against the raw frame decoder')
+    parser.add_argument('pcap', nargs='?', help='pcap/pcapng file (a synthetic one is generated if omitted)')
+    parser.add_argument('--count', type=int, default=50000, help='Packets in the synthetic capture')
+    parser.add_argument('--pipeline', action='store_true', help='Also benchmark the full packet handler pipeline')
+    args = parser.parse_args()
+
+    path = args.pcap
+    if not path:
+        path = os.path.join(tempfile.gettempdir(), 'nta_benchmark.pcap')
+        print(f"Generating {args.count} synthetic packets into {path}...")
+        generate_pcap(path, args.count)
+
+    count, scapy_elapsed = benchmark_scapy_decode(path)
+    _, raw_elapsed = benchmark_raw_decode(path)
+    results = {
+        'pcap': path,
+        'packets': count,
+        'scapy_decode_pps': count / scapy_elapsed,
+        'raw_decode_pps': count / raw_elapsed,
+        'speedup': scapy_elapsed / raw_elapsed
+    }
+    if args.pipeline:
+        results.update(benchmark_pipeline(path))
+
+    print(json.dumps(results, indent=2))
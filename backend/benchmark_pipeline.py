@@ -0,0 +1,272 @@
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import socket
+import struct
+import subprocess
+import sys
+import time
+
+from fast_decode import decode_frame
+from replay import scratch_app
+
+ETHERNET_HEADER = b'\x02\x00\x00\x00\x00\x02\x02\x00\x00\x00\x00\x01'
+
+# Analytics routes driven through the Flask test client
+ANALYTICS_ROUTES = [
+    '/api/stats',
+    '/api/get_country_analytics',
+    '/api/get_asn_isp_insights',
+    '/api/get_ip_clustering',
+    '/api/get_ip_grouping_by_activity',
+    '/api/get_port_protocol_intelligence',
+    '/api/get_port_country_correlation',
+    '/api/get_geo_time_correlation',
+    '/api/get_world_map_bubbles',
+    '/api/get_vpn_proxy_tor_detection'
+]
+
+
+def parse_weights(text, cast=str):
+    """Parse 'a=0.6,b=0.4' (or 'a:0.6,...') into ([a, b], [0.6, 0.4])"""
+    values, weights = [], []
+    for item in text.split(','):
+        key, _, weight = item.replace(':', '=').partition('=')
+        values.append(cast(key.strip()))
+        weights.append(float(weight or 1))
+    return values, weights
+
+
+class TrafficProfile:
+    """Synthetic traffic shape: IP cardinality, protocol mix and frame size distribution"""
+
+    def __init__(self, ips=1000, protocols='tcp=0.6,udp=0.35,icmp=0.05', sizes='64=0.4,576=0.2,1400=0.4',
+                 ipv6=0.1, seed=42):
+        self.ips = ips
+        self.protocols = parse_weights(protocols)
+        self.sizes = parse_weights(sizes, int)
+        self.ipv6 = ipv6
+        self.seed = seed
+
+    def describe(self):
+        return {
+            'ips': self.ips,
+            'protocols': dict(zip(*self.protocols)),
+            'sizes': dict(zip(*self.sizes)),
+            'ipv6': self.ipv6,
+            'seed': self.seed
+        }
+
+
+def build_frame(src, dst, protocol, size, sport, dport, version=4):
+    """Build an Ethernet frame of (at least) size bytes with an IPv4/IPv6 and TCP/UDP/ICMP header"""
+    if protocol == 'tcp':
+        transport = struct.pack('!HHIIBBHHH', sport, dport, 1, 0, 0x50, 0x18, 65535, 0, 0)
+        proto = 6
+    elif protocol == 'udp':
+        transport = struct.pack('!HHHH', sport, dport, 8, 0)
+        proto = 17
+    else:
+        transport = struct.pack('!BBHHH', 8, 0, 0, 1, 1)
+        proto = 1 if version == 4 else 58
+
+    if version == 4:
+        header_size = 14 + 20 + len(transport)
+        payload = b'x' * max(0, size - header_size)
+        ip = struct.pack('!BBHHHBBH4s4s', 0x45, 0, 20 + len(transport) + len(payload), 0, 0, 64, proto, 0,
+                         socket.inet_aton(src), socket.inet_aton(dst))
+        return ETHERNET_HEADER + b'\x08\x00' + ip + transport + payload
+
+    header_size = 14 + 40 + len(transport)
+    payload = b'x' * max(0, size - header_size)
+    ip = struct.pack('!IHBB16s16s', 0x60000000, len(transport) + len(payload), proto, 64,
+                     socket.inet_pton(socket.AF_INET6, src), socket.inet_pton(socket.AF_INET6, dst))
+    return ETHERNET_HEADER + b'\x86\xdd' + ip + transport + payload
+
+
+def generate_frames(profile, count, start_time=1700000000.0):
+    """Generate (timestamp, frame) pairs following the traffic profile"""
+    rng = random.Random(profile.seed)
+    v4_hosts = [f'10.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}' for i in range(1, profile.ips + 1)]
+    v6_hosts = [f'2001:db8::{i:x}' for i in range(1, profile.ips + 1)]
+    servers_v4 = ['8.8.8.8', '1.1.1.1', '93.184.216.34', '104.18.32.145', '13.107.42.14']
+    servers_v6 = ['2001:4860:4860::8888', '2606:4700:4700::1111']
+    protocols, protocol_weights = profile.protocols
+    sizes, size_weights = profile.sizes
+    ports = {'tcp': [80, 443, 22, 3389, 8080], 'udp': [53, 123, 443, 5353], 'icmp': [0]}
+
+    frames = []
+    for i in range(count):
+        protocol = rng.choices(protocols, protocol_weights)[0]
+        size = rng.choices(sizes, size_weights)[0]
+        version = 6 if rng.random() < profile.ipv6 else 4
+        host = rng.choice(v6_hosts if version == 6 else v4_hosts)
+        server = rng.choice(servers_v6 if version == 6 else servers_v4)
+        src, dst = (host, server) if rng.random() < 0.6 else (server, host)
+        frame = build_frame(src, dst, protocol, size, rng.randint(1024, 65535), rng.choice(ports[protocol]), version)
+        frames.append((start_time + i * 0.0001, frame))
+    return frames
+
+
+def percentiles(samples_ns):
+    """Latency percentiles in microseconds"""
+    if not samples_ns:
+        return {}
+    ordered = sorted(samples_ns)
+
+    def pick(fraction):
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] / 1000
+
+    return {
+        'p50_us': pick(0.50),
+        'p90_us': pick(0.90),
+        'p99_us': pick(0.99),
+        'p999_us': pick(0.999),
+        'max_us': ordered[-1] / 1000,
+        'mean_us': sum(ordered) / len(ordered) / 1000
+    }
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def time_calls(fn, items):
+    """Call fn on each item, timing every call; returns the result entry"""
+    clock = time.perf_counter_ns
+    samples = []
+    started = clock()
+    for item in items:
+        call_started = clock()
+        fn(item)
+        samples.append(clock() - call_started)
+    elapsed = (clock() - started) / 1e9
+    result = {'calls': len(samples), 'elapsed_s': elapsed, 'per_second': len(samples) / elapsed if elapsed else 0.0}
+    result.update(percentiles(samples))
+    result['peak_rss_mb'] = peak_rss_mb()
+    return result
+
+
+def run_benchmarks(profile, count, repeat, skip_scapy=False):
+    """Run every pipeline stage and return the results dict"""
+    # Synthetic packets, sessions and models go to a temporary directory, not the real database
+    with scratch_app() as app:
+        return run_stages(app, profile, count, repeat, skip_scapy)
+
+
+def run_stages(app, profile, count, repeat, skip_scapy):
+    """Run every pipeline stage against an imported app module"""
+    app.THREAT_INTEL_CONFIG['enabled'] = False
+    results = {}
+
+    frames = generate_frames(profile, count)
+    results['generated'] = {'frames': len(frames), 'peak_rss_mb': peak_rss_mb()}
+
+    # Raw frame decode on its own, then decode + handle_packet_record (the raw engine's path)
+    results['decode_frame'] = time_calls(lambda item: decode_frame(item[1], item[0]), frames)
+    results['raw_handle_packet_record'] = time_calls(
+        lambda item: app.handle_packet_record(decode_frame(item[1], item[0])), frames)
+
+    # packet_handler with scapy packets (the scapy engine's path)
+    if not skip_scapy and app.SCAPY_AVAILABLE:
+        from scapy.all import Ether
+        packets = [Ether(frame) for _, frame in frames[:max(1, count // 5)]]
+        results['scapy_packet_handler'] = time_calls(app.packet_handler, packets)
+
+    # Filter matching with every filter enabled and none of them applied in the kernel
+    records = [decode_frame(frame, timestamp) for timestamp, frame in frames]
+    saved_filters = dict(app.packet_filters)
+    app.packet_filters.update({'enabled': True, 'protocol_filter': 'TCP', 'port_filter': 443,
+                               'size_filter': {'min': 0, 'max': 1500}})
+    try:
+        results['packet_matches_filters'] = time_calls(app.packet_matches_filters, records)
+    finally:
+        app.packet_filters.clear()
+        app.packet_filters.update(saved_filters)
+
+    # Periodic work done by the stats loop
+    results['update_top_talkers'] = time_calls(lambda _: app.update_top_talkers(), range(repeat))
+    if app.SKLEARN_AVAILABLE:
+        results['detect_anomalies_with_ai'] = time_calls(lambda _: app.detect_anomalies_with_ai(), range(repeat))
+    results['detect_simple_anomalies'] = time_calls(lambda _: app.detect_simple_anomalies(), range(repeat))
+
+    # Analytics routes
+    client = app.app.test_client()
+    routes = {}
+    for route in ANALYTICS_ROUTES:
+        routes[route] = time_calls(lambda _: client.get(route), range(repeat))
+    results['routes'] = routes
+
+    results['state'] = {'total_packets': app.packet_stats['total_packets'], 'unique_ips': len(app.packet_stats['ips'])}
+    results['peak_rss_mb'] = peak_rss_mb()
+    return results
+
+
+def git_commit():
+    """Current commit of the working tree, if available"""
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except Exception:
+        return None
+
+
+def compare(baseline, current, prefix=''):
+    """Print per-stage throughput and p99 changes against a baseline results dict"""
+    for name, entry in current.items():
+        base = baseline.get(name)
+        if not isinstance(entry, dict) or not isinstance(base, dict):
+            continue
+        if 'per_second' not in entry:
+            compare(base, entry, prefix + name + ' ')
+            continue
+        ratio = entry['per_second'] / base['per_second'] if base.get('per_second') else 0.0
+        print(f"{prefix}{name}: {base['per_second']:.0f} -> {entry['per_second']:.0f}/s ({ratio:.2f}x), "
+              f"p99 {base.get('p99_us', 0):.1f} -> {entry.get('p99_us', 0):.1f} us")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the packet pipeline with synthetic traffic')
+    parser.add_argument('--count', type=int, default=50000, help='Synthetic packets to generate')
+    parser.add_argument('--ips', type=int, default=1000, help='Distinct local IP addresses')
+    parser.add_argument('--protocols', default='tcp=0.6,udp=0.35,icmp=0.05', help='Protocol mix')
+    parser.add_argument('--sizes', default='64=0.4,576=0.2,1400=0.4', help='Frame size distribution (bytes=weight)')
+    parser.add_argument('--ipv6', type=float, default=0.1, help='Fraction of IPv6 packets')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--repeat', type=int, default=20, help='Calls per periodic function and analytics route')
+    parser.add_argument('--skip-scapy', action='store_true', help='Skip the scapy packet_handler stage')
+    parser.add_argument('--output', help='Write the results JSON to this file')
+    parser.add_argument('--compare', help='Baseline results JSON to compare against')
+    args = parser.parse_args()
+
+    profile = TrafficProfile(args.ips, args.protocols, args.sizes, args.ipv6, args.seed)
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': time.time(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'count': args.count,
+            'repeat': args.repeat,
+            'profile': profile.describe()
+        },
+        'results': run_benchmarks(profile, args.count, args.repeat, args.skip_scapy)
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    print(output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print(f"\nCompared with {baseline['meta'].get('commit')}:")
+        compare(baseline['results'], report['results'])
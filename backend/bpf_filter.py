@@ -0,0 +1,134 @@
+import ipaddress
+
+PROTOCOL_BPF_NAMES = {'TCP': 'tcp', 'UDP': 'udp', 'ICMP': 'icmp'}
+
+
+def _ip_filter_to_bpf(value):
+    """Translate an exact IP match into a BPF primitive"""
+    try:
+        ip = ipaddress.ip_address(str(value).strip())
+    except ValueError:
+        return None
+    return f'host {ip}'
+
+
+def _protocol_filter_to_bpf(value):
+    """Translate a protocol name or number into a BPF primitive"""
+    if isinstance(value, str) and value.upper() in PROTOCOL_BPF_NAMES:
+        return PROTOCOL_BPF_NAMES[value.upper()]
+    if isinstance(value, int) and not isinstance(value, bool) and 0 <= value <= 255:
+        return f'ip proto {value}'
+    return None
+
+
+def _port_filter_to_bpf(value):
+    """Translate a TCP/UDP port match into a BPF primitive"""
+    if isinstance(value, bool):
+        return None
+    try:
+        port = int(value)
+    except (TypeError, ValueError):
+        return None
+    if not 0 <= port <= 65535:
+        return None
+    return f'tcp port {port} or udp port {port}'
+
+
+def _size_filter_to_bpf(value):
+    """Translate a frame length range into BPF 'greater'/'less' primitives"""
+    if not isinstance(value, dict):
+        return None
+    try:
+        size_min = float(value.get('min', 0) or 0)
+        size_max = float(value.get('max', float('inf')))
+    except (TypeError, ValueError):
+        return None
+    terms = []
+    # 'greater N' is len >= N and 'less N' is len <= N, matching the inclusive Python check
+    if size_min > 0:
+        terms.append(f'greater {int(size_min)}' if size_min.is_integer() else None)
+    if size_max != float('inf'):
+        terms.append(f'less {int(size_max)}' if size_max.is_integer() else None)
+    if None in terms:
+        return None
+    return ' and '.join(terms)
+
+
+FILTER_TRANSLATORS = {
+    'ip_filter': _ip_filter_to_bpf,
+    'protocol_filter': _protocol_filter_to_bpf,
+    'port_filter': _port_filter_to_bpf,
+    'size_filter': _size_filter_to_bpf
+}
+
+
+def compile_bpf_filter(filters):
+    """Compile packet filter settings into a BPF expression.
+
+    Returns (expression, kernel_filters, python_filters) where expression is
+    None when nothing can be pushed into the kernel, kernel_filters lists the
+    settings covered by the expression and python_filters lists the ones that
+    still have to be checked per packet.
+    """
+    kernel_filters = []
+    python_filters = []
+    terms = []
+
+    if not filters.get('enabled', False):
+        return None, kernel_filters, python_filters
+
+    for name, translate in FILTER_TRANSLATORS.items():
+        value = filters.get(name)
+        if not value:
+            continue
+        term = translate(value)
+        if term is None:
+            python_filters.append(name)
+        elif term:
+            terms.append(f'({term})')
+            kernel_filters.append(name)
+
+    expression = ' and '.join(terms) if terms else None
+    return expression, kernel_filters, python_filters
+
+
+def record_matches_filters(record, filters, kernel_filters=()):
+    """Check a PacketRecord against the filter settings, skipping the ones in kernel_filters"""
+    if not filters.get('enabled', False):
+        return True  # No filtering enabled
+
+    # Size filter
+    if 'size_filter' not in kernel_filters:
+        size_filter = filters.get('size_filter', {'min': 0, 'max': float('inf')})
+        if not (size_filter['min'] <= record.size <= size_filter['max']):
+            return False
+
+    ip_filter = filters.get('ip_filter')
+    protocol_filter = filters.get('protocol_filter')
+    port_filter = filters.get('port_filter')
+
+    # Non-IP frames never match an IP, protocol or port filter, as with the compiled BPF
+    if record.src is None:
+        return not (ip_filter or protocol_filter or port_filter)
+
+    # IP filter
+    if ip_filter and 'ip_filter' not in kernel_filters:
+        if ip_filter not in [record.src, record.dst]:
+            return False
+
+    # Protocol filter
+    if protocol_filter and 'protocol_filter' not in kernel_filters:
+        protocol = record.protocol
+        # Map protocol names to numbers (simplified)
+        protocol_map = {'TCP': 6, 'UDP': 17, 'ICMP': 1}
+        if protocol_filter in protocol_map:
+            if protocol != protocol_map[protocol_filter]:
+                return False
+        elif isinstance(protocol_filter, int) and protocol != protocol_filter:
+            return False
+
+    # Port filter (for TCP/UDP)
+    if port_filter and 'port_filter' not in kernel_filters:
+        return record.src_port == port_filter or record.dst_port == port_filter
+
+    return True
@@ -0,0 +1,378 @@
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+import time
+import traceback
+from multiprocessing import reduction
+from multiprocessing.connection import Connection, wait
+
+from bpf_filter import record_matches_filters
+from fast_decode import RawSniffer, scapy_packet_to_record
+from flow_table import flow_key
+from packet_partitions import PacketPartitionRouter, PartitionedPacketWriter
+
+
+class WorkerCounters:
+    """Per-process counters accumulated between two deltas"""
+
+    def __init__(self, sample_size):
+        self.sample_size = sample_size
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Start a new delta interval"""
+        self.packets = 0
+        self.bytes = 0
+        self.protocols = {}
+        self.ips = {}  # ip -> [sent, received, bytes]
+        self.flows = {}  # normalized 5-tuple -> FlowTable.merge() arguments
+        self.recent = []
+
+    def add(self, record):
+        """Count one packet record"""
+        with self.lock:
+            self.packets += 1
+            self.bytes += record.size
+            if record.src is None:
+                return
+
+            self.protocols[record.protocol] = self.protocols.get(record.protocol, 0) + 1
+            src = self.ips.get(record.src)
+            if src is None:
+                src = self.ips[record.src] = [0, 0, 0]
+            src[0] += 1
+            src[2] += record.size
+            dst = self.ips.get(record.dst)
+            if dst is None:
+                dst = self.ips[record.dst] = [0, 0, 0]
+            dst[1] += 1
+            dst[2] += record.size
+
+            key, forward = flow_key(record.src, record.dst, record.protocol, record.src_port, record.dst_port)
+            flow = self.flows.get(key)
+            if flow is None:
+                # first_seen, last_seen, fwd packets/bytes, rev packets/bytes, tcp flags, initiator direction
+                flow = self.flows[key] = [record.timestamp, record.timestamp, 0, 0, 0, 0, 0, forward]
+            if forward:
+                flow[2] += 1
+                flow[3] += record.size
+            else:
+                flow[4] += 1
+                flow[5] += record.size
+            flow[6] |= record.tcp_flags or 0
+            flow[1] = record.timestamp
+
+            # Keep a sample of the most recent packets for history and anomaly detection
+            self.recent.append((record.timestamp, record.src, record.dst, record.protocol, record.size,
+                                record.src_port, record.dst_port, record.tcp_flags))
+            if len(self.recent) > self.sample_size * 2:
+                del self.recent[:-self.sample_size]
+
+    def take_delta(self):
+        """Return the counters accumulated since the last call and reset them"""
+        with self.lock:
+            delta = {
+                'packets': self.packets,
+                'bytes': self.bytes,
+                'protocols': self.protocols,
+                'ips': self.ips,
+                'flows': self.flows,
+                'recent': self.recent[-self.sample_size:]
+            }
+            self.reset()
+        return delta
+
+
+def run_capture_worker(worker_id, iface, engine, bpf_expression, filters, kernel_filters, fanout_group,
+                       flush_interval, sample_size, partition_dir, partition_granularity, deltas, stop):
+    """Entry point of a capture worker process"""
+    counters = WorkerCounters(sample_size)
+    # Each worker opens its own partition connections; SQLite serializes writers across processes
+    writer = PartitionedPacketWriter(PacketPartitionRouter(partition_dir, partition_granularity)) if partition_dir else None
+    if writer:
+        writer.start()
+    interface_name = iface or 'default'
+
+    def handle_record(record):
+        if not record_matches_filters(record, filters, kernel_filters):
+            return
+        counters.add(record)
+        if writer and record.src is not None:
+            writer.submit((record.timestamp, record.src, record.dst, record.protocol, record.size, interface_name))
+
+    try:
+        if engine == 'raw':
+            sniffer = RawSniffer(handle_record, iface=iface, filter=bpf_expression, fanout_group=fanout_group)
+        else:
+            from scapy.all import AsyncSniffer
+            sniffer = AsyncSniffer(iface=iface, prn=lambda packet: handle_record(scapy_packet_to_record(packet)),
+                                   store=0, filter=bpf_expression)
+        sniffer.start()
+    except Exception as e:
+        print(f"Capture worker {worker_id} failed to start on {interface_name}: {e}")
+        if writer:
+            writer.stop()
+        return
+
+    last_flush = time.time()
+    stopping = False
+    try:
+        while not stopping:
+            # The stop pipe turns readable when the app closes its end, including when it exits
+            stopping = stop.poll(flush_interval)
+            now = time.time()
+            delta = counters.take_delta()
+            delta.update({
+                'worker_id': worker_id,
+                'iface': interface_name,
+                'pid': os.getpid(),
+                'interval': now - last_flush,
+                'timestamp': now,
+                'db_rows_dropped': writer.rows_dropped if writer else 0
+            })
+            last_flush = now
+            try:
+                deltas.send(delta)
+            except OSError:
+                break  # The app is gone
+    finally:
+        sniffer.stop()
+        if writer:
+            writer.stop()
+
+
+def run_worker_launcher(commands, app_end):
+    """Launcher process: fork a capture worker for every request until the app closes the pipe"""
+    app_end.close()
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)  # The kernel reaps exited workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Workers stop when the app closes their stop pipe
+    while True:
+        try:
+            args = commands.recv()
+            deltas = Connection(reduction.recv_handle(commands), readable=False)
+            stop = Connection(reduction.recv_handle(commands), writable=False)
+        except EOFError:
+            return
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            commands.close()
+            code = 1
+            try:
+                run_capture_worker(*args, deltas, stop)
+                code = 0
+            except Exception:
+                traceback.print_exc()
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(code)
+        deltas.close()
+        stop.close()
+        commands.send(pid)
+
+
+class WorkerLauncher:
+    """Forks capture workers from a helper process forked before the app started any threads.
+
+    Forking a worker straight from the app would copy every lock its other
+    threads hold at that moment (stdout, SQLite, the socket.io server) into
+    a child that can never release them. The helper stays single-threaded,
+    so workers forked from it start clean and still share the imported
+    modules copy-on-write. Each worker gets a pipe for its deltas and a stop
+    pipe whose other ends stay in this process.
+    """
+
+    def __init__(self):
+        context = multiprocessing.get_context('fork')
+        self.commands, launcher_end = context.Pipe()
+        self.lock = threading.Lock()
+        self.process = context.Process(target=run_worker_launcher, args=(launcher_end, self.commands),
+                                       name='capture-worker-launcher', daemon=True)
+        self.process.start()
+        launcher_end.close()
+
+    def launch(self, args):
+        """Fork a worker running run_capture_worker(*args, ...); returns (pid, delta connection, stop connection)"""
+        deltas, worker_deltas = multiprocessing.Pipe(duplex=False)
+        worker_stop, stop = multiprocessing.Pipe(duplex=False)
+        try:
+            with self.lock:
+                self.commands.send(args)
+                reduction.send_handle(self.commands, worker_deltas.fileno(), self.process.pid)
+                reduction.send_handle(self.commands, worker_stop.fileno(), self.process.pid)
+                pid = self.commands.recv()
+        finally:
+            worker_deltas.close()
+            worker_stop.close()
+        return pid, deltas, stop
+
+
+class WorkerProcess:
+    """A worker forked by the launcher, with the Process methods the pool uses"""
+
+    def __init__(self, pid, deltas, stop):
+        self.pid = pid
+        self.deltas = deltas
+        self.stop = stop
+        self.exited = threading.Event()  # Set once its delta pipe reaches EOF
+
+    def is_alive(self):
+        return not self.exited.is_set()
+
+    def join(self, timeout=None):
+        self.exited.wait(timeout)
+
+    def terminate(self):
+        if self.is_alive():
+            try:
+                os.kill(self.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+
+worker_launcher = None  # Set by start_worker_launcher()
+
+
+def start_worker_launcher():
+    """Fork the launcher that CaptureWorkerPool needs; call before the process starts any threads.
+
+    Returns the launcher, or None where the fork start method is not available.
+    """
+    global worker_launcher
+    if worker_launcher is None and 'fork' in multiprocessing.get_all_start_methods():
+        worker_launcher = WorkerLauncher()
+    return worker_launcher
+
+
+class CaptureWorkerPool:
+    """Runs capture in worker processes and merges their counter deltas in this process.
+
+    One process is started per interface, or workers_per_interface processes
+    sharing each interface through a PACKET_FANOUT group (raw engine only).
+    Mirrors the AsyncSniffer start/stop interface.
+    """
+
+    def __init__(self, interfaces, on_delta, engine='raw', workers_per_interface=1, bpf_expression=None,
+                 filters=None, kernel_filters=(), flush_interval=1.0, sample_size=200,
+                 partition_dir='packet_partitions', partition_granularity='hour'):
+        self.interfaces = interfaces or [None]
+        self.on_delta = on_delta
+        self.engine = engine
+        self.workers_per_interface = max(1, int(workers_per_interface))
+        self.bpf_expression = bpf_expression
+        self.filters = dict(filters or {})
+        self.kernel_filters = list(kernel_filters)
+        self.flush_interval = flush_interval
+        self.sample_size = sample_size
+        self.partition_dir = partition_dir
+        self.partition_granularity = partition_granularity
+
+        self.processes = []
+        self.aggregator = None
+        self.running = False
+        self.worker_stats = {}
+        self.stats_lock = threading.Lock()
+
+    def start(self):
+        """Start the worker processes and the aggregator thread"""
+        if self.workers_per_interface > 1 and self.engine != 'raw':
+            raise ValueError('Several workers per interface require the raw engine (PACKET_FANOUT)')
+        if worker_launcher is None:
+            raise RuntimeError('Capture worker processes need start_worker_launcher() and the fork start method')
+
+        worker_id = 0
+        for index, iface in enumerate(self.interfaces):
+            fanout_group = (os.getpid() + index) & 0xFFFF if self.workers_per_interface > 1 else None
+            for _ in range(self.workers_per_interface):
+                process = WorkerProcess(*worker_launcher.launch(
+                    (worker_id, iface, self.engine, self.bpf_expression, self.filters, self.kernel_filters,
+                     fanout_group, self.flush_interval, self.sample_size, self.partition_dir,
+                     self.partition_granularity)))
+                self.processes.append(process)
+                with self.stats_lock:
+                    self.worker_stats[worker_id] = {
+                        'worker_id': worker_id,
+                        'iface': iface or 'default',
+                        'pid': process.pid,
+                        'packets': 0,
+                        'bytes': 0,
+                        'pps': 0.0,
+                        'bps': 0.0,
+                        'db_rows_dropped': 0,
+                        'last_update': None
+                    }
+                worker_id += 1
+
+        self.running = True
+        self.aggregator = threading.Thread(target=self._aggregate, name='capture-worker-aggregator')
+        self.aggregator.daemon = True
+        self.aggregator.start()
+
+    def stop(self, timeout=3):
+        """Stop the workers, merging their final deltas"""
+        for process in self.processes:
+            process.stop.close()
+        for process in self.processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        self.running = False
+        if self.aggregator:
+            self.aggregator.join(timeout)
+        self._drain()
+        self.processes = []
+
+    def get_worker_stats(self):
+        """Get per-worker counters and rates"""
+        with self.stats_lock:
+            stats = [dict(entry) for entry in self.worker_stats.values()]
+        for entry, process in zip(stats, self.processes):
+            entry['alive'] = process.is_alive()
+        return stats
+
+    def _handle_delta(self, delta):
+        """Update per-worker rates and hand the delta to the merge callback"""
+        interval = delta['interval'] or self.flush_interval
+        with self.stats_lock:
+            entry = self.worker_stats.get(delta['worker_id'])
+            if entry is not None:
+                entry['packets'] += delta['packets']
+                entry['bytes'] += delta['bytes']
+                entry['pps'] = delta['packets'] / interval
+                entry['bps'] = delta['bytes'] * 8 / interval
+                entry['db_rows_dropped'] = delta['db_rows_dropped']
+                entry['last_update'] = delta['timestamp']
+        try:
+            self.on_delta(delta)
+        except Exception as e:
+            print(f"Error merging capture worker delta: {e}")
+
+    def _receive(self, process):
+        """Merge one delta from a worker's pipe, or mark the worker exited at EOF"""
+        try:
+            delta = process.deltas.recv()
+        except (EOFError, OSError):
+            process.exited.set()
+            return
+        self._handle_delta(delta)
+
+    def _aggregate(self):
+        """Aggregator loop fed by the workers' delta pipes"""
+        while self.running:
+            by_connection = {process.deltas: process for process in self.processes if process.is_alive()}
+            if not by_connection:
+                time.sleep(0.5)
+                continue
+            for connection in wait(list(by_connection), timeout=0.5):
+                self._receive(by_connection[connection])
+
+    def _drain(self):
+        """Merge whatever deltas are still in the pipes, then close them"""
+        for process in self.processes:
+            while process.is_alive() and process.deltas.poll(0.1):
+                self._receive(process)
+            process.deltas.close()
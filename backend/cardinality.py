@@ -0,0 +1,226 @@
+import hashlib
+import math
+import struct
+from collections import deque
+from functools import lru_cache
+
+from heavy_hitters import network_key, subnet_key
+
+FAMILIES = ('subnet', 'network', 'country', 'asn', 'dst_port')
+INVERSE_POWERS = [2.0 ** -rank for rank in range(66)]
+
+
+@lru_cache(maxsize=65536)
+def hash_value(value):
+    """Stable 64-bit hash, identical across processes (unlike hash())"""
+    return int.from_bytes(hashlib.blake2b(str(value).encode(), digest_size=8).digest(), 'little')
+
+
+class HyperLogLog:
+    """Mergeable distinct counter using 2 ** precision one-byte registers.
+
+    Small sets are kept as their exact 64-bit hashes (so most per-key
+    counters stay tiny and exact) and switch to registers after
+    2 ** precision / 16 values, bounding every counter to a few KB.
+    The standard error of the dense estimate is 1.04 / sqrt(2 ** precision).
+    """
+
+    def __init__(self, precision=10):
+        self.precision = precision
+        self.m = 1 << precision
+        self.sparse = set()  # Exact hashes while small
+        self.registers = None
+
+    def add(self, value):
+        """Add a value"""
+        self.add_hash(hash_value(value))
+
+    def add_hash(self, h):
+        """Add a value by its hash_value()"""
+        if self.registers is None:
+            self.sparse.add(h)
+            if len(self.sparse) > self.m >> 4:
+                self._densify()
+            return
+        index = h & (self.m - 1)
+        rank = 65 - self.precision - (h >> self.precision).bit_length()
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def count(self):
+        """Estimated number of distinct values"""
+        if self.registers is None:
+            return len(self.sparse)
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(map(INVERSE_POWERS.__getitem__, self.registers))
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # Linear counting is more accurate for small cardinalities
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def merge(self, other):
+        """Fold another counter with the same precision into this one"""
+        if other.precision != self.precision:
+            raise ValueError('Cannot merge HyperLogLog counters with different precision')
+        if other.registers is None:
+            for h in other.sparse:
+                self.add_hash(h)
+            return
+        if self.registers is None:
+            self._densify()
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def copy(self):
+        counter = HyperLogLog(self.precision)
+        counter.sparse = set(self.sparse)
+        counter.registers = bytearray(self.registers) if self.registers is not None else None
+        return counter
+
+    def to_bytes(self):
+        """Serialize for merging in another process"""
+        if self.registers is None:
+            return b'S' + bytes([self.precision]) + struct.pack(f'<{len(self.sparse)}Q', *self.sparse)
+        return b'D' + bytes([self.precision]) + bytes(self.registers)
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Rebuild a counter serialized with to_bytes()"""
+        counter = cls(data[1])
+        if data[:1] == b'S':
+            counter.sparse = set(struct.unpack(f'<{(len(data) - 2) // 8}Q', data[2:]))
+        else:
+            counter.registers = bytearray(data[2:])
+        return counter
+
+    def _densify(self):
+        """Switch from exact hashes to registers"""
+        self.registers = bytearray(self.m)
+        sparse, self.sparse = self.sparse, set()
+        for h in sparse:
+            self.add_hash(h)
+
+
+class DistinctCounters:
+    """HyperLogLog distinct counts kept per subnet, network, country, ASN, destination port and time bucket.
+
+    Per key: distinct IPs seen in each /24 subnet, /16 network, country and
+    ASN, and distinct sources per destination port. Per time bucket:
+    distinct sources, destinations and sources per destination port, so
+    questions like "how many sources hit port 22 in the last minute" merge
+    a few buckets instead of scanning packets. Bucket time follows packet
+    timestamps. Adding a value twice never changes a counter, so the IPs
+    already placed in their per-key counters are remembered (up to
+    seen_limit of them) and skipped. Callers serialize access.
+    """
+
+    def __init__(self, precision=10, bucket_seconds=60, bucket_count=60, seen_limit=65536):
+        self.precision = precision
+        self.bucket_seconds = bucket_seconds
+        self.seen_limit = seen_limit
+        self.seen = {}  # ip -> whether its country/ASN were counted too
+        self.totals = {name: HyperLogLog(precision) for name in ('sources', 'destinations', 'dst_ports')}
+        self.keyed = {family: {} for family in FAMILIES}
+        self.buckets = deque(maxlen=bucket_count)  # [start, sources, destinations, {port: sources}]
+
+    def add_packet(self, timestamp, src, dst, dst_port=None, src_geo=None, dst_geo=None):
+        """Account one packet's endpoints (geo dicts from the GeoIP cache, if known)"""
+        src_hash = hash_value(src)
+        dst_hash = hash_value(dst)
+        bucket = self._bucket(timestamp)
+        self.totals['sources'].add_hash(src_hash)
+        self.totals['destinations'].add_hash(dst_hash)
+        bucket[1].add_hash(src_hash)
+        bucket[2].add_hash(dst_hash)
+
+        seen = self.seen
+        for ip, h, geo in ((src, src_hash, src_geo), (dst, dst_hash, dst_geo)):
+            counted = seen.get(ip)
+            if counted is None:
+                self._counter('subnet', subnet_key(ip)).add_hash(h)
+                self._counter('network', network_key(ip)).add_hash(h)
+            elif counted or not geo:
+                continue
+            if geo:
+                self._counter('country', geo.get('country', 'Unknown')).add_hash(h)
+                self._counter('asn', geo.get('asn', 'Unknown')).add_hash(h)
+            if len(seen) >= self.seen_limit:
+                seen.clear()
+            seen[ip] = bool(geo)
+
+        if dst_port:
+            self.totals['dst_ports'].add_hash(hash_value(dst_port))
+            self._counter('dst_port', dst_port).add_hash(src_hash)
+            port_sources = bucket[3].get(dst_port)
+            if port_sources is None:
+                port_sources = bucket[3][dst_port] = HyperLogLog(self.precision)
+            port_sources.add_hash(src_hash)
+
+    def distinct(self, family, key):
+        """Distinct IPs for a subnet/network/country/ASN key, or distinct sources for a destination port"""
+        counter = self.keyed[family].get(key)
+        return counter.count() if counter else 0
+
+    def window(self, seconds=60, dst_port=None):
+        """Distinct sources and destinations (or sources of one destination port) in the last seconds"""
+        if not self.buckets:
+            return {'sources': 0, 'destinations': 0}
+        since = self.buckets[-1][0] + self.bucket_seconds - seconds
+        sources = HyperLogLog(self.precision)
+        destinations = HyperLogLog(self.precision)
+        for start, bucket_sources, bucket_destinations, port_sources in self.buckets:
+            if start + self.bucket_seconds <= since:
+                continue
+            if dst_port is None:
+                sources.merge(bucket_sources)
+                destinations.merge(bucket_destinations)
+            elif dst_port in port_sources:
+                sources.merge(port_sources[dst_port])
+        if dst_port is not None:
+            return {'sources': sources.count()}
+        return {'sources': sources.count(), 'destinations': destinations.count()}
+
+    def merge(self, other):
+        """Fold counters from another interface or process into these"""
+        for name, counter in other.totals.items():
+            self.totals[name].merge(counter)
+        for family, counters in other.keyed.items():
+            for key, counter in counters.items():
+                self._counter(family, key).merge(counter)
+        buckets = {bucket[0]: bucket for bucket in self.buckets}
+        for start, sources, destinations, port_sources in other.buckets:
+            bucket = buckets.get(start)
+            if bucket is None:
+                bucket = buckets[start] = [start, HyperLogLog(self.precision), HyperLogLog(self.precision), {}]
+            bucket[1].merge(sources)
+            bucket[2].merge(destinations)
+            for port, counter in port_sources.items():
+                if port not in bucket[3]:
+                    bucket[3][port] = HyperLogLog(self.precision)
+                bucket[3][port].merge(counter)
+        self.buckets = deque(sorted(buckets.values(), key=lambda bucket: bucket[0]), maxlen=self.buckets.maxlen)
+
+    def get_stats(self):
+        """Overall distinct counts and how many keys each family tracks"""
+        stats = {name: counter.count() for name, counter in self.totals.items()}
+        stats['keys'] = {family: len(counters) for family, counters in self.keyed.items()}
+        stats['buckets'] = len(self.buckets)
+        return stats
+
+    def _counter(self, family, key):
+        counters = self.keyed[family]
+        counter = counters.get(key)
+        if counter is None:
+            counter = counters[key] = HyperLogLog(self.precision)
+        return counter
+
+    def _bucket(self, timestamp):
+        """The bucket covering timestamp (late packets count towards the newest bucket)"""
+        buckets = self.buckets
+        if buckets and timestamp < buckets[-1][0] + self.bucket_seconds:
+            return buckets[-1]
+        start = timestamp - timestamp % self.bucket_seconds
+        bucket = [start, HyperLogLog(self.precision), HyperLogLog(self.precision), {}]
+        buckets.append(bucket)
+        return bucket
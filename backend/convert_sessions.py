@@ -0,0 +1,49 @@
+import argparse
+import glob
+import json
+import os
+
+from session_file import COMPRESSION_EXTENSIONS, open_session_file, read_session_file
+
+# session_info fields that are only known once the session has ended
+END_FIELDS = ('end_time', 'duration', 'packet_count')
+
+
+def convert_session_file(path, compression=None, output_dir=None):
+    """Convert a single-document session JSON file into an NDJSON session file"""
+    session_info, packets = read_session_file(path)
+    session_info = dict(session_info)
+    session_info.pop('packets', None)
+    end_info = {field: session_info.pop(field) for field in END_FIELDS if field in session_info}
+
+    base = os.path.splitext(os.path.basename(path))[0]
+    output = os.path.join(output_dir or os.path.dirname(path), base + '.ndjson' + COMPRESSION_EXTENSIONS[compression])
+
+    count = 0
+    with open_session_file(output, 'wb') as f:
+        f.write((json.dumps({'session_info': session_info}, separators=(',', ':')) + '\n').encode())
+        for packet in packets:
+            f.write((json.dumps(packet, separators=(',', ':')) + '\n').encode())
+            count += 1
+        end_info['packet_count'] = count
+        f.write((json.dumps({'session_end': end_info}, separators=(',', ':')) + '\n').encode())
+    return output, count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Convert saved session JSON files to append-only NDJSON session files')
+    parser.add_argument('files', nargs='*', help='Session JSON files (default: session_*.json in the current directory)')
+    parser.add_argument('--compression', choices=['gzip', 'zstd'], help='Compress the output (zstd requires zstandard)')
+    parser.add_argument('--output-dir', help='Directory for the converted files (default: next to each input)')
+    parser.add_argument('--delete', action='store_true', help='Remove each JSON file after it is converted')
+    args = parser.parse_args()
+
+    for path in args.files or sorted(glob.glob('session_*.json')):
+        try:
+            output, count = convert_session_file(path, args.compression, args.output_dir)
+        except Exception as e:
+            print(f"Error converting {path}: {e}")
+            continue
+        print(f"{path} -> {output} ({count} packets)")
+        if args.delete:
+            os.remove(path)
@@ -0,0 +1,305 @@
+import argparse
+import sqlite3
+import threading
+import time
+
+
+def _add_indexes(cursor):
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_packets_timestamp ON packets (timestamp)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_packets_src_ip ON packets (src_ip, timestamp)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_packets_dst_ip ON packets (dst_ip, timestamp)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_alerts_timestamp ON alerts (timestamp)')
+
+
+def _add_packets_hourly(cursor):
+    # Per-hour conversation totals kept after raw packet rows expire
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS packets_hourly (
+            hour INTEGER,
+            src_ip TEXT,
+            dst_ip TEXT,
+            protocol INTEGER,
+            interface TEXT,
+            packets INTEGER,
+            bytes INTEGER,
+            PRIMARY KEY (hour, src_ip, dst_ip, protocol, interface)
+        )
+    ''')
+
+
+def _enable_incremental_vacuum(cursor):
+    # Only takes effect on a rebuilt file; this is a one-off copy of the database
+    cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    cursor.execute('VACUUM')
+
+
+# (version, description, function(cursor), rebuilds the file); applied in order to databases below that version
+MIGRATIONS = [
+    (1, 'Index packets by time and address, alerts by time', _add_indexes, False),
+    (2, 'Hourly packet totals for expired rows', _add_packets_hourly, False),
+    (3, 'Incremental vacuum for compaction', _enable_incremental_vacuum, True)
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def migrate_database(db_path='nta_data.db', rebuild=False):
+    """Switch the database to WAL and apply pending migrations; returns the schema version.
+
+    Migrations that rebuild the file (a full VACUUM: minutes on a large
+    database, and free disk space for a copy of it) only run with rebuild,
+    otherwise they and any later ones stay pending. A failed migration is
+    rolled back and reported, leaving the database at the last version
+    that succeeded.
+    """
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)  # Autocommit, so VACUUM can run
+    try:
+        cursor = conn.cursor()
+        try:
+            cursor.execute('PRAGMA journal_mode = WAL')
+        except sqlite3.Error as e:
+            print(f"Error switching {db_path} to WAL mode: {e}")
+        version = cursor.execute('PRAGMA user_version').fetchone()[0]
+        for target, description, migration, rebuilds in MIGRATIONS:
+            if version >= target:
+                continue
+            if rebuilds and not rebuild:
+                print(f"Schema version {target} of {db_path} ({description}) rebuilds the file; apply it with "
+                      f"NTA_DB_REBUILD=1 or python db_maintenance.py --rebuild {db_path}")
+                break
+            print(f"Migrating {db_path} to schema version {target}: {description}")
+            try:
+                if not rebuilds:
+                    cursor.execute('BEGIN IMMEDIATE')
+                migration(cursor)
+                cursor.execute(f'PRAGMA user_version = {target}')
+                if not rebuilds:
+                    cursor.execute('COMMIT')
+            except sqlite3.Error as e:
+                if conn.in_transaction:
+                    cursor.execute('ROLLBACK')
+                print(f"Error migrating {db_path} to schema version {target}: {e}")
+                break
+            version = target
+        return version
+    finally:
+        conn.close()
+
+
+class RetentionJob:
+    """Background job that expires old rows in small chunks.
+
+    Every interval seconds, packet rows older than packet_retention seconds
+    are deleted, or with mode 'downsample' first summed into packets_hourly
+    per (hour, src, dst, protocol, interface). Alerts older than
+    alert_retention are deleted. Each chunk of chunk_size rows is its own
+    short transaction followed by a pause, so the packet writer is never
+    locked out for long. Freed pages are returned to the filesystem with
+    an incremental vacuum and the WAL is checkpointed afterwards. A
+    retention of 0 keeps rows forever.
+
+    With a PacketPartitionRouter as partitions, packet retention removes
+    whole partition files instead (summed into packets_hourly first when
+    downsampling); the packets table in db_path only holds rows written
+    before partitioning and is expired as above.
+    """
+
+    def __init__(self, db_path='nta_data.db', packet_retention=7 * 86400, alert_retention=30 * 86400,
+                 mode='downsample', interval=300, chunk_size=5000, pause=0.05, partitions=None):
+        if mode not in ('delete', 'downsample'):
+            raise ValueError(f'Unknown retention mode: {mode}')
+        self.db_path = db_path
+        self.packet_retention = packet_retention
+        self.alert_retention = alert_retention
+        self.mode = mode
+        self.interval = interval
+        self.chunk_size = chunk_size
+        self.pause = pause
+        self.partitions = partitions
+        self.thread = None
+        self.running = False
+        self.wake = threading.Event()
+
+        # Counters exposed through the stats API
+        self.runs = 0
+        self.packets_expired = 0
+        self.partitions_expired = 0
+        self.alerts_expired = 0
+        self.pages_freed = 0
+        self.last_run_seconds = 0.0
+        self.last_error = None
+
+    def start(self):
+        """Start the retention thread"""
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name='db-retention')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self, timeout=5):
+        """Stop the retention thread"""
+        self.running = False
+        self.wake.set()
+        if self.thread:
+            self.thread.join(timeout)
+            self.thread = None
+
+    def run_once(self, now=None):
+        """Expire old rows and compact the file"""
+        started = time.time()
+        now = started if now is None else now
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        try:
+            if self.packet_retention:
+                if self.partitions is not None:
+                    self._expire_partitions(conn, now - self.packet_retention)
+                self.packets_expired += self._expire_packets(conn, now - self.packet_retention)
+            if self.alert_retention:
+                self.alerts_expired += self._expire_chunks(
+                    conn, 'DELETE FROM alerts WHERE id IN (SELECT id FROM alerts WHERE timestamp < ? LIMIT ?)',
+                    now - self.alert_retention)
+            freelist = conn.execute('PRAGMA freelist_count').fetchone()[0]
+            while freelist and self._is_running():
+                # executescript steps the pragma to completion; execute() frees a single page
+                conn.executescript(f'PRAGMA incremental_vacuum({self.chunk_size});')
+                remaining = conn.execute('PRAGMA freelist_count').fetchone()[0]
+                self.pages_freed += freelist - remaining
+                if remaining >= freelist:
+                    break
+                freelist = remaining
+                time.sleep(self.pause)
+            conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchall()
+        finally:
+            conn.close()
+        self.runs += 1
+        self.last_run_seconds = time.time() - started
+
+    def get_stats(self):
+        return {
+            'running': self.running,
+            'mode': self.mode,
+            'packet_retention': self.packet_retention,
+            'alert_retention': self.alert_retention,
+            'runs': self.runs,
+            'packets_expired': self.packets_expired,
+            'partitions_expired': self.partitions_expired,
+            'alerts_expired': self.alerts_expired,
+            'pages_freed': self.pages_freed,
+            'last_run_seconds': self.last_run_seconds,
+            'last_error': self.last_error
+        }
+
+    def _expire_partitions(self, conn, cutoff):
+        """Delete partition files that ended before cutoff, downsampling them first"""
+        for start, _, path in self.partitions.expired(cutoff):
+            self.partitions.retire(start, path)
+        # Also picks up partitions retired before a restart
+        for path in self.partitions.retired():
+            if not self._is_running():
+                break
+            if self.mode == 'downsample':
+                self._downsample_partition(conn, path)
+            self.partitions.delete(path)
+            self.partitions_expired += 1
+
+    def _downsample_partition(self, conn, path):
+        """Add a partition file's packets to packets_hourly"""
+        # Aggregate from the partition file, then insert in chunks so writers to conn are not held up
+        partition = sqlite3.connect(path)
+        try:
+            rows = partition.execute('''
+                SELECT CAST(timestamp / 3600 AS INTEGER) * 3600, src_ip, dst_ip, protocol, interface,
+                       COUNT(*), SUM(size)
+                FROM packets GROUP BY 1, 2, 3, 4, 5
+            ''').fetchall()
+        except sqlite3.OperationalError as e:
+            print(f"Error reading retired packet partition {path}: {e}")
+            return
+        finally:
+            partition.close()
+        for i in range(0, len(rows), self.chunk_size):
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.executemany('''
+                    INSERT INTO packets_hourly (hour, src_ip, dst_ip, protocol, interface, packets, bytes)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (hour, src_ip, dst_ip, protocol, interface) DO UPDATE SET
+                        packets = packets + excluded.packets,
+                        bytes = bytes + excluded.bytes
+                ''', rows[i:i + self.chunk_size])
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            time.sleep(self.pause)
+        self.packets_expired += sum(row[5] for row in rows)
+
+    def _expire_packets(self, conn, cutoff):
+        if self.mode == 'delete':
+            return self._expire_chunks(
+                conn, 'DELETE FROM packets WHERE id IN (SELECT id FROM packets WHERE timestamp < ? LIMIT ?)', cutoff)
+
+        expired = 0
+        conn.execute('CREATE TEMP TABLE IF NOT EXISTS expired_packets (id INTEGER PRIMARY KEY)')
+        while self._is_running():
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.execute('DELETE FROM expired_packets')
+                count = conn.execute('''
+                    INSERT INTO expired_packets SELECT id FROM packets WHERE timestamp < ? LIMIT ?
+                ''', (cutoff, self.chunk_size)).rowcount
+                conn.execute('''
+                    INSERT INTO packets_hourly (hour, src_ip, dst_ip, protocol, interface, packets, bytes)
+                    SELECT CAST(timestamp / 3600 AS INTEGER) * 3600, src_ip, dst_ip, protocol, interface,
+                           COUNT(*), SUM(size)
+                    FROM packets WHERE id IN (SELECT id FROM expired_packets)
+                    GROUP BY 1, 2, 3, 4, 5
+                    ON CONFLICT (hour, src_ip, dst_ip, protocol, interface) DO UPDATE SET
+                        packets = packets + excluded.packets,
+                        bytes = bytes + excluded.bytes
+                ''')
+                conn.execute('DELETE FROM packets WHERE id IN (SELECT id FROM expired_packets)')
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            expired += count
+            if count < self.chunk_size:
+                break
+            time.sleep(self.pause)
+        return expired
+
+    def _expire_chunks(self, conn, sql, cutoff):
+        """Run a chunked DELETE (parameters: cutoff, chunk size) until it deletes less than a chunk"""
+        expired = 0
+        while self._is_running():
+            count = conn.execute(sql, (cutoff, self.chunk_size)).rowcount
+            expired += count
+            if count < self.chunk_size:
+                break
+            time.sleep(self.pause)
+        return expired
+
+    def _is_running(self):
+        # run_once() is also called directly, without the thread
+        return self.running or self.thread is None
+
+    def _run(self):
+        while self.running:
+            try:
+                self.run_once()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"Error running database retention: {e}")
+            self.wake.wait(self.interval)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Apply pending schema migrations to an NTA database')
+    parser.add_argument('database', nargs='?', default='nta_data.db')
+    parser.add_argument('--rebuild', action='store_true',
+                        help='Also apply migrations that rebuild the file (stop the server first)')
+    args = parser.parse_args()
+    print(f"Schema version {migrate_database(args.database, args.rebuild)} of {SCHEMA_VERSION}")
@@ -0,0 +1,136 @@
+import queue
+import sqlite3
+import threading
+import time
+
+
+class BatchedPacketWriter:
+    """Background writer that batches packet rows into SQLite"""
+
+    INSERT_SQL = '''
+        INSERT INTO packets (timestamp, src_ip, dst_ip, protocol, size, interface)
+        VALUES (?, ?, ?, ?, ?, ?)
+    '''
+    THREAD_NAME = 'packet-db-writer'
+
+    def __init__(self, db_path='nta_data.db', max_queue_size=50000, batch_size=1000, flush_interval=0.5):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.thread = None
+        self.running = False
+
+        # Counters exposed through the stats API
+        self.rows_written = 0
+        self.rows_dropped = 0
+        self.batches_written = 0
+        self.last_batch_size = 0
+        self.last_batch_latency = 0.0
+        self.max_batch_latency = 0.0
+        self.total_batch_latency = 0.0
+        self.errors = 0
+
+    def start(self):
+        """Start the writer thread"""
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name=self.THREAD_NAME)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self, timeout=5):
+        """Stop the writer thread after flushing queued rows"""
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout)
+            self.thread = None
+
+    def submit(self, row):
+        """Queue a packet row without blocking; returns False if it was dropped"""
+        try:
+            self.queue.put_nowait(row)
+            return True
+        except queue.Full:
+            self.rows_dropped += 1
+            return False
+
+    def get_stats(self):
+        """Get writer counters"""
+        return {
+            'running': self.running,
+            'queue_depth': self.queue.qsize(),
+            'queue_capacity': self.queue.maxsize,
+            'rows_written': self.rows_written,
+            'rows_dropped': self.rows_dropped,
+            'batches_written': self.batches_written,
+            'last_batch_size': self.last_batch_size,
+            'last_batch_latency_ms': self.last_batch_latency * 1000,
+            'max_batch_latency_ms': self.max_batch_latency * 1000,
+            'avg_batch_latency_ms': (self.total_batch_latency / self.batches_written * 1000) if self.batches_written else 0.0,
+            'errors': self.errors
+        }
+
+    def _collect_batch(self):
+        """Collect rows until the batch is full or the flush interval has elapsed"""
+        batch = []
+        deadline = time.time() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _drain(self):
+        """Take everything currently queued"""
+        batch = []
+        while True:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                return batch
+
+    def _write_batch(self, conn, batch):
+        """Insert a batch of rows in a single transaction"""
+        started = time.time()
+        try:
+            conn.executemany(self.INSERT_SQL, batch)
+            conn.commit()
+        except Exception as e:
+            self.errors += 1
+            print(f"Error writing batch to database ({self.THREAD_NAME}): {e}")
+            return
+        latency = time.time() - started
+        self.rows_written += len(batch)
+        self.batches_written += 1
+        self.last_batch_size = len(batch)
+        self.last_batch_latency = latency
+        self.total_batch_latency += latency
+        self.max_batch_latency = max(self.max_batch_latency, latency)
+
+    def _connect(self):
+        """Open the writer's long-lived connection"""
+        conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        conn.execute('PRAGMA synchronous = NORMAL')  # Durable enough in WAL mode, and no fsync per batch
+        return conn
+
+    def _run(self):
+        """Writer loop running on one long-lived connection"""
+        conn = self._connect()
+        try:
+            while self.running:
+                batch = self._collect_batch()
+                if batch:
+                    self._write_batch(conn, batch)
+
+            # Flush whatever is left before exiting
+            batch = self._drain()
+            for i in range(0, len(batch), self.batch_size):
+                self._write_batch(conn, batch[i:i + self.batch_size])
+        finally:
+            conn.close()
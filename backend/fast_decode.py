@@ -0,0 +1,384 @@
+import socket
+import struct
+import threading
+import time
+
+# scapy is optional here; it is only needed to convert packets from the scapy engine
+try:
+    from scapy.layers.inet import IP, TCP, UDP
+    from scapy.layers.inet6 import IPv6
+except ImportError:
+    IP = TCP = UDP = IPv6 = None
+
+# Link-layer header types (see pcap-linktype(7))
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4 = 228
+LINKTYPE_IPV6 = 229
+LINKTYPE_LINUX_SLL2 = 276
+
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_IPV6 = 0x86DD
+ETHERTYPE_VLAN = (0x8100, 0x88A8, 0x9100)
+
+PROTO_TCP = 6
+PROTO_UDP = 17
+
+ETH_P_ALL = 0x0003
+SOL_PACKET = 263
+PACKET_FANOUT = 18
+PACKET_FANOUT_HASH = 0
+
+_unpack_u16 = struct.Struct('!H').unpack_from
+_unpack_ports = struct.Struct('!HH').unpack_from
+_inet_ntoa = socket.inet_ntoa
+
+
+def _inet6_ntoa(packed):
+    return socket.inet_ntop(socket.AF_INET6, packed)
+
+
+class PacketRecord:
+    """Lightweight per-packet record shared by the scapy and raw capture engines"""
+
+    __slots__ = ('timestamp', 'src', 'dst', 'protocol', 'size', 'src_port', 'dst_port', 'tcp_flags', 'raw',
+                 'linktype')
+
+    def __init__(self, timestamp, size, src=None, dst=None, protocol=0, src_port=None, dst_port=None,
+                 tcp_flags=None, raw=None, linktype=LINKTYPE_ETHERNET):
+        self.timestamp = timestamp
+        self.size = size
+        self.src = src
+        self.dst = dst
+        self.protocol = protocol
+        self.src_port = src_port
+        self.dst_port = dst_port
+        self.tcp_flags = tcp_flags
+        self.raw = raw
+        self.linktype = linktype
+
+    def __len__(self):
+        return self.size
+
+    def __repr__(self):
+        return (f'PacketRecord({self.src}:{self.src_port} -> {self.dst}:{self.dst_port}, '
+                f'proto={self.protocol}, size={self.size})')
+
+
+def _scapy_linktype(packet):
+    """Link-layer type of a scapy packet, based on its outermost layer"""
+    if IP is None:
+        return LINKTYPE_ETHERNET
+    if isinstance(packet, IP):
+        return LINKTYPE_IPV4
+    if isinstance(packet, IPv6):
+        return LINKTYPE_IPV6
+    from scapy.config import conf
+    return conf.l2types.layer2num.get(type(packet), LINKTYPE_ETHERNET)
+
+
+def frame_bytes(record):
+    """Return the captured frame of a record as bytes (None when unavailable)"""
+    raw = record.raw
+    if raw is None or isinstance(raw, bytes):
+        return raw
+    if isinstance(raw, (bytearray, memoryview)):
+        return bytes(raw)
+    # scapy keeps the bytes it dissected; rebuilding the packet is the fallback
+    original = getattr(raw, 'original', None)
+    return original if original else bytes(raw)
+
+
+def scapy_packet_to_record(packet):
+    """Convert a dissected scapy packet into a PacketRecord"""
+    record = PacketRecord(time.time(), len(packet), raw=packet, linktype=_scapy_linktype(packet))
+    if IP in packet:
+        ip_layer = packet[IP]
+        record.protocol = ip_layer.proto
+    elif IPv6 in packet:
+        ip_layer = packet[IPv6]
+        record.protocol = ip_layer.nh
+    else:
+        return record
+    record.src = ip_layer.src
+    record.dst = ip_layer.dst
+
+    if TCP in packet:
+        record.src_port = packet[TCP].sport
+        record.dst_port = packet[TCP].dport
+        record.tcp_flags = int(packet[TCP].flags)
+    elif UDP in packet:
+        record.src_port = packet[UDP].sport
+        record.dst_port = packet[UDP].dport
+    return record
+
+
+def _decode_transport(record, frame, offset, protocol):
+    """Fill in ports (and TCP flags) from the transport header at offset"""
+    if protocol == PROTO_TCP:
+        if len(frame) >= offset + 14:
+            record.src_port, record.dst_port = _unpack_ports(frame, offset)
+            record.tcp_flags = frame[offset + 13]
+    elif protocol == PROTO_UDP:
+        if len(frame) >= offset + 4:
+            record.src_port, record.dst_port = _unpack_ports(frame, offset)
+
+
+def _decode_ip(record, frame, offset, version):
+    """Decode an IPv4/IPv6 header starting at offset"""
+    if version == 4:
+        if len(frame) < offset + 20:
+            return
+        ihl = (frame[offset] & 0x0F) * 4
+        protocol = frame[offset + 9]
+        record.protocol = protocol
+        record.src = _inet_ntoa(frame[offset + 12:offset + 16])
+        record.dst = _inet_ntoa(frame[offset + 16:offset + 20])
+        # Only the first fragment carries the transport header
+        if _unpack_u16(frame, offset + 6)[0] & 0x1FFF == 0:
+            _decode_transport(record, frame, offset + ihl, protocol)
+    elif version == 6:
+        if len(frame) < offset + 40:
+            return
+        protocol = frame[offset + 6]
+        record.protocol = protocol
+        record.src = _inet6_ntoa(bytes(frame[offset + 8:offset + 24]))
+        record.dst = _inet6_ntoa(bytes(frame[offset + 24:offset + 40]))
+        _decode_transport(record, frame, offset + 40, protocol)
+
+
+def decode_frame(frame, timestamp=None, linktype=LINKTYPE_ETHERNET, size=None):
+    """Decode a raw frame into a PacketRecord using fixed header offsets.
+
+    frame may be bytes or a memoryview; size is the original wire length
+    when the frame was truncated on capture. Non-IP frames produce a record
+    with only the size and timestamp set.
+    """
+    if timestamp is None:
+        timestamp = time.time()
+    record = PacketRecord(timestamp, size if size is not None else len(frame), raw=frame, linktype=linktype)
+
+    if linktype == LINKTYPE_ETHERNET:
+        if len(frame) < 14:
+            return record
+        offset = 12
+        ethertype = _unpack_u16(frame, offset)[0]
+        while ethertype in ETHERTYPE_VLAN and len(frame) >= offset + 6:
+            offset += 4
+            ethertype = _unpack_u16(frame, offset)[0]
+        offset += 2
+    elif linktype == LINKTYPE_LINUX_SLL:
+        if len(frame) < 16:
+            return record
+        ethertype = _unpack_u16(frame, 14)[0]
+        offset = 16
+    elif linktype == LINKTYPE_LINUX_SLL2:
+        if len(frame) < 20:
+            return record
+        ethertype = _unpack_u16(frame, 0)[0]
+        offset = 20
+    elif linktype == LINKTYPE_NULL:
+        if len(frame) < 5:
+            return record
+        # Address family is in host byte order; the IP version nibble is unambiguous
+        ethertype = ETHERTYPE_IPV6 if frame[4] >> 4 == 6 else ETHERTYPE_IPV4
+        offset = 4
+    elif linktype in (LINKTYPE_RAW, LINKTYPE_IPV4, LINKTYPE_IPV6, 12):
+        if len(frame) < 1:
+            return record
+        ethertype = ETHERTYPE_IPV6 if frame[0] >> 4 == 6 else ETHERTYPE_IPV4
+        offset = 0
+    else:
+        return record
+
+    if ethertype == ETHERTYPE_IPV4:
+        _decode_ip(record, frame, offset, 4)
+    elif ethertype == ETHERTYPE_IPV6:
+        _decode_ip(record, frame, offset, 6)
+    return record
+
+
+def read_pcap(path):
+    """Yield (timestamp, frame, original_length, linktype) from a pcap or pcapng file"""
+    with open(path, 'rb') as f:
+        magic = f.read(4)
+        if magic == b'\x0a\x0d\x0d\x0a':
+            yield from _read_pcapng(f, magic)
+        else:
+            yield from _read_classic_pcap(f, magic)
+
+
+def _read_classic_pcap(f, magic):
+    """Reader for libpcap files (micro- and nanosecond variants, either byte order)"""
+    magics = {
+        b'\xd4\xc3\xb2\xa1': ('<', 1e-6), b'\xa1\xb2\xc3\xd4': ('>', 1e-6),
+        b'\x4d\x3c\xb2\xa1': ('<', 1e-9), b'\xa1\xb2\x3c\x4d': ('>', 1e-9)
+    }
+    if magic not in magics:
+        raise ValueError('Not a pcap or pcapng file')
+    endian, resolution = magics[magic]
+    header = f.read(20)
+    if len(header) < 20:
+        raise ValueError('Truncated pcap header')
+    linktype = struct.unpack(endian + 'HHiIII', header)[-1] & 0x0FFFFFFF
+    record_header = struct.Struct(endian + 'IIII')
+
+    while True:
+        data = f.read(16)
+        if len(data) < 16:
+            return
+        ts_sec, ts_frac, caplen, origlen = record_header.unpack(data)
+        frame = f.read(caplen)
+        if len(frame) < caplen:
+            return
+        yield ts_sec + ts_frac * resolution, frame, origlen, linktype
+
+
+def _read_pcapng(f, magic):
+    """Reader for pcapng files (SHB, IDB, EPB and SPB blocks)"""
+    endian = '<'
+    interfaces = []  # (linktype, timestamp resolution) per interface id
+    data = magic + f.read(8)
+
+    while len(data) == 12:
+        block_type, block_length = struct.unpack(endian + 'II', data[:8])
+        if block_type == 0x0A0D0D0A:
+            # Section header: byte order magic decides the endianness of the section
+            endian = '<' if data[8:12] == b'\x4d\x3c\x2b\x1a' else '>'
+            block_length = struct.unpack(endian + 'I', data[4:8])[0]
+            interfaces = []
+            body = f.read(block_length - 12)
+        else:
+            body = data[8:] + f.read(block_length - 12)
+        if len(body) < block_length - 12:
+            return
+
+        if block_type == 1:
+            linktype = struct.unpack_from(endian + 'H', body, 0)[0]
+            interfaces.append((linktype, _pcapng_resolution(body[8:-4], endian)))
+        elif block_type == 6:
+            interface_id, ts_high, ts_low, caplen, origlen = struct.unpack_from(endian + 'IIIII', body, 0)
+            linktype, resolution = interfaces[interface_id] if interface_id < len(interfaces) else (LINKTYPE_ETHERNET, 1e-6)
+            yield ((ts_high << 32) | ts_low) * resolution, body[20:20 + caplen], origlen, linktype
+        elif block_type == 3:
+            origlen = struct.unpack_from(endian + 'I', body, 0)[0]
+            linktype = interfaces[0][0] if interfaces else LINKTYPE_ETHERNET
+            frame = body[4:4 + origlen]
+            yield time.time(), frame, origlen, linktype
+
+        data = f.read(12)
+
+
+def _pcapng_resolution(options, endian):
+    """Get the timestamp resolution from an interface description block's options"""
+    offset = 0
+    while offset + 4 <= len(options):
+        code, length = struct.unpack_from(endian + 'HH', options, offset)
+        if code == 0:
+            break
+        if code == 9 and length >= 1:
+            value = options[offset + 4]
+            return 2.0 ** -(value & 0x7F) if value & 0x80 else 10.0 ** -value
+        offset += 4 + ((length + 3) & ~3)
+    return 1e-6
+
+
+class RawSniffer:
+    """Capture engine that reads raw frames and decodes them without scapy.
+
+    Reads from an AF_PACKET socket on a live interface, or from a pcap/pcapng
+    file when offline is given. Mirrors the AsyncSniffer start/stop interface.
+    Sockets opened with the same fanout_group split the interface's flows.
+    """
+
+    def __init__(self, prn, iface=None, offline=None, filter=None, snaplen=65535, fanout_group=None):
+        self.prn = prn
+        self.iface = iface
+        self.offline = offline
+        self.filter = filter
+        self.snaplen = snaplen
+        self.fanout_group = fanout_group
+        self.running = False
+        self.thread = None
+        self.sock = None
+        self.packets = 0
+
+    def start(self):
+        """Open the source and start the reader thread"""
+        if self.offline is None:
+            self.sock = self._open_socket()
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name=f'raw-sniffer-{self.iface or self.offline}')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self, join=True):
+        """Stop the reader thread"""
+        self.running = False
+        if join and self.thread and self.thread is not threading.current_thread():
+            self.thread.join(2)
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def join(self, timeout=None):
+        """Wait for the reader thread to finish"""
+        if self.thread:
+            self.thread.join(timeout)
+
+    def _open_socket(self):
+        """Open an AF_PACKET socket, attaching the BPF filter if one is set"""
+        if not hasattr(socket, 'AF_PACKET'):
+            raise RuntimeError('Raw capture engine requires AF_PACKET sockets (Linux)')
+        sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL))
+        if self.iface:
+            sock.bind((self.iface, 0))
+        if self.fanout_group is not None:
+            # Sockets in the same fanout group share the interface's traffic by flow hash
+            sock.setsockopt(SOL_PACKET, PACKET_FANOUT, (self.fanout_group & 0xFFFF) | (PACKET_FANOUT_HASH << 16))
+        sock.settimeout(0.5)
+        if self.filter:
+            from scapy.arch.linux import attach_filter
+            attach_filter(sock, self.filter, self.iface)
+        return sock
+
+    def _run(self):
+        """Reader loop"""
+        try:
+            if self.offline is not None:
+                self._run_offline()
+            else:
+                self._run_live()
+        except Exception as e:
+            print(f"Error in raw capture engine: {e}")
+        finally:
+            self.running = False
+
+    def _run_live(self):
+        """Read frames from the AF_PACKET socket"""
+        buffer = bytearray(self.snaplen)
+        view = memoryview(buffer)
+        prn = self.prn
+        while self.running:
+            try:
+                length = self.sock.recv_into(buffer)
+            except socket.timeout:
+                continue
+            except OSError:
+                if not self.running:
+                    return
+                raise
+            # Copy the frame out of the receive buffer before it is reused
+            self.packets += 1
+            prn(decode_frame(bytes(view[:length]), time.time()))
+
+    def _run_offline(self):
+        """Read frames from a pcap/pcapng file as fast as possible"""
+        prn = self.prn
+        for timestamp, frame, origlen, linktype in read_pcap(self.offline):
+            if not self.running:
+                return
+            self.packets += 1
+            prn(decode_frame(frame, timestamp, linktype, origlen))
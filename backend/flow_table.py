@@ -0,0 +1,282 @@
+import heapq
+from collections import deque
+
+TCP_FLAG_NAMES = 'FSRPAUEC'
+
+
+def flow_key(src, dst, protocol, src_port, dst_port):
+    """Normalize a 5-tuple so both directions of a connection share one key.
+
+    Returns (key, forward) where forward is True when the packet travels
+    from the key's first endpoint to its second.
+    """
+    src_port = src_port or 0
+    dst_port = dst_port or 0
+    if (src, src_port) <= (dst, dst_port):
+        return (src, dst, protocol, src_port, dst_port), True
+    return (dst, src, protocol, dst_port, src_port), False
+
+
+def tcp_flags_to_str(flags):
+    """Render a TCP flags bitmask as letters, e.g. 0x12 -> 'SA'"""
+    return ''.join(name for bit, name in enumerate(TCP_FLAG_NAMES) if flags & (1 << bit))
+
+
+class Flow:
+    """Compact per-flow record; counters are kept per direction of the normalized key"""
+
+    __slots__ = ('key', 'initiator_forward', 'first_seen', 'last_seen', 'fwd_packets', 'fwd_bytes',
+                 'rev_packets', 'rev_bytes', 'tcp_flags')
+
+    def __init__(self, key, initiator_forward, timestamp):
+        self.key = key
+        self.initiator_forward = initiator_forward  # Whether the first packet went key[0] -> key[1]
+        self.first_seen = timestamp
+        self.last_seen = timestamp
+        self.fwd_packets = 0
+        self.fwd_bytes = 0
+        self.rev_packets = 0
+        self.rev_bytes = 0
+        self.tcp_flags = 0
+
+    @property
+    def packets(self):
+        return self.fwd_packets + self.rev_packets
+
+    @property
+    def bytes(self):
+        return self.fwd_bytes + self.rev_bytes
+
+    def to_dict(self):
+        """Describe the flow from the initiator's point of view"""
+        a, b, protocol, a_port, b_port = self.key
+        if self.initiator_forward:
+            src, dst, src_port, dst_port = a, b, a_port, b_port
+            out_packets, out_bytes, in_packets, in_bytes = self.fwd_packets, self.fwd_bytes, self.rev_packets, self.rev_bytes
+        else:
+            src, dst, src_port, dst_port = b, a, b_port, a_port
+            out_packets, out_bytes, in_packets, in_bytes = self.rev_packets, self.rev_bytes, self.fwd_packets, self.fwd_bytes
+        return {
+            'src': src,
+            'dst': dst,
+            'src_port': src_port,
+            'dst_port': dst_port,
+            'protocol': protocol,
+            'first_seen': self.first_seen,
+            'last_seen': self.last_seen,
+            'duration': self.last_seen - self.first_seen,
+            'packets_out': out_packets,
+            'bytes_out': out_bytes,
+            'packets_in': in_packets,
+            'bytes_in': in_bytes,
+            'packets': self.packets,
+            'bytes': self.bytes,
+            'tcp_flags': tcp_flags_to_str(self.tcp_flags)
+        }
+
+
+class FlowTable:
+    """Bidirectional 5-tuple flow table with idle/active timeouts driven by a timer wheel.
+
+    Each flow sits in exactly one wheel slot, scheduled for its earliest
+    possible expiry. Packets never move flows between slots; when the wheel
+    reaches a slot, flows that saw traffic in the meantime are rescheduled
+    and the rest expire. Updates are O(1) and the table holds at most
+    max_flows entries, evicting the flow closest to expiry when full.
+    The clock is the packet timestamps (so replays expire flows in capture
+    time); advance_clock() carries it on from the wall clock while no packets arrive.
+    Callers serialize access.
+    """
+
+    def __init__(self, idle_timeout=60.0, active_timeout=1800.0, max_flows=100000, tick=1.0, expired_history=1000):
+        self.idle_timeout = idle_timeout
+        self.active_timeout = active_timeout
+        self.max_flows = max_flows
+        self.tick = tick
+        self.wheel_size = int(max(idle_timeout, active_timeout) // tick) + 2
+        self.slots = [[] for _ in range(self.wheel_size)]
+        self.current_tick = None
+        self.next_tick_time = float('-inf')
+        self.stream_time = None  # Newest packet timestamp
+        self._clock_anchor = (None, 0.0)  # (stream time, wall clock) at the last tick that saw packets
+        self.flows = {}
+        self.expired = deque(maxlen=expired_history)  # Most recently finished flows, as dicts
+
+        # Counters exposed through the stats API
+        self.flows_created = 0
+        self.flows_expired_idle = 0
+        self.flows_expired_active = 0
+        self.flows_evicted = 0
+
+    def __len__(self):
+        return len(self.flows)
+
+    def update(self, timestamp, src, dst, protocol, src_port, dst_port, size, tcp_flags=None):
+        """Account one packet to its flow"""
+        if self.stream_time is None or timestamp > self.stream_time:
+            self.stream_time = timestamp
+        if timestamp >= self.next_tick_time:
+            self.advance(timestamp)
+        key, forward = flow_key(src, dst, protocol, src_port, dst_port)
+        flow = self.flows.get(key)
+        if flow is None:
+            flow = self._create(key, forward, timestamp)
+        if forward:
+            flow.fwd_packets += 1
+            flow.fwd_bytes += size
+        else:
+            flow.rev_packets += 1
+            flow.rev_bytes += size
+        if tcp_flags:
+            flow.tcp_flags |= tcp_flags
+        if timestamp > flow.last_seen:
+            flow.last_seen = timestamp
+
+    def merge(self, key, first_seen, last_seen, fwd_packets, fwd_bytes, rev_packets, rev_bytes, tcp_flags,
+              initiator_forward):
+        """Add counters for a normalized key accumulated elsewhere (e.g. by a capture worker)"""
+        if self.stream_time is None or last_seen > self.stream_time:
+            self.stream_time = last_seen
+        if last_seen >= self.next_tick_time:
+            self.advance(last_seen)
+        flow = self.flows.get(key)
+        if flow is None:
+            flow = self._create(key, initiator_forward, first_seen)
+        flow.fwd_packets += fwd_packets
+        flow.fwd_bytes += fwd_bytes
+        flow.rev_packets += rev_packets
+        flow.rev_bytes += rev_bytes
+        flow.tcp_flags |= tcp_flags
+        flow.first_seen = min(flow.first_seen, first_seen)
+        flow.last_seen = max(flow.last_seen, last_seen)
+
+    def advance(self, now):
+        """Move the wheel to now, expiring flows whose idle or active timeout has passed"""
+        target = int(now // self.tick)
+        self.next_tick_time = (target + 1) * self.tick
+        if self.current_tick is None:
+            self.current_tick = target
+            return
+        if target <= self.current_tick:
+            return
+
+        # After a jump of more than one turn every slot is visited once
+        start = max(self.current_tick + 1, target - self.wheel_size + 1)
+        for tick in range(start, target + 1):
+            index = tick % self.wheel_size
+            slot = self.slots[index]
+            if not slot:
+                continue
+            self.slots[index] = []
+            self.current_tick = tick
+            for flow in slot:
+                if self.flows.get(flow.key) is not flow:
+                    continue  # Already evicted
+                idle_deadline = flow.last_seen + self.idle_timeout
+                active_deadline = flow.first_seen + self.active_timeout
+                deadline = min(idle_deadline, active_deadline)
+                if deadline > now:
+                    self._schedule(flow, deadline)
+                elif idle_deadline <= active_deadline:
+                    self._finish(flow, 'idle')
+                    self.flows_expired_idle += 1
+                else:
+                    self._finish(flow, 'active')
+                    self.flows_expired_active += 1
+        self.current_tick = target
+
+    def advance_clock(self, now):
+        """Expire flows while no packets arrive; call about once a second with the wall clock.
+
+        The wheel is moved to the newest packet timestamp plus the wall-clock
+        time since a tick last saw it change, so a replay or pcap file with
+        old timestamps keeps a single clock.
+        """
+        if self.stream_time is None:
+            return
+        if self.stream_time != self._clock_anchor[0]:
+            self._clock_anchor = (self.stream_time, now)
+        self.advance(self._clock_anchor[0] + now - self._clock_anchor[1])
+
+    def active_flows(self, limit=100, ip=None):
+        """Most recently active flows as dicts, optionally only those involving ip"""
+        flows = self.flows.values()
+        if ip:
+            flows = [flow for flow in flows if ip == flow.key[0] or ip == flow.key[1]]
+        return [flow.to_dict() for flow in heapq.nlargest(limit, flows, key=lambda flow: flow.last_seen)]
+
+    def expired_flows(self, limit=100, ip=None):
+        """Most recently finished flows as dicts, newest first"""
+        flows = reversed(self.expired)
+        if ip:
+            flows = (flow for flow in flows if ip == flow['src'] or ip == flow['dst'])
+        result = []
+        for flow in flows:
+            if len(result) >= limit:
+                break
+            result.append(flow)
+        return result
+
+    def top_flows(self, n=10, by='bytes'):
+        """Largest active flows by 'bytes', 'packets' or 'duration'"""
+        if by == 'duration':
+            key = lambda flow: flow.last_seen - flow.first_seen
+        elif by == 'packets':
+            key = lambda flow: flow.fwd_packets + flow.rev_packets
+        else:
+            key = lambda flow: flow.fwd_bytes + flow.rev_bytes
+        return [flow.to_dict() for flow in heapq.nlargest(n, self.flows.values(), key=key)]
+
+    def clear(self):
+        """Drop all flows"""
+        self.flows.clear()
+        self.slots = [[] for _ in range(self.wheel_size)]
+        self.expired.clear()
+
+    def get_stats(self):
+        """Get flow table counters"""
+        return {
+            'active_flows': len(self.flows),
+            'max_flows': self.max_flows,
+            'idle_timeout': self.idle_timeout,
+            'active_timeout': self.active_timeout,
+            'flows_created': self.flows_created,
+            'flows_expired_idle': self.flows_expired_idle,
+            'flows_expired_active': self.flows_expired_active,
+            'flows_evicted': self.flows_evicted
+        }
+
+    def _create(self, key, initiator_forward, timestamp):
+        """Insert a new flow, evicting one first if the table is full"""
+        if len(self.flows) >= self.max_flows:
+            self._evict_one()
+        flow = self.flows[key] = Flow(key, initiator_forward, timestamp)
+        self.flows_created += 1
+        if self.current_tick is None:
+            self.current_tick = int(timestamp // self.tick)
+        self._schedule(flow, timestamp + min(self.idle_timeout, self.active_timeout))
+        return flow
+
+    def _schedule(self, flow, deadline):
+        """Place a flow in the slot for its deadline (clamped to the wheel's horizon)"""
+        tick = int(deadline // self.tick)
+        tick = min(max(tick, self.current_tick + 1), self.current_tick + self.wheel_size - 1)
+        self.slots[tick % self.wheel_size].append(flow)
+
+    def _evict_one(self):
+        """Evict the live flow that is scheduled to expire soonest"""
+        for offset in range(1, self.wheel_size + 1):
+            slot = self.slots[(self.current_tick + offset) % self.wheel_size]
+            while slot:
+                flow = slot.pop()
+                if self.flows.get(flow.key) is flow:
+                    self._finish(flow, 'evicted')
+                    self.flows_evicted += 1
+                    return
+
+    def _finish(self, flow, reason):
+        """Remove a flow and keep its final record"""
+        del self.flows[flow.key]
+        record = flow.to_dict()
+        record['end_reason'] = reason
+        self.expired.append(record)
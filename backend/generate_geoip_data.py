@@ -1,33 +1,74 @@
-import requests
-import json
+import argparse
 import time
-import random
 
-def generate_test_geoip_data():
+from geoip_db import GeoIPDatabaseBuilder, GeoIPDatabase
+
+DEFAULT_OUTPUT = 'geoip.ntadb'
+
+def generate_test_geoip_data(output=DEFAULT_OUTPUT):
     """Generate test GeoIP data to populate the dashboard"""
     
     print("Generating test GeoIP data...")
     
     # Sample GeoIP data
     test_ips = [
-        {"ip": "8.8.8.8", "country": "United States", "country_code": "US", "city": "Mountain View", "region": "California", "latitude": 37.4056, "longitude": -122.0775, "isp": "Google LLC", "asn": "AS15169"},
-        {"ip": "1.1.1.1", "country": "Australia", "country_code": "AU", "city": "Brisbane", "region": "Queensland", "latitude": -27.4698, "longitude": 153.0251, "isp": "Cloudflare, Inc.", "asn": "AS13335"},
-        {"ip": "216.58.214.14", "country": "United States", "country_code": "US", "city": "Mountain View", "region": "California", "latitude": 37.4056, "longitude": -122.0775, "isp": "Google LLC", "asn": "AS15169"},
-        {"ip": "209.85.202.138", "country": "United States", "country_code": "US", "city": "Moncks Corner", "region": "South Carolina", "latitude": 33.1960, "longitude": -80.0131, "isp": "Google LLC", "asn": "AS15169"},
-        {"ip": "172.217.160.142", "country": "United States", "country_code": "US", "city": "Kansas City", "region": "Missouri", "latitude": 39.1070, "longitude": -94.5745, "isp": "Google LLC", "asn": "AS15169"},
-        {"ip": "104.18.32.145", "country": "United States", "country_code": "US", "city": "San Francisco", "region": "California", "latitude": 37.7749, "longitude": -122.4194, "isp": "Cloudflare, Inc.", "asn": "AS13335"},
-        {"ip": "13.107.42.14", "country": "United States", "country_code": "US", "city": "Redmond", "region": "Washington", "latitude": 47.6739, "longitude": -122.1215, "isp": "Microsoft Corporation", "asn": "AS8075"},
-        {"ip": "52.97.134.1", "country": "Ireland", "country_code": "IE", "city": "Dublin", "region": "Leinster", "latitude": 53.3498, "longitude": -6.2603, "isp": "Amazon.com, Inc.", "asn": "AS16509"},
-        {"ip": "185.199.108.153", "country": "United States", "country_code": "US", "city": "San Francisco", "region": "California", "latitude": 37.7749, "longitude": -122.4194, "isp": "GitHub, Inc.", "asn": "AS36459"},
-        {"ip": "104.26.0.1", "country": "United States", "country_code": "US", "city": "San Francisco", "region": "California", "latitude": 37.7749, "longitude": -122.4194, "isp": "Cloudflare, Inc.", "asn": "AS13335"}
+        {"ip": "8.8.8.8", "country": "United States", "country_code": "US", "city": "Mountain View", "region": "California", "latitude": 37.4056, "longitude": -122.0775, "isp": "Google LLC", "asn": "AS15169", "timezone": "America/Los_Angeles"},
+        {"ip": "1.1.1.1", "country": "Australia", "country_code": "AU", "city": "Brisbane", "region": "Queensland", "latitude": -27.4698, "longitude": 153.0251, "isp": "Cloudflare, Inc.", "asn": "AS13335", "timezone": "Australia/Brisbane"},
+        {"ip": "216.58.214.14", "country": "United States", "country_code": "US", "city": "Mountain View", "region": "California", "latitude": 37.4056, "longitude": -122.0775, "isp": "Google LLC", "asn": "AS15169", "timezone": "America/Los_Angeles"},
+        {"ip": "209.85.202.138", "country": "United States", "country_code": "US", "city": "Moncks Corner", "region": "South Carolina", "latitude": 33.1960, "longitude": -80.0131, "isp": "Google LLC", "asn": "AS15169", "timezone": "America/New_York"},
+        {"ip": "172.217.160.142", "country": "United States", "country_code": "US", "city": "Kansas City", "region": "Missouri", "latitude": 39.1070, "longitude": -94.5745, "isp": "Google LLC", "asn": "AS15169", "timezone": "America/Chicago"},
+        {"ip": "104.18.32.145", "country": "United States", "country_code": "US", "city": "San Francisco", "region": "California", "latitude": 37.7749, "longitude": -122.4194, "isp": "Cloudflare, Inc.", "asn": "AS13335", "timezone": "America/Los_Angeles"},
+        {"ip": "13.107.42.14", "country": "United States", "country_code": "US", "city": "Redmond", "region": "Washington", "latitude": 47.6739, "longitude": -122.1215, "isp": "Microsoft Corporation", "asn": "AS8075", "timezone": "America/Los_Angeles"},
+        {"ip": "52.97.134.1", "country": "Ireland", "country_code": "IE", "city": "Dublin", "region": "Leinster", "latitude": 53.3498, "longitude": -6.2603, "isp": "Amazon.com, Inc.", "asn": "AS16509", "timezone": "Europe/Dublin"},
+        {"ip": "185.199.108.153", "country": "United States", "country_code": "US", "city": "San Francisco", "region": "California", "latitude": 37.7749, "longitude": -122.4194, "isp": "GitHub, Inc.", "asn": "AS36459", "timezone": "America/Los_Angeles"},
+        {"ip": "104.26.0.1", "country": "United States", "country_code": "US", "city": "San Francisco", "region": "California", "latitude": 37.7749, "longitude": -122.4194, "isp": "Cloudflare, Inc.", "asn": "AS13335", "timezone": "America/Los_Angeles"}
     ]
     
-    # Simulate adding this data to the packet_stats.geoip_data
-    # In a real implementation, this would happen when packets are captured
+    # Write the sample IPs as single-address ranges into an offline database
+    builder = GeoIPDatabaseBuilder()
+    for entry in test_ips:
+        builder.add_range(entry['ip'], entry['ip'], dict(entry, org=entry['isp']))
+    count = builder.write(output)
     
-    print("Test GeoIP data generated successfully!")
+    print(f"Test GeoIP data generated successfully! ({count} ranges written to {output})")
     print("Note: This data will be visible in the dashboard when packet capture is running.")
     print("To see real-time data, start packet capture on a network interface.")
 
+def build_geoip_database(output, csv_paths=None, mmdb_path=None, asn_mmdb_path=None):
+    """Build an offline GeoIP/ASN database from CSV and/or MMDB inputs"""
+    builder = GeoIPDatabaseBuilder()
+    
+    for csv_path in csv_paths or []:
+        print(f"Loading ranges from {csv_path}...")
+        builder.load_csv(csv_path)
+    
+    if mmdb_path:
+        print(f"Loading ranges from {mmdb_path}...")
+        builder.load_mmdb(mmdb_path, asn_mmdb_path)
+    
+    started = time.time()
+    count = builder.write(output)
+    print(f"Wrote {count} ranges to {output} in {time.time() - started:.2f}s ({builder.skipped} skipped)")
+    
+    # Quick lookup benchmark against the new file
+    db = GeoIPDatabase(output)
+    if count:
+        started = time.time()
+        for _ in range(10000):
+            db.lookup('8.8.8.8')
+        print(f"Average lookup time: {(time.time() - started) / 10000 * 1e6:.1f} us")
+    db.close()
+
 if __name__ == "__main__":
-    generate_test_geoip_data()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Generate or build the offline GeoIP/ASN range database')
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help='Database file to write')
+    parser.add_argument('--csv', action='append', help='CSV with network or start_ip/end_ip columns plus '
+                        'country_code,country,city,region,latitude,longitude,asn,org,timezone (repeatable)')
+    parser.add_argument('--mmdb', help='MaxMind-style City database to convert (requires maxminddb)')
+    parser.add_argument('--asn-mmdb', help='MaxMind-style ASN database to join with --mmdb')
+    args = parser.parse_args()
+    
+    if args.csv or args.mmdb:
+        build_geoip_database(args.output, args.csv, args.mmdb, args.asn_mmdb)
+    else:
+        generate_test_geoip_data(args.output)
\ No newline at end of file
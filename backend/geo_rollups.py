@@ -0,0 +1,170 @@
+from port_stats import RankedCounters
+
+DIMENSIONS = ('country', 'asn', 'isp', 'timezone', 'network_type')
+
+
+class GeoRollups:
+    """Traffic rolled up by country, ASN, ISP, timezone and network type.
+
+    Each IP with GeoIP data is assigned to one group per dimension. Packet
+    counts are added to its groups as they arrive, and an IP's existing
+    totals move with it when its geo info arrives or changes. Queries cost
+    O(groups) instead of a pass over every known IP. Callers serialize access.
+    """
+
+    def __init__(self, network_type, bubble_count=100):
+        self.network_type = network_type  # org string -> network type name
+        self.groups = {dimension: {} for dimension in DIMENSIONS}  # key -> [packets, bytes, unique_ips]
+        self.group_order = [self.groups[dimension] for dimension in DIMENSIONS]
+        self.ip_groups = {}  # ip -> group key per dimension
+        self.country_info = {}  # country -> {'country_code', 'latitude', 'longitude'} of its first IP
+        self.country_isps = {}  # country -> {isp: ip count}
+        self.country_ips = {}  # country -> set of ips
+        self.timezone_countries = {}  # timezone -> {country: ip count}
+        self.bubble_ips = {}  # ip -> (latitude, longitude, country) for IPs with coordinates
+        self.bubbles = RankedCounters(keep=bubble_count * 2)  # ip -> [bytes, packets], ranked by bytes
+
+    def add(self, ip, packets, size):
+        """Add traffic seen for an IP to its groups (ignored until its geo info is known)"""
+        keys = self.ip_groups.get(ip)
+        if keys is None:
+            return
+        for groups, key in zip(self.group_order, keys):
+            group = groups[key]
+            group[0] += packets
+            group[1] += size
+        if ip in self.bubble_ips:
+            self.bubbles.add(ip, size, packets)
+
+    def assign(self, ip, geo_info, packets=0, size=0):
+        """Place an IP in its groups, carrying over the packets/bytes already counted for it"""
+        if ip in self.ip_groups:
+            self._remove(ip, packets, size)
+
+        country = geo_info.get('country', 'Unknown')
+        isp = geo_info.get('isp', 'Unknown')
+        timezone = geo_info.get('timezone', 'Unknown')
+        keys = (country, geo_info.get('asn', 'Unknown'), isp, timezone,
+                self.network_type(geo_info.get('org') or 'Unknown'))
+        self.ip_groups[ip] = keys
+        for groups, key in zip(self.group_order, keys):
+            group = groups.get(key)
+            if group is None:
+                group = groups[key] = [0, 0, 0]
+            group[0] += packets
+            group[1] += size
+            group[2] += 1
+
+        if country not in self.country_info:
+            self.country_info[country] = {
+                'country_code': geo_info.get('country_code', 'XX'),
+                'latitude': geo_info.get('latitude', 0),
+                'longitude': geo_info.get('longitude', 0)
+            }
+        self.country_ips.setdefault(country, set()).add(ip)
+        if isp and isp != 'Unknown':
+            isps = self.country_isps.setdefault(country, {})
+            isps[isp] = isps.get(isp, 0) + 1
+        countries = self.timezone_countries.setdefault(timezone, {})
+        countries[country] = countries.get(country, 0) + 1
+
+        latitude = geo_info.get('latitude', 0)
+        longitude = geo_info.get('longitude', 0)
+        if latitude != 0 and longitude != 0:
+            self.bubble_ips[ip] = (latitude, longitude, country)
+            self.bubbles.add(ip, size, packets)
+
+    def forget(self, ip):
+        """Stop tracking an IP (evicted from the IP table), keeping the traffic and IP count in its groups.
+
+        If the IP returns it is assigned again and counted as a new IP.
+        """
+        keys = self.ip_groups.pop(ip, None)
+        if keys is None:
+            return
+        country = keys[0]
+        members = self.country_ips.get(country)
+        if members is not None:
+            members.discard(ip)
+            if not members:
+                del self.country_ips[country]
+        if self.bubble_ips.pop(ip, None) is not None:
+            self.bubbles.discard(ip)
+
+    def _remove(self, ip, packets, size):
+        """Take an IP and its totals out of its current groups"""
+        keys = self.ip_groups.pop(ip)
+        for groups, key in zip(self.group_order, keys):
+            group = groups[key]
+            group[0] -= packets
+            group[1] -= size
+            group[2] -= 1
+            if group[2] <= 0:
+                del groups[key]
+
+        country, _, isp, timezone, _ = keys
+        members = self.country_ips.get(country)
+        if members is not None:
+            members.discard(ip)
+            if not members:
+                del self.country_ips[country]
+                self.country_info.pop(country, None)
+        isps = self.country_isps.get(country)
+        if isps and isp in isps:
+            isps[isp] -= 1
+            if isps[isp] <= 0:
+                del isps[isp]
+        countries = self.timezone_countries.get(timezone)
+        if countries and country in countries:
+            countries[country] -= 1
+            if countries[country] <= 0:
+                del countries[country]
+        if self.bubble_ips.pop(ip, None) is not None:
+            self.bubbles.discard(ip)
+
+    def rollup(self, dimension):
+        """(key, packets, bytes, unique_ips) for every group of a dimension, by bytes"""
+        return sorted(((key, packets, size, unique_ips) for key, (packets, size, unique_ips) in self.groups[dimension].items()),
+                      key=lambda entry: entry[2], reverse=True)
+
+    def countries(self):
+        """Country rollup rows with location and ISP list"""
+        rows = []
+        for country, packets, size, unique_ips in self.rollup('country'):
+            info = self.country_info.get(country, {})
+            rows.append({
+                'country': country,
+                'country_code': info.get('country_code', 'XX'),
+                'packets': packets,
+                'bytes': size,
+                'unique_ips': unique_ips,
+                'latitude': info.get('latitude', 0),
+                'longitude': info.get('longitude', 0),
+                'isp_list': list(self.country_isps.get(country, {}))
+            })
+        return rows
+
+    def timezones(self, limit=20):
+        """Timezone rollup rows with up to five countries each"""
+        rows = []
+        for timezone, packets, size, unique_ips in self.rollup('timezone')[:limit]:
+            rows.append({
+                'timezone': timezone,
+                'countries': list(self.timezone_countries.get(timezone, {}))[:5],
+                'packets': packets,
+                'bytes': size,
+                'unique_ips': unique_ips
+            })
+        return rows
+
+    def ips_in_country(self, country):
+        """IPs whose geo info places them in country"""
+        return self.country_ips.get(country, set())
+
+    def top_bubbles(self, n=100):
+        """(ip, latitude, longitude, country, packets, bytes) for the busiest IPs with coordinates"""
+        rows = []
+        for ip, (size, packets) in self.bubbles.top(n):
+            latitude, longitude, country = self.bubble_ips[ip]
+            rows.append((ip, latitude, longitude, country, packets, size))
+        return rows
@@ -0,0 +1,277 @@
+import csv
+import ipaddress
+import mmap
+import socket
+import struct
+import time
+
+# File layout (little-endian):
+#   header   - magic, version, record count, records offset, strings offset, strings size
+#   records  - fixed-width ranges sorted by start address
+#   strings  - length-prefixed UTF-8 strings referenced by offset from the records
+# Addresses are stored as 16-byte big-endian IPv6 values (IPv4 is IPv4-mapped),
+# so byte-wise comparison of the raw slices gives numeric ordering.
+GEOIP_DB_MAGIC = b'NTAGEO1\x00'
+GEOIP_DB_VERSION = 1
+HEADER_FORMAT = '<8sIIIII'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+RECORD_FORMAT = '<16s16sIIIIffIII'
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+STRING_LENGTH_FORMAT = '<H'
+STRING_LENGTH_SIZE = struct.calcsize(STRING_LENGTH_FORMAT)
+
+IPV4_MAPPED_PREFIX = b'\x00' * 10 + b'\xff\xff'
+
+CSV_FIELDS = ['country_code', 'country', 'city', 'region', 'latitude', 'longitude', 'asn', 'org', 'timezone']
+
+
+def ip_to_key(ip):
+    """Convert an IP address to its 16-byte sort key"""
+    if isinstance(ip, str):
+        # inet_pton is much cheaper than ipaddress on the lookup path
+        try:
+            if ':' in ip:
+                return socket.inet_pton(socket.AF_INET6, ip)
+            return IPV4_MAPPED_PREFIX + socket.inet_pton(socket.AF_INET, ip)
+        except OSError:
+            raise ValueError(f'Invalid IP address: {ip}')
+    addr = ipaddress.ip_address(ip)
+    if addr.version == 4:
+        return IPV4_MAPPED_PREFIX + addr.packed
+    return addr.packed
+
+
+def parse_asn(asn):
+    """Convert 'AS15169' / '15169' / 15169 into an integer ASN (0 if unknown)"""
+    if asn in (None, '', 'Unknown'):
+        return 0
+    if isinstance(asn, int):
+        return asn
+    asn = str(asn).strip().upper()
+    if asn.startswith('AS'):
+        asn = asn[2:]
+    try:
+        return int(asn)
+    except ValueError:
+        return 0
+
+
+class GeoIPDatabase:
+    """Read-only memory-mapped IP range database with binary search lookups"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count, records_offset, strings_offset, strings_size = struct.unpack_from(HEADER_FORMAT, self._mmap, 0)
+        if magic != GEOIP_DB_MAGIC:
+            self.close()
+            raise ValueError(f'{path} is not a GeoIP range database')
+        if version != GEOIP_DB_VERSION:
+            self.close()
+            raise ValueError(f'Unsupported GeoIP database version {version}')
+        self.record_count = count
+        self.records_offset = records_offset
+        self.strings_offset = strings_offset
+        self.strings_size = strings_size
+        self._strings = {}
+        self.lookups = 0
+        self.hits = 0
+
+    def close(self):
+        """Release the memory map"""
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _string(self, offset):
+        """Decode a string from the string table (memoized, the table is small)"""
+        value = self._strings.get(offset)
+        if value is None:
+            position = self.strings_offset + offset
+            (length,) = struct.unpack_from(STRING_LENGTH_FORMAT, self._mmap, position)
+            start = position + STRING_LENGTH_SIZE
+            value = self._mmap[start:start + length].decode('utf-8')
+            self._strings[offset] = value
+        return value
+
+    def _find(self, key):
+        """Find the index of the range containing key, or -1"""
+        mm = self._mmap
+        base = self.records_offset
+        lo, hi = 0, self.record_count
+        # Rightmost record whose start <= key
+        while lo < hi:
+            mid = (lo + hi) >> 1
+            offset = base + mid * RECORD_SIZE
+            if mm[offset:offset + 16] <= key:
+                lo = mid + 1
+            else:
+                hi = mid
+        index = lo - 1
+        if index < 0:
+            return -1
+        offset = base + index * RECORD_SIZE
+        if key <= mm[offset + 16:offset + 32]:
+            return index
+        return -1
+
+    def lookup(self, ip):
+        """Resolve an IP to a geo info dict, or None if it is not covered"""
+        self.lookups += 1
+        try:
+            key = ip_to_key(ip)
+        except ValueError:
+            return None
+
+        index = self._find(key)
+        if index < 0:
+            return None
+        self.hits += 1
+
+        (_, _, country_code, country, city, region, latitude, longitude,
+         asn, org, timezone) = struct.unpack_from(RECORD_FORMAT, self._mmap, self.records_offset + index * RECORD_SIZE)
+        org_name = self._string(org)
+        return {
+            'ip': ip,
+            'country': self._string(country),
+            'country_code': self._string(country_code),
+            'city': self._string(city),
+            'region': self._string(region),
+            'latitude': round(latitude, 4),
+            'longitude': round(longitude, 4),
+            'org': org_name,
+            'asn': f'AS{asn}' if asn else 'Unknown',
+            'isp': org_name,
+            'timezone': self._string(timezone),
+            'last_updated': time.time()
+        }
+
+    def get_stats(self):
+        """Get database counters"""
+        return {
+            'path': self.path,
+            'ranges': self.record_count,
+            'lookups': self.lookups,
+            'hits': self.hits
+        }
+
+
+class GeoIPDatabaseBuilder:
+    """Collect IP ranges and write them out as a GeoIP range database"""
+
+    def __init__(self):
+        self.ranges = []
+        self.skipped = 0
+
+    def add_range(self, start_ip, end_ip, info):
+        """Add an inclusive address range with its geo info"""
+        start = ip_to_key(start_ip)
+        end = ip_to_key(end_ip)
+        if end < start:
+            start, end = end, start
+        self.ranges.append((start, end, info))
+
+    def add_network(self, network, info):
+        """Add a CIDR network with its geo info"""
+        net = ipaddress.ip_network(network, strict=False)
+        self.add_range(net.network_address, net.broadcast_address, info)
+
+    def load_csv(self, path):
+        """Load ranges from a CSV with a 'network' or 'start_ip'/'end_ip' column plus the geo fields"""
+        with open(path, newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                info = {field: row.get(field, '') for field in CSV_FIELDS}
+                if row.get('network'):
+                    self.add_network(row['network'], info)
+                elif row.get('start_ip'):
+                    self.add_range(row['start_ip'], row.get('end_ip') or row['start_ip'], info)
+                elif row.get('ip'):
+                    self.add_range(row['ip'], row['ip'], info)
+                else:
+                    self.skipped += 1
+
+    def load_mmdb(self, path, asn_path=None):
+        """Load ranges from a MaxMind-style City database, optionally joined with an ASN database"""
+        try:
+            import maxminddb
+        except ImportError:
+            raise RuntimeError('maxminddb is required to convert MMDB files (pip install maxminddb)')
+
+        asn_reader = maxminddb.open_database(asn_path) if asn_path else None
+        try:
+            with maxminddb.open_database(path) as reader:
+                for network, record in reader:
+                    record = record or {}
+                    country = record.get('country') or record.get('registered_country') or {}
+                    subdivisions = record.get('subdivisions') or [{}]
+                    location = record.get('location') or {}
+                    asn_record = record
+                    if asn_reader is not None:
+                        # ASN ranges are resolved at the start of each city range
+                        asn_record = asn_reader.get(network.network_address) or {}
+                    self.add_network(network, {
+                        'country_code': country.get('iso_code', ''),
+                        'country': (country.get('names') or {}).get('en', ''),
+                        'city': ((record.get('city') or {}).get('names') or {}).get('en', ''),
+                        'region': (subdivisions[0].get('names') or {}).get('en', ''),
+                        'latitude': location.get('latitude', 0.0),
+                        'longitude': location.get('longitude', 0.0),
+                        'asn': asn_record.get('autonomous_system_number', 0),
+                        'org': asn_record.get('autonomous_system_organization', ''),
+                        'timezone': location.get('time_zone', '')
+                    })
+        finally:
+            if asn_reader is not None:
+                asn_reader.close()
+
+    def write(self, path):
+        """Sort the ranges and write the database file; returns the number of ranges written"""
+        strings = bytearray()
+        string_offsets = {}
+
+        def intern(value):
+            value = str(value or 'Unknown')
+            offset = string_offsets.get(value)
+            if offset is None:
+                encoded = value.encode('utf-8')[:0xFFFF]
+                offset = len(strings)
+                strings.extend(struct.pack(STRING_LENGTH_FORMAT, len(encoded)))
+                strings.extend(encoded)
+                string_offsets[value] = offset
+            return offset
+
+        records = bytearray()
+        count = 0
+        last_end = None
+        for start, end, info in sorted(self.ranges, key=lambda r: (r[0], r[1])):
+            # Overlapping ranges are not allowed; the first range wins
+            if last_end is not None and start <= last_end:
+                self.skipped += 1
+                continue
+            records.extend(struct.pack(
+                RECORD_FORMAT, start, end,
+                intern(info.get('country_code') or 'XX'),
+                intern(info.get('country')),
+                intern(info.get('city')),
+                intern(info.get('region')),
+                float(info.get('latitude') or 0.0),
+                float(info.get('longitude') or 0.0),
+                parse_asn(info.get('asn')),
+                intern(info.get('org') or info.get('isp')),
+                intern(info.get('timezone'))
+            ))
+            last_end = end
+            count += 1
+
+        records_offset = HEADER_SIZE
+        strings_offset = records_offset + len(records)
+        with open(path, 'wb') as f:
+            f.write(struct.pack(HEADER_FORMAT, GEOIP_DB_MAGIC, GEOIP_DB_VERSION, count,
+                                records_offset, strings_offset, len(strings)))
+            f.write(records)
+            f.write(strings)
+        return count
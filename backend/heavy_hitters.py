@@ -0,0 +1,175 @@
+import heapq
+from functools import lru_cache
+from ipaddress import ip_network
+
+DIMENSIONS = ('ips', 'dst_ports', 'subnets')
+METRICS = ('bytes', 'packets')
+
+
+@lru_cache(maxsize=65536)
+def subnet_key(ip):
+    """The /24 (IPv4) or /64 (IPv6) network an address belongs to, as a string"""
+    if ':' not in ip:
+        return ip[:ip.rfind('.')] + '.0/24'
+    try:
+        return str(ip_network(f'{ip}/64', strict=False))
+    except ValueError:
+        return ip
+
+
+@lru_cache(maxsize=65536)
+def network_key(ip):
+    """The /16 (IPv4) or /48 (IPv6) network an address belongs to, as a string"""
+    if ':' not in ip:
+        return ip[:ip.find('.', ip.find('.') + 1)] + '.0.0/16'
+    try:
+        return str(ip_network(f'{ip}/48', strict=False))
+    except ValueError:
+        return ip
+
+
+class SpaceSaving:
+    """Space-Saving heavy-hitter summary over at most capacity keys.
+
+    Counts are overestimates: a key's true weight lies in
+    [count - error, count], and every key whose true weight exceeds
+    total / capacity is guaranteed to be monitored. When a new key arrives
+    while the summary is full it replaces the key with the smallest count
+    and inherits that count as its error. The minimum is found through a
+    lazy heap, so updates to monitored keys are O(1).
+    """
+
+    def __init__(self, capacity=1000):
+        self.capacity = capacity
+        self.counts = {}  # key -> [count, error]
+        self.heap = []  # (count when pushed, key), one entry per monitored key
+        self.total = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.counts)
+
+    def add(self, key, weight=1):
+        """Add weight to a key"""
+        self.total += weight
+        entry = self.counts.get(key)
+        if entry is not None:
+            entry[0] += weight
+            return
+        if len(self.counts) < self.capacity:
+            self.counts[key] = [weight, 0]
+            heapq.heappush(self.heap, (weight, key))
+            return
+
+        # Replace the key with the smallest count
+        minimum = self._pop_min()
+        count = self.counts.pop(minimum)[0]
+        self.counts[key] = [count + weight, count]
+        heapq.heappush(self.heap, (count + weight, key))
+        self.evictions += 1
+
+    def get(self, key):
+        """(count, error) for a monitored key, or None"""
+        entry = self.counts.get(key)
+        return tuple(entry) if entry is not None else None
+
+    def top(self, n=10):
+        """(key, count, error) for the n keys with the largest counts"""
+        ranked = heapq.nlargest(n, self.counts.items(), key=lambda item: item[1][0])
+        return [(key, count, error) for key, (count, error) in ranked]
+
+    def error_bound(self):
+        """Upper bound on any count's overestimate"""
+        if len(self.counts) < self.capacity:
+            return 0
+        return self.total / self.capacity
+
+    def clear(self):
+        """Drop all counts"""
+        self.counts.clear()
+        self.heap = []
+        self.total = 0
+        self.evictions = 0
+
+    def _pop_min(self):
+        """Pop the heap entry of the key with the smallest current count"""
+        heap = self.heap
+        counts = self.counts
+        while True:
+            pushed, key = heapq.heappop(heap)
+            current = counts[key][0]
+            if current == pushed:
+                return key
+            # Counts only grow, so a stale entry is re-queued with the current count
+            heapq.heappush(heap, (current, key))
+
+
+class HeavyHitters:
+    """Top-K by bytes and by packets for IPs, destination ports and subnets in bounded memory.
+
+    Each dimension/metric pair is a SpaceSaving summary, so memory stays at
+    capacity keys per summary however many distinct sources a scan or flood
+    produces. Callers serialize access.
+    """
+
+    def __init__(self, capacity=1000):
+        self.capacity = capacity
+        self.summaries = {(dimension, metric): SpaceSaving(capacity) for dimension in DIMENSIONS for metric in METRICS}
+        summaries = self.summaries
+        # Bound methods for the per-packet path
+        self._ip_bytes = summaries[('ips', 'bytes')].add
+        self._ip_packets = summaries[('ips', 'packets')].add
+        self._subnet_bytes = summaries[('subnets', 'bytes')].add
+        self._subnet_packets = summaries[('subnets', 'packets')].add
+        self._port_bytes = summaries[('dst_ports', 'bytes')].add
+        self._port_packets = summaries[('dst_ports', 'packets')].add
+
+    def add(self, dimension, key, packets, size):
+        """Add packets/bytes to a key of one dimension"""
+        self.summaries[(dimension, 'bytes')].add(key, size)
+        self.summaries[(dimension, 'packets')].add(key, packets)
+
+    def add_ip(self, ip, packets, size):
+        """Add traffic sent or received by an IP to it and its subnet"""
+        self._ip_bytes(ip, size)
+        self._ip_packets(ip, packets)
+        subnet = subnet_key(ip)
+        self._subnet_bytes(subnet, size)
+        self._subnet_packets(subnet, packets)
+
+    def add_packet(self, src, dst, dst_port, size):
+        """Account one packet: both endpoints, their subnets and the destination port"""
+        self._ip_bytes(src, size)
+        self._ip_packets(src, 1)
+        self._ip_bytes(dst, size)
+        self._ip_packets(dst, 1)
+        src_subnet = subnet_key(src)
+        dst_subnet = subnet_key(dst)
+        self._subnet_bytes(src_subnet, size)
+        self._subnet_packets(src_subnet, 1)
+        self._subnet_bytes(dst_subnet, size)
+        self._subnet_packets(dst_subnet, 1)
+        if dst_port:
+            self._port_bytes(dst_port, size)
+            self._port_packets(dst_port, 1)
+
+    def top(self, dimension, n=10, by='bytes'):
+        """(key, count, error) for the n heaviest keys of a dimension by 'bytes' or 'packets'"""
+        return self.summaries[(dimension, by)].top(n)
+
+    def clear(self):
+        """Drop all summaries"""
+        for summary in self.summaries.values():
+            summary.clear()
+
+    def get_stats(self):
+        """Summary sizes, totals and error bounds"""
+        return {
+            f'{dimension}_{metric}': {
+                'tracked': len(summary),
+                'total': summary.total,
+                'evictions': summary.evictions,
+                'error_bound': summary.error_bound()
+            }
+            for (dimension, metric), summary in self.summaries.items()
+        }
@@ -0,0 +1,273 @@
+import socket
+import time
+from array import array
+from functools import lru_cache
+
+import numpy as np
+
+from db_writer import BatchedPacketWriter
+
+IPV6_KEY = 1 << 128  # Added to IPv6 keys so they never collide with IPv4 ones
+COUNTER_FIELDS = ('sent', 'received', 'bytes')
+COLUMN_TYPES = {  # name -> (array typecode, NumPy dtype)
+    'hi': ('Q', np.uint64),
+    'lo': ('Q', np.uint64),
+    'v6': ('B', np.bool_),
+    'sent': ('q', np.int64),
+    'received': ('q', np.int64),
+    'bytes': ('q', np.int64),
+    'first_seen': ('d', np.float64),
+    'last_seen': ('d', np.float64)
+}
+
+
+@lru_cache(maxsize=65536)
+def ip_key(ip):
+    """Integer key for an address string (raises ValueError if it is not an IP address)"""
+    try:
+        if ':' in ip:
+            return int.from_bytes(socket.inet_pton(socket.AF_INET6, ip), 'big') + IPV6_KEY
+        return int.from_bytes(socket.inet_pton(socket.AF_INET, ip), 'big')
+    except OSError:
+        raise ValueError(f'Not an IP address: {ip}')
+
+
+class IPSpillWriter(BatchedPacketWriter):
+    """Background writer that folds evicted IP counters into the ip_stats_spill table"""
+
+    INSERT_SQL = '''
+        INSERT INTO ip_stats_spill (ip, sent, received, bytes, last_evicted)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(ip) DO UPDATE SET
+            sent = sent + excluded.sent,
+            received = received + excluded.received,
+            bytes = bytes + excluded.bytes,
+            last_evicted = excluded.last_evicted
+    '''
+    THREAD_NAME = 'ip-spill-writer'
+
+
+class IPStatsEntry:
+    """Write-through view of one IP's counters, so table[ip]['sent'] += 1 keeps working"""
+
+    __slots__ = ('table', 'row')
+
+    def __init__(self, table, row):
+        self.table = table
+        self.row = row
+
+    def __getitem__(self, field):
+        return self.table.columns[field][self.row]
+
+    def __setitem__(self, field, value):
+        self.table.columns[field][self.row] = value
+
+    def keys(self):
+        return COUNTER_FIELDS
+
+    def get(self, field, default=None):
+        return self[field] if field in COUNTER_FIELDS else default
+
+
+class IPStatsTable:
+    """Per-IP counters in NumPy columns, holding at most capacity IPs.
+
+    Addresses are keyed by integer (IPv6 offset by 2 ** 128) through a dict
+    index into fixed-width columns: sent, received, bytes, first_seen,
+    last_seen, plus the address split into high/low 64-bit halves. Columns are typed arrays, which are cheap
+    to update one element at a time, and are read as NumPy arrays without
+    copying for vectorized queries. They grow by doubling up to capacity.
+
+    Reads through the mapping interface (get, items) return plain dicts;
+    table[ip] creates a zeroed entry and returns a write-through view, so
+    code written for the old defaultdict keeps working. When full, the
+    coldest tenth of the table is evicted in one vectorized pass: 'lru' by
+    last_seen, 'lfu' by packets (a flood of one-packet sources then
+    evicts itself). Evicted counters are passed to spill (e.g.
+    IPSpillWriter.submit) and evicted addresses to on_evict, if given.
+    Callers serialize access.
+    """
+
+    def __init__(self, capacity=200000, policy='lru', spill=None, initial_size=1024, on_evict=None):
+        if policy not in ('lru', 'lfu'):
+            raise ValueError(f'Unknown eviction policy: {policy}')
+        self.capacity = capacity
+        self.policy = policy
+        self.spill = spill
+        self.on_evict = on_evict
+        self.index = {}  # ip_key -> row
+        self.names = []  # row -> address string (None for free rows)
+        self.free_rows = []
+        self.columns = {name: array(typecode) for name, (typecode, _) in COLUMN_TYPES.items()}
+        self._allocate(min(initial_size, capacity))
+        self.evictions = 0
+        self.spilled = 0
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, ip):
+        try:
+            return ip_key(ip) in self.index
+        except ValueError:
+            return False
+
+    def __iter__(self):
+        return iter([self.names[row] for row in self.index.values()])
+
+    def __getitem__(self, ip):
+        key = ip_key(ip)
+        row = self.index.get(key)
+        if row is None:
+            row = self._insert(ip, key, time.time())
+        return IPStatsEntry(self, row)
+
+    def __setitem__(self, ip, counters):
+        entry = self[ip]
+        for field in COUNTER_FIELDS:
+            entry[field] = counters.get(field, 0)
+
+    def get(self, ip, default=None):
+        """Counters for an IP as a plain dict, or default"""
+        try:
+            row = self.index.get(ip_key(ip))
+        except ValueError:
+            return default
+        if row is None:
+            return default
+        columns = self.columns
+        return {'sent': columns['sent'][row], 'received': columns['received'][row], 'bytes': columns['bytes'][row]}
+
+    def items(self):
+        """Yield (ip, counters dict) for every IP present when iteration starts"""
+        names = self.names
+        sent = self.columns['sent']
+        received = self.columns['received']
+        size = self.columns['bytes']
+        for row in list(self.index.values()):
+            ip = names[row]
+            if ip is not None:
+                yield ip, {'sent': sent[row], 'received': received[row], 'bytes': size[row]}
+
+    def keys(self):
+        return list(self)
+
+    def add(self, ip, sent, received, size, timestamp=None):
+        """Add packets sent/received and bytes to an IP"""
+        if timestamp is None:
+            timestamp = time.time()
+        key = ip_key(ip)
+        row = self.index.get(key)
+        if row is None:
+            row = self._insert(ip, key, timestamp)
+        columns = self.columns
+        if sent:
+            columns['sent'][row] += sent
+        if received:
+            columns['received'][row] += received
+        columns['bytes'][row] += size
+        columns['last_seen'][row] = timestamp
+
+    def live_rows(self):
+        """Row numbers of every IP in the table"""
+        return np.fromiter(self.index.values(), dtype=np.int64, count=len(self.index))
+
+    def column(self, name):
+        """NumPy view of a whole column (free rows included); do not keep it across updates"""
+        return np.frombuffer(self.columns[name], dtype=COLUMN_TYPES[name][1])
+
+    def snapshot(self, rows=None):
+        """Copies of every column for rows (default all IPs), plus 'packets' and 'row'"""
+        if rows is None:
+            rows = self.live_rows()
+        data = {name: self.column(name)[rows] for name in self.columns}
+        data['packets'] = data['sent'] + data['received']
+        data['row'] = rows
+        return data
+
+    def top(self, n=10, by='bytes'):
+        """(ip, counters dict) for the n IPs with the most 'bytes' or 'packets'"""
+        data = self.snapshot()
+        values = data['packets'] if by == 'packets' else data['bytes']
+        if len(values) > n:
+            order = np.argpartition(-values, n)[:n]
+            order = order[np.argsort(-values[order], kind='stable')]
+        else:
+            order = np.argsort(-values, kind='stable')
+        return [(self.names[row], {'sent': int(data['sent'][i]), 'received': int(data['received'][i]),
+                                   'bytes': int(data['bytes'][i])})
+                for i, row in zip(order.tolist(), data['row'][order].tolist())]
+
+    def memory_bytes(self):
+        """Bytes held by the NumPy columns"""
+        return sum(column.itemsize * len(column) for column in self.columns.values())
+
+    def get_stats(self):
+        """Get table size and eviction counters"""
+        return {
+            'entries': len(self.index),
+            'capacity': self.capacity,
+            'policy': self.policy,
+            'evictions': self.evictions,
+            'spilled': self.spilled,
+            'column_bytes': self.memory_bytes()
+        }
+
+    def _allocate(self, size):
+        """Grow (or create) the columns to size rows"""
+        old = len(self.names)
+        for name, column in self.columns.items():
+            column.extend(array(column.typecode, bytes(column.itemsize * (size - old))))
+        self.names.extend([None] * (size - old))
+        self.free_rows.extend(range(size - 1, old - 1, -1))
+
+    def _insert(self, ip, key, timestamp):
+        """Claim a row for a new IP, growing the columns or evicting cold IPs first"""
+        if not self.free_rows:
+            if len(self.names) < self.capacity:
+                self._allocate(min(len(self.names) * 2, self.capacity))
+            else:
+                self._evict()
+        row = self.free_rows.pop()
+        self.index[key] = row
+        self.names[row] = ip
+        columns = self.columns
+        is_v6 = key >= IPV6_KEY
+        address = key - IPV6_KEY if is_v6 else key
+        columns['hi'][row] = address >> 64
+        columns['lo'][row] = address & 0xFFFFFFFFFFFFFFFF
+        columns['v6'][row] = 1 if is_v6 else 0
+        columns['sent'][row] = 0
+        columns['received'][row] = 0
+        columns['bytes'][row] = 0
+        columns['first_seen'][row] = timestamp
+        columns['last_seen'][row] = timestamp
+        return row
+
+    def _evict(self):
+        """Evict the coldest tenth of the table: oldest last_seen (lru) or fewest packets (lfu)"""
+        columns = self.columns
+        if self.policy == 'lru':
+            coldness = self.column('last_seen').copy()
+        else:
+            coldness = self.column('sent') + self.column('received')
+        count = max(1, self.capacity // 10)
+        victims = np.argpartition(coldness, count - 1)[:count] if count < len(coldness) else np.arange(len(coldness))
+        victims = victims.tolist()
+
+        now = time.time()
+        spill = self.spill
+        on_evict = self.on_evict
+        sent = columns['sent']
+        received = columns['received']
+        size = columns['bytes']
+        for row in victims:
+            ip = self.names[row]
+            del self.index[ip_key(ip)]
+            self.names[row] = None
+            if spill and spill((ip, sent[row], received[row], size[row], now)) is not False:
+                self.spilled += 1
+            if on_evict:
+                on_evict(ip)
+        self.free_rows.extend(victims)
+        self.evictions += len(victims)
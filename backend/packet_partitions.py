@@ -0,0 +1,237 @@
+import calendar
+import glob
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from db_writer import BatchedPacketWriter
+
+GRANULARITIES = {'hour': 3600, 'day': 86400}
+PARTITION_FILE_PATTERN = re.compile(r'packets_(\d{8})(?:_(\d{2}))?\.db$')
+PACKET_COLUMNS = ('timestamp', 'src_ip', 'dst_ip', 'protocol', 'size', 'interface')
+
+
+def create_partition_schema(conn):
+    """Create the packets table and its indexes in a partition database"""
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS packets (
+            timestamp REAL,
+            src_ip TEXT,
+            dst_ip TEXT,
+            protocol INTEGER,
+            size INTEGER,
+            interface TEXT
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_packets_timestamp ON packets (timestamp)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_packets_src_ip ON packets (src_ip, timestamp)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_packets_dst_ip ON packets (dst_ip, timestamp)')
+    conn.commit()
+
+
+class PacketPartitionRouter:
+    """Packet rows in one SQLite file per UTC hour or day under directory.
+
+    Files are named packets_YYYYMMDD_HH.db (hourly) or packets_YYYYMMDD.db
+    (daily); a file's name alone gives the time range it covers, so range
+    queries open only the files that overlap and retention removes whole
+    files. The writer thread keeps up to max_open partitions open for
+    writing; retire() never moves one of those. Reads also include the
+    packets table of legacy_db (rows written before partitioning) until
+    retention has emptied it.
+    """
+
+    def __init__(self, directory='packet_partitions', granularity='hour', max_open=4, legacy_db=None):
+        if granularity not in GRANULARITIES:
+            raise ValueError(f'Unknown partition granularity: {granularity}')
+        self.directory = directory
+        self.granularity = granularity
+        self.span = GRANULARITIES[granularity]
+        self.max_open = max_open
+        self.legacy_db = legacy_db
+        self.open_connections = OrderedDict()  # partition start -> write connection, least recently used first
+        self.lock = threading.Lock()
+        self.partitions_dropped = 0
+        self.bytes_dropped = 0
+
+    def partition_start(self, timestamp):
+        """Start of the partition holding timestamp"""
+        return int(timestamp) // self.span * self.span
+
+    def partition_path(self, start):
+        name_format = 'packets_%Y%m%d_%H.db' if self.granularity == 'hour' else 'packets_%Y%m%d.db'
+        return os.path.join(self.directory, time.strftime(name_format, time.gmtime(start)))
+
+    def partitions(self, start=None, end=None):
+        """(start, end, path) of every partition file overlapping [start, end), oldest first"""
+        found = []
+        for path in glob.glob(os.path.join(self.directory, 'packets_*.db')):
+            match = PARTITION_FILE_PATTERN.search(path)
+            if not match:
+                continue
+            day, hour = match.groups()
+            # Files left over from the other granularity are still found and expired
+            partition_start = calendar.timegm(time.strptime(day + (hour or '00'), '%Y%m%d%H'))
+            partition_end = partition_start + (3600 if hour else 86400)
+            if (start is None or partition_end > start) and (end is None or partition_start < end):
+                found.append((partition_start, partition_end, path))
+        return sorted(found)
+
+    def connection(self, start):
+        """Write connection for a partition, creating the file if needed (writer thread only)"""
+        with self.lock:
+            conn = self.open_connections.get(start)
+            if conn is not None:
+                self.open_connections.move_to_end(start)
+                return conn
+            os.makedirs(self.directory, exist_ok=True)
+            conn = sqlite3.connect(self.partition_path(start), timeout=30, check_same_thread=False)
+            create_partition_schema(conn)
+            conn.execute('PRAGMA synchronous = NORMAL')
+            self.open_connections[start] = conn
+            while len(self.open_connections) > self.max_open:
+                _, oldest = self.open_connections.popitem(last=False)
+                oldest.close()
+            return conn
+
+    def close(self):
+        """Close every write connection"""
+        with self.lock:
+            for conn in self.open_connections.values():
+                conn.close()
+            self.open_connections.clear()
+
+    def fetch(self, start=None, end=None, limit=1000, columns=PACKET_COLUMNS, newest_first=True):
+        """Up to limit rows with start <= timestamp < end, reading only the partitions in range.
+
+        columns must include timestamp when there is a legacy database.
+        """
+        order = 'DESC' if newest_first else 'ASC'
+        conditions, params = [], []
+        if start is not None:
+            conditions.append('timestamp >= ?')
+            params.append(start)
+        if end is not None:
+            conditions.append('timestamp < ?')
+            params.append(end)
+        sql = (f'SELECT {", ".join(columns)} FROM packets {"WHERE " + " AND ".join(conditions) if conditions else ""} '
+               f'ORDER BY timestamp {order} LIMIT ?')
+
+        rows = []
+        partitions = self.partitions(start, end)
+        for _, _, path in reversed(partitions) if newest_first else partitions:
+            if len(rows) >= limit:
+                break
+            try:
+                conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+                try:
+                    rows.extend(conn.execute(sql, params + [limit - len(rows)]).fetchall())
+                finally:
+                    conn.close()
+            except sqlite3.Error as e:
+                # Dropped by retention since it was listed, or not written yet
+                print(f"Error reading packet partition {path}: {e}")
+        if self.legacy_db:
+            legacy_rows = self._fetch_legacy(sql, params + [limit])
+            if legacy_rows:
+                timestamp = columns.index('timestamp')
+                rows.extend(legacy_rows)
+                rows.sort(key=lambda row: row[timestamp], reverse=newest_first)
+                del rows[limit:]
+        return rows
+
+    def _fetch_legacy(self, sql, params):
+        """Rows of the legacy packets table matching a fetch() query"""
+        try:
+            conn = sqlite3.connect(f'file:{self.legacy_db}?mode=ro', uri=True)
+            try:
+                return conn.execute(sql, params).fetchall()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"Error reading legacy packets from {self.legacy_db}: {e}")
+            return []
+
+    def expired(self, cutoff):
+        """Partitions that end at or before cutoff"""
+        return [partition for partition in self.partitions(end=cutoff) if partition[1] <= cutoff]
+
+    def retire(self, start, path):
+        """Rename an expired partition out of the writer's way; returns the new path, or None if it is open"""
+        with self.lock:
+            if start in self.open_connections and self.partition_path(start) == path:
+                return None
+            retired = path[:-len('.db')] + '.expired.db'
+            for suffix in ('', '-wal', '-shm'):  # SQLite finds the WAL by the database's name
+                if os.path.exists(path + suffix):
+                    os.replace(path + suffix, retired + suffix)
+            return retired
+
+    def retired(self):
+        """Paths of retired partitions not deleted yet"""
+        return sorted(glob.glob(os.path.join(self.directory, 'packets_*.expired.db')))
+
+    def delete(self, path):
+        """Delete a retired partition file"""
+        freed = 0
+        for file_path in (path, path + '-wal', path + '-shm'):
+            try:
+                freed += os.path.getsize(file_path)
+                os.remove(file_path)
+            except FileNotFoundError:
+                pass
+        self.partitions_dropped += 1
+        self.bytes_dropped += freed
+
+    def get_stats(self):
+        partitions = self.partitions()
+        size = 0
+        for _, _, path in partitions:
+            for file_path in (path, path + '-wal'):
+                try:
+                    size += os.path.getsize(file_path)
+                except OSError:
+                    pass
+        return {
+            'directory': self.directory,
+            'granularity': self.granularity,
+            'partitions': len(partitions),
+            'oldest': partitions[0][0] if partitions else None,
+            'newest': partitions[-1][0] if partitions else None,
+            'bytes': size,
+            'open_for_writing': len(self.open_connections),
+            'partitions_dropped': self.partitions_dropped,
+            'bytes_dropped': self.bytes_dropped
+        }
+
+
+class PartitionedPacketWriter(BatchedPacketWriter):
+    """Background writer that batches packet rows into the partition of each row's timestamp"""
+
+    INSERT_SQL = f'INSERT INTO packets ({", ".join(PACKET_COLUMNS)}) VALUES ({", ".join("?" * len(PACKET_COLUMNS))})'
+
+    def __init__(self, router, **kwargs):
+        super().__init__(router.directory, **kwargs)
+        self.router = router
+
+    def _connect(self):
+        # The router stands in for the connection: it hands out one per partition and closes them all
+        return self.router
+
+    def _write_batch(self, conn, batch):
+        """Insert a batch, one transaction per partition it touches"""
+        by_partition = defaultdict(list)
+        for row in batch:
+            by_partition[self.router.partition_start(row[0])].append(row)
+        for start, rows in by_partition.items():
+            try:
+                partition = self.router.connection(start)
+            except sqlite3.Error as e:
+                self.errors += 1
+                print(f"Error opening packet partition for {start}: {e}")
+                continue
+            super()._write_batch(partition, rows)
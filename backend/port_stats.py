@@ -0,0 +1,126 @@
+import heapq
+
+
+class RankedCounters:
+    """Counters per key ([packets, bytes, ...]) that keep their busiest keys ranked as they update.
+
+    leaders always contains the keep keys with the most packets (it may hold
+    up to twice as many between trims), so top() ranks at most 2 * keep
+    entries however many keys there are. Counters only grow: a key outside
+    leaders has at most threshold packets while every leader has at least
+    that many.
+    """
+
+    def __init__(self, keep=100, width=2):
+        self.keep = keep
+        self.width = width
+        self.counters = {}
+        self.leaders = set()
+        self.threshold = 0
+
+    def __len__(self):
+        return len(self.counters)
+
+    def get(self, key):
+        return self.counters.get(key)
+
+    def add(self, key, packets, size):
+        """Add packets/bytes to a key and return its counters list"""
+        counters = self.counters.get(key)
+        if counters is None:
+            counters = self.counters[key] = [0] * self.width
+        counters[0] += packets
+        counters[1] += size
+        if counters[0] > self.threshold and key not in self.leaders:
+            self.leaders.add(key)
+            if len(self.leaders) > 2 * self.keep:
+                self._trim()
+        return counters
+
+    def discard(self, key):
+        """Forget a key; top() stays exact while at least n leaders remain"""
+        self.counters.pop(key, None)
+        self.leaders.discard(key)
+
+    def top(self, n):
+        """(key, counters) for the n keys with the most packets (n <= keep)"""
+        counters = self.counters
+        keys = heapq.nlargest(n, self.leaders, key=lambda key: counters[key][0])
+        return [(key, counters[key]) for key in keys]
+
+    def clear(self):
+        """Drop all counters"""
+        self.counters.clear()
+        self.leaders.clear()
+        self.threshold = 0
+
+    def _trim(self):
+        """Shrink leaders back to the keep busiest keys and raise the threshold"""
+        counters = self.counters
+        kept = heapq.nlargest(self.keep, self.leaders, key=lambda key: counters[key][0])
+        self.leaders = set(kept)
+        self.threshold = counters[kept[-1]][0]
+
+
+class PortStats:
+    """Live port and protocol aggregates, updated once per packet at capture time.
+
+    Keeps packets/bytes per protocol, per port (in total and as source or
+    destination) and per (port, country), plus a ranking of the unusual (port, direction) pairs.
+    Unusual ports are classified once, the first time they are seen. The
+    rankings are maintained incrementally, so queries do not depend on traffic
+    volume or on how many distinct ports have been seen. Callers serialize access.
+    """
+
+    def __init__(self, is_unusual_port, keep=100):
+        self.is_unusual_port = is_unusual_port
+        self.protocols = {}  # protocol -> [packets, bytes]
+        self.ports = RankedCounters(keep, width=6)  # port -> [packets, bytes, src packets, src bytes, dst packets, dst bytes]
+        self.unusual = RankedCounters(keep)  # (port, direction) for unusual ports only
+        self.port_countries = RankedCounters(keep)
+        self.unusual_cache = {}  # port -> is_unusual_port(port)
+
+    def add(self, protocol, size, src_port=None, dst_port=None, src_country=None, dst_country=None, packets=1):
+        """Account packets (all in the same direction of one 5-tuple) totalling size bytes"""
+        protocol_counters = self.protocols.get(protocol)
+        if protocol_counters is None:
+            protocol_counters = self.protocols[protocol] = [0, 0]
+        protocol_counters[0] += packets
+        protocol_counters[1] += size
+
+        if src_port:
+            self._add_port(src_port, 2, 'source', packets, size)
+        if dst_port:
+            self._add_port(dst_port, 4, 'destination', packets, size)
+
+        # A packet counts towards the country of each endpoint with known geo data
+        for country in (src_country, dst_country):
+            if country is None:
+                continue
+            if src_port:
+                self.port_countries.add((src_port, country), packets, size)
+            if dst_port:
+                self.port_countries.add((dst_port, country), packets, size)
+
+    def _add_port(self, port, offset, direction, packets, size):
+        counters = self.ports.add(port, packets, size)
+        counters[offset] += packets
+        counters[offset + 1] += size
+
+        unusual = self.unusual_cache.get(port)
+        if unusual is None:
+            unusual = self.unusual_cache[port] = self.is_unusual_port(port)
+        if unusual:
+            self.unusual.add((port, direction), packets, size)
+
+    def protocol_totals(self):
+        """(protocol, packets, bytes) sorted by packets"""
+        return sorted(((protocol, packets, size) for protocol, (packets, size) in self.protocols.items()),
+                      key=lambda entry: entry[1], reverse=True)
+
+    def clear(self):
+        """Drop all counters"""
+        self.protocols.clear()
+        self.ports.clear()
+        self.unusual.clear()
+        self.port_countries.clear()
@@ -0,0 +1,212 @@
+import heapq
+import socket
+
+from ip_table import IPV6_KEY, ip_key
+
+
+class PrefixNode:
+    """Trie node covering prefix/length, with traffic totals for every address below it"""
+
+    __slots__ = ('prefix', 'length', 'children', 'packets', 'bytes', 'ips')
+
+    def __init__(self, prefix, length):
+        self.prefix = prefix
+        self.length = length
+        self.children = [None, None]
+        self.packets = 0
+        self.bytes = 0
+        self.ips = 0  # Addresses (leaves) below this node
+
+
+class PrefixTrie:
+    """Path-compressed binary trie over the addresses of one IP version.
+
+    Only branching nodes and leaves exist, so the depth is about log2 of
+    the number of addresses rather than the address width. Every node
+    holds packets, bytes and the number of addresses below it. The clusters
+    at prefix length L are the topmost nodes at least L bits long. top()
+    walks them best-first, largest subtree first, so its cost grows with
+    the size of the answer rather than with the number of addresses.
+    """
+
+    def __init__(self, bits):
+        self.bits = bits
+        self.root = PrefixNode(0, 0)
+
+    def add(self, key, packets, size):
+        """Add traffic for an address (an integer of self.bits bits)"""
+        bits = self.bits
+        node = self.root
+        path = [node]
+        new = False
+        while node.length < bits:
+            bit = (key >> (bits - 1 - node.length)) & 1
+            child = node.children[bit]
+            if child is None:
+                child = node.children[bit] = PrefixNode(key, bits)
+                path.append(child)
+                new = True
+                break
+            common = bits - (key ^ child.prefix).bit_length()
+            if common >= child.length:
+                node = child
+                path.append(node)
+                continue
+
+            # Split the edge: a branching node where key and child diverge
+            shift = bits - common
+            middle = PrefixNode(key >> shift << shift, common)
+            middle.packets = child.packets
+            middle.bytes = child.bytes
+            middle.ips = child.ips
+            middle.children[(child.prefix >> (shift - 1)) & 1] = child
+            leaf = middle.children[(key >> (shift - 1)) & 1] = PrefixNode(key, bits)
+            node.children[bit] = middle
+            path.append(middle)
+            path.append(leaf)
+            new = True
+            break
+
+        for node in path:
+            node.packets += packets
+            node.bytes += size
+            if new:
+                node.ips += 1
+
+    def remove(self, key):
+        """Remove an address and its traffic"""
+        bits = self.bits
+        path = [self.root]
+        node = self.root
+        while node.length < bits:
+            node = node.children[(key >> (bits - 1 - node.length)) & 1]
+            if node is None or (node.prefix ^ key) >> (bits - node.length):
+                return False
+            path.append(node)
+        leaf = path[-1]
+        for node in path[:-1]:
+            node.packets -= leaf.packets
+            node.bytes -= leaf.bytes
+            node.ips -= 1
+
+        # Detach the leaf; a parent left with a single child is spliced out
+        parent = path[-2]
+        parent.children[parent.children.index(leaf)] = None
+        if parent is not self.root:
+            remaining = parent.children[0] or parent.children[1]
+            grandparent = path[-3]
+            grandparent.children[grandparent.children.index(parent)] = remaining
+        return True
+
+    def find(self, prefix, length):
+        """The topmost node within prefix/length, or None if no address falls in it"""
+        bits = self.bits
+        node = self.root
+        while node.length < length:
+            node = node.children[(prefix >> (bits - 1 - node.length)) & 1]
+            if node is None:
+                return None
+            checked = min(node.length, length)
+            if (node.prefix ^ prefix) >> (bits - checked):
+                return None
+        return node
+
+    def top(self, length, n=10, by='bytes', within=None):
+        """(prefix, packets, bytes, ips) for the n largest /length clusters, optionally inside within=(prefix, length)"""
+        start = self.root
+        if within is not None:
+            start = self.find(*within)
+            if start is None:
+                return []
+        if start.ips == 0:
+            return []
+
+        shift = self.bits - length
+        counter = 0
+        heap = [(-getattr(start, by), counter, start)]
+        result = []
+        while heap and len(result) < n:
+            _, _, node = heapq.heappop(heap)
+            if node.length >= length:
+                result.append((node.prefix >> shift << shift, node.packets, node.bytes, node.ips))
+                continue
+            for child in node.children:
+                if child is not None:
+                    counter += 1
+                    heapq.heappush(heap, (-getattr(child, by), counter, child))
+        return result
+
+
+class PrefixIndex:
+    """Live IPv4 and IPv6 prefix tries fed with per-address traffic.
+
+    add() only accumulates per-address deltas; they are folded into the
+    tries by flush() (called by queries and the stats loop), so a busy
+    address costs one dict update per packet and one trie walk per flush.
+    Callers serialize access.
+    """
+
+    def __init__(self):
+        self.v4 = PrefixTrie(32)
+        self.v6 = PrefixTrie(128)
+        self.pending = {}  # ip -> [packets, bytes] not yet in the tries
+
+    def add(self, ip, packets, size):
+        """Record traffic for an address"""
+        delta = self.pending.get(ip)
+        if delta is None:
+            self.pending[ip] = [packets, size]
+        else:
+            delta[0] += packets
+            delta[1] += size
+
+    def remove(self, ip):
+        """Forget an address (e.g. when it is evicted from the IP table)"""
+        self.pending.pop(ip, None)
+        try:
+            key = ip_key(ip)
+        except ValueError:
+            return
+        if key >= IPV6_KEY:
+            self.v6.remove(key - IPV6_KEY)
+        else:
+            self.v4.remove(key)
+
+    def flush(self):
+        """Fold pending deltas into the tries"""
+        pending, self.pending = self.pending, {}
+        for ip, (packets, size) in pending.items():
+            try:
+                key = ip_key(ip)
+            except ValueError:
+                continue
+            if key >= IPV6_KEY:
+                self.v6.add(key - IPV6_KEY, packets, size)
+            else:
+                self.v4.add(key, packets, size)
+
+    def top(self, length, n=10, by='bytes', within=None, version=4):
+        """Largest clusters at a prefix length as dicts, optionally inside a 'prefix/len' network"""
+        self.flush()
+        trie = self.v6 if version == 6 else self.v4
+        family = socket.AF_INET6 if version == 6 else socket.AF_INET
+        width = trie.bits // 8
+        if within is not None:
+            address, _, within_length = within.partition('/')
+            within = (int.from_bytes(socket.inet_pton(family, address), 'big'), int(within_length or trie.bits))
+        return [{
+            'network': f"{socket.inet_ntop(family, prefix.to_bytes(width, 'big'))}/{length}",
+            'packets': packets,
+            'bytes': size,
+            'unique_ips': ips
+        } for prefix, packets, size, ips in trie.top(length, n, by, within)]
+
+    def members(self, network, n=10, by='bytes'):
+        """Up to n of the busiest addresses inside a 'prefix/len' network"""
+        version = 6 if ':' in network else 4
+        return [cluster['network'].split('/')[0]
+                for cluster in self.top(128 if version == 6 else 32, n, by, network, version)]
+
+    def get_stats(self):
+        """Addresses indexed and trie sizes"""
+        return {'ipv4_addresses': self.v4.root.ips, 'ipv6_addresses': self.v6.root.ips, 'pending': len(self.pending)}
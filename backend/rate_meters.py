@@ -0,0 +1,165 @@
+import numpy as np
+
+WINDOWS = {'1s': 1, '10s': 10, '1m': 60, '5m': 300, '1h': 3600}
+
+
+class RateMeter:
+    """Packets and bytes per second for the last horizon seconds, in fixed circular arrays.
+
+    Traffic accumulates in pending and is written into the bucket of the
+    second that just ended by roll(), which the clock calls once a second;
+    seconds without a roll() (or without traffic) are zeroed on the next one.
+    """
+
+    __slots__ = ('horizon', 'packets', 'bytes', 'pending', 'second', 'first_second')
+
+    def __init__(self, horizon=3600):
+        self.horizon = horizon
+        self.packets = np.zeros(horizon, dtype=np.int64)
+        self.bytes = np.zeros(horizon, dtype=np.int64)
+        self.pending = [0, 0]  # [packets, bytes] since the last roll
+        self.second = None  # Last closed second
+        self.first_second = None
+
+    def roll(self, second):
+        """Close every second before second, putting pending traffic in the last of them"""
+        if self.second is None:
+            self.second = second - 2
+            self.first_second = second - 1 if self.pending[0] else second
+        elapsed = second - 1 - self.second
+        if elapsed <= 0:
+            return
+        slots = np.arange(second - min(elapsed, self.horizon), second) % self.horizon
+        self.packets[slots] = 0
+        self.bytes[slots] = 0
+        slot = (second - 1) % self.horizon
+        pending = self.pending
+        self.packets[slot] = pending[0]
+        self.bytes[slot] = pending[1]
+        pending[0] = pending[1] = 0
+        self.second = second - 1
+
+    def rates(self, windows=WINDOWS):
+        """{'1s': {'pps': ..., 'bps': ...}, ...}: averages over each window (or the meter's age, if shorter)"""
+        result = {}
+        if self.second is None:
+            return {name: {'pps': 0.0, 'bps': 0.0} for name in windows}
+        age = self.second - self.first_second + 1
+        for name, seconds in windows.items():
+            seconds = min(seconds, self.horizon)
+            slots = np.arange(self.second - seconds + 1, self.second + 1) % self.horizon
+            span = max(1, min(seconds, age))
+            result[name] = {
+                'pps': float(self.packets[slots].sum()) / span,
+                'bps': float(self.bytes[slots].sum()) * 8 / span
+            }
+        return result
+
+
+class RateMeters:
+    """Sliding-window pps/bps for all traffic and per interface, protocol and top IP.
+
+    add() only bumps pending counters; tick() rolls every meter over once a
+    second. Meters for IPs exist only for the addresses passed to
+    track_ips() (the current top talkers), so a newly tracked IP starts with
+    an empty history. Callers serialize access.
+    """
+
+    def __init__(self, horizon=3600, windows=WINDOWS):
+        self.horizon = horizon
+        self.windows = windows
+        self.total = RateMeter(horizon)
+        self.interfaces = {}
+        self.protocols = {}
+        self.ips = {}
+
+    def add(self, interface, protocol, src, dst, size, packets=1):
+        """Account packets on an interface (protocol None for non-IP packets; src/dst count only if tracked)"""
+        pending = self.total.pending
+        pending[0] += packets
+        pending[1] += size
+        meter = self.interfaces.get(interface)
+        if meter is None:
+            meter = self.interfaces[interface] = self._new_meter()
+        pending = meter.pending
+        pending[0] += packets
+        pending[1] += size
+        if protocol is not None:
+            meter = self.protocols.get(protocol)
+            if meter is None:
+                meter = self.protocols[protocol] = self._new_meter()
+            pending = meter.pending
+            pending[0] += packets
+            pending[1] += size
+        ips = self.ips
+        if ips:
+            meter = ips.get(src)
+            if meter is not None:
+                pending = meter.pending
+                pending[0] += packets
+                pending[1] += size
+            meter = ips.get(dst)
+            if meter is not None:
+                pending = meter.pending
+                pending[0] += packets
+                pending[1] += size
+
+    def add_interface(self, interface, packets, size):
+        """Account traffic on an interface only (for pre-aggregated counts)"""
+        self.add(interface, None, None, None, size, packets)
+
+    def add_protocol(self, protocol, packets, size):
+        """Account traffic for a protocol only (for pre-aggregated counts)"""
+        meter = self.protocols.get(protocol)
+        if meter is None:
+            meter = self.protocols[protocol] = self._new_meter()
+        meter.pending[0] += packets
+        meter.pending[1] += size
+
+    def add_ip(self, ip, packets, size):
+        """Account traffic for an IP only (it must already be tracked)"""
+        meter = self.ips.get(ip)
+        if meter is not None:
+            meter.pending[0] += packets
+            meter.pending[1] += size
+
+    def track_ips(self, ips):
+        """Keep IP meters for exactly these addresses"""
+        current = self.ips
+        self.ips = {ip: current.get(ip) or self._new_meter() for ip in ips}
+
+    def tick(self, now):
+        """Roll every meter over to the second containing now"""
+        second = int(now)
+        self.total.roll(second)
+        for meters in (self.interfaces, self.protocols, self.ips):
+            for meter in meters.values():
+                meter.roll(second)
+
+    def closed_second(self):
+        """(second, packets, bytes, {protocol: (packets, bytes)}) for the last second rolled over, or None"""
+        second = self.total.second
+        if second is None:
+            return None
+        slot = second % self.horizon
+        protocols = {protocol: (int(meter.packets[slot]), int(meter.bytes[slot]))
+                     for protocol, meter in self.protocols.items() if meter.second == second and meter.packets[slot]}
+        return second, int(self.total.packets[slot]), int(self.total.bytes[slot]), protocols
+
+    def get_rates(self):
+        """Rates per window for every scope"""
+        windows = self.windows
+        return {
+            'global': self.total.rates(windows),
+            'interfaces': {str(key): meter.rates(windows) for key, meter in self.interfaces.items()},
+            'protocols': {str(key): meter.rates(windows) for key, meter in self.protocols.items()},
+            'ips': {ip: meter.rates(windows) for ip, meter in self.ips.items()}
+        }
+
+    def _new_meter(self):
+        meter = RateMeter(self.horizon)
+        if self.total.second is not None:
+            # Pending traffic belongs to the second the next roll closes
+            meter.second = self.total.second
+            meter.first_second = self.total.second + 1
+        return meter
@@ -0,0 +1,215 @@
+import argparse
+import contextlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from fast_decode import PacketRecord, decode_frame, read_pcap
+from session_file import read_session_file
+
+PCAP_MAGICS = (b'\xd4\xc3\xb2\xa1', b'\xa1\xb2\xc3\xd4', b'\x4d\x3c\xb2\xa1', b'\xa1\xb2\x3c\x4d', b'\x0a\x0d\x0d\x0a')
+
+
+def is_pcap_file(path):
+    """Whether path starts with a pcap or pcapng magic number"""
+    with open(path, 'rb') as f:
+        return f.read(4) in PCAP_MAGICS
+
+
+def session_packet_to_record(packet):
+    """Convert a packet dict from a saved session into a PacketRecord"""
+    src = packet.get('src')
+    dst = packet.get('dst')
+    return PacketRecord(
+        packet['timestamp'],
+        packet['size'],
+        src=None if src in (None, 'Unknown') else src,
+        dst=None if dst in (None, 'Unknown') else dst,
+        protocol=packet.get('protocol', 0),
+        src_port=packet.get('src_port'),
+        dst_port=packet.get('dst_port'),
+        tcp_flags=packet.get('tcp_flags')
+    )
+
+
+def iter_replay_records(path):
+    """Yield PacketRecords from a pcap/pcapng file or a saved session file"""
+    if is_pcap_file(path):
+        for timestamp, frame, origlen, linktype in read_pcap(path):
+            yield decode_frame(frame, timestamp, linktype, origlen)
+    else:
+        _, packets = read_session_file(path)
+        for packet in packets:
+            yield session_packet_to_record(packet)
+
+
+class PacketReplayer:
+    """Feeds a capture file through a packet record handler.
+
+    speed 0 replays as fast as possible; otherwise packets are paced by
+    their original timestamps, scaled by speed (1.0 = original timing).
+    Mirrors the AsyncSniffer start/stop interface.
+    """
+
+    def __init__(self, path, prn, speed=0, limit=None):
+        self.path = path
+        self.prn = prn
+        self.speed = float(speed or 0)
+        self.limit = limit
+        self.thread = None
+        self.running = False
+        self.wake = threading.Event()  # Cuts a pacing sleep short when stopping
+
+        # Counters exposed through the replay API
+        self.packets = 0
+        self.bytes = 0
+        self.started_at = None
+        self.finished_at = None
+        self.first_timestamp = None
+        self.last_timestamp = None
+        self.error = None
+
+    def start(self):
+        """Start replaying in a background thread"""
+        self.running = True
+        self.wake.clear()
+        self.thread = threading.Thread(target=self._run, name='packet-replay')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self, join=True, timeout=5):
+        """Stop replaying"""
+        self.running = False
+        self.wake.set()
+        if join and self.thread:
+            self.thread.join(timeout)
+
+    def join(self, timeout=None):
+        """Wait for the replay thread"""
+        if self.thread:
+            self.thread.join(timeout)
+
+    def run(self):
+        """Replay in the calling thread and return the final stats"""
+        self.running = True
+        self._run()
+        return self.get_stats()
+
+    def get_stats(self):
+        """Get replay progress and ingest rate"""
+        end = self.finished_at or time.perf_counter()
+        elapsed = end - self.started_at if self.started_at else 0.0
+        capture_span = (self.last_timestamp - self.first_timestamp) if self.packets else 0.0
+        return {
+            'file': self.path,
+            'running': self.running,
+            'speed': self.speed,
+            'packets': self.packets,
+            'bytes': self.bytes,
+            'elapsed': elapsed,
+            'pps': self.packets / elapsed if elapsed else 0.0,
+            'bps': self.bytes * 8 / elapsed if elapsed else 0.0,
+            'capture_span': capture_span,
+            'finished': self.finished_at is not None,
+            'error': self.error
+        }
+
+    def _run(self):
+        """Replay loop"""
+        prn = self.prn
+        speed = self.speed
+        self.started_at = time.perf_counter()
+        try:
+            for record in iter_replay_records(self.path):
+                if not self.running:
+                    break
+                if self.first_timestamp is None:
+                    self.first_timestamp = record.timestamp
+                if speed:
+                    # Wait until this packet's offset in the capture, scaled by speed
+                    delay = (record.timestamp - self.first_timestamp) / speed - (time.perf_counter() - self.started_at)
+                    if delay > 0 and self.wake.wait(delay):
+                        break
+                prn(record)
+                self.last_timestamp = record.timestamp
+                self.packets += 1
+                self.bytes += record.size
+                if self.limit and self.packets >= self.limit:
+                    break
+        except Exception as e:
+            self.error = str(e)
+            print(f"Error replaying {self.path}: {e}")
+        finally:
+            self.finished_at = time.perf_counter()
+            self.running = False
+
+
+@contextlib.contextmanager
+def scratch_app():
+    """Import the backend with its database, packet partitions, sessions and models in a temporary directory.
+
+    Offline runs (the replay CLI, benchmarks) use this so their traffic never
+    lands in the storage of a real deployment. The GeoIP database is still
+    read from the original working directory.
+    """
+    directory = tempfile.mkdtemp(prefix='nta-scratch-')
+    previous = os.getcwd()
+    os.environ.setdefault('GEOIP_DB_PATH', os.path.abspath('geoip.ntadb'))
+    os.environ.setdefault('NTA_CAPTURE_WORKERS', '0')  # No multiprocess capture, so no worker launcher
+    os.chdir(directory)
+    try:
+        import app
+        try:
+            yield app
+        finally:
+            app.stop_storage_writers()
+    finally:
+        os.chdir(previous)
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def replay_via_server(url, path, speed, limit):
+    """Start a replay on a running backend and poll it until it finishes"""
+    import requests
+    response = requests.post(f'{url}/api/replay', json={'file': path, 'speed': speed, 'limit': limit}).json()
+    if response.get('status') != 'success':
+        raise RuntimeError(response.get('message'))
+    while True:
+        time.sleep(1)
+        stats = requests.get(f'{url}/api/replay').json()['replay']
+        print(f"   {stats['packets']} packets, {stats['pps']:.0f} pps")
+        if not stats['running']:
+            return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Replay a pcap/pcapng file or saved session through the analysis pipeline')
+    parser.add_argument('file', help='pcap/pcapng file or session_*.json / .ndjson[.gz|.zst] '
+                                     '(with --server, a path inside the server\'s NTA_REPLAY_DIR)')
+    parser.add_argument('--speed', type=float, default=0,
+                        help='0 = as fast as possible (default), 1 = original timing, 2 = twice as fast, ...')
+    parser.add_argument('--limit', type=int, help='Stop after this many packets')
+    parser.add_argument('--server', help='Backend URL (e.g. http://localhost:5000); replays in-process if omitted')
+    parser.add_argument('--json', action='store_true', help='Print the final stats as JSON')
+    args = parser.parse_args()
+
+    if args.server:
+        stats = replay_via_server(args.server, args.file, args.speed, args.limit)
+    else:
+        # Same pipeline as live capture, without needing root or an interface, and with throwaway storage
+        path = os.path.abspath(args.file)
+        with scratch_app() as app:
+            stats = PacketReplayer(path, app.handle_packet_record, args.speed, args.limit).run()
+            stats['total_packets'] = app.packet_stats['total_packets']
+            stats['unique_ips'] = len(app.packet_stats['ips'])
+
+    if args.json:
+        print(json.dumps(stats, indent=2))
+    else:
+        print(f"Replayed {stats['packets']} packets ({stats['bytes']} bytes) in {stats['elapsed']:.2f}s: "
+              f"{stats['pps']:.0f} pps, {stats['bps'] / 1e6:.1f} Mbit/s")
+        if stats['error']:
+            print(f"Error: {stats['error']}")
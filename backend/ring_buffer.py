@@ -0,0 +1,99 @@
+import numpy as np
+
+# One row per packet; ports and TCP flags are -1 when not present
+PACKET_DTYPE = np.dtype([
+    ('timestamp', 'f8'),
+    ('src', 'S39'),  # Long enough for any textual IPv6 address
+    ('dst', 'S39'),
+    ('protocol', 'i2'),
+    ('size', 'u4'),
+    ('src_port', 'i4'),
+    ('dst_port', 'i4'),
+    ('tcp_flags', 'i2')
+])
+
+
+class PacketRingBuffer:
+    """Fixed-capacity packet history backed by a NumPy structured array.
+
+    append() overwrites the oldest row in O(1). last() returns a view of the
+    newest rows without copying unless the requested window wraps around the
+    end of the array; last_segments() never copies.
+    """
+
+    def __init__(self, capacity=100000):
+        self.capacity = int(capacity)
+        self.data = np.zeros(self.capacity, dtype=PACKET_DTYPE)
+        self.head = 0  # Next slot to write
+        self.total = 0  # Rows appended since creation (a sequence number)
+
+    def __len__(self):
+        return min(self.total, self.capacity)
+
+    def append(self, timestamp, src, dst, protocol, size, src_port=None, dst_port=None, tcp_flags=None):
+        """Append one packet, overwriting the oldest row when full"""
+        self.data[self.head] = (
+            timestamp,
+            src.encode() if isinstance(src, str) else (src or b''),
+            dst.encode() if isinstance(dst, str) else (dst or b''),
+            protocol,
+            size,
+            -1 if src_port is None else src_port,
+            -1 if dst_port is None else dst_port,
+            -1 if tcp_flags is None else tcp_flags
+        )
+        self.head += 1
+        if self.head == self.capacity:
+            self.head = 0
+        self.total += 1
+
+    def clear(self):
+        """Drop all rows"""
+        self.head = 0
+        self.total = 0
+
+    def last_segments(self, n=None):
+        """Return the newest n rows as up to two zero-copy views, oldest first"""
+        size = len(self)
+        n = size if n is None else max(0, min(int(n), size))
+        if n == 0:
+            return []
+        if n <= self.head:
+            return [self.data[self.head - n:self.head]]
+        # The window wraps: tail of the array followed by its start
+        return [self.data[self.capacity - (n - self.head):], self.data[:self.head]]
+
+    def last(self, n=None):
+        """Return the newest n rows (a view unless the window wraps)"""
+        segments = self.last_segments(n)
+        if not segments:
+            return self.data[:0]
+        if len(segments) == 1:
+            return segments[0]
+        return np.concatenate(segments)
+
+    def since(self, sequence):
+        """Return rows appended after the given sequence number, and the new sequence number"""
+        return self.last(self.total - sequence), self.total
+
+    def to_dicts(self, n=None):
+        """Convert the newest n rows into JSON-friendly dicts (for API responses only)"""
+        packets = []
+        for segment in self.last_segments(n):
+            for row in segment.tolist():
+                timestamp, src, dst, protocol, size, src_port, dst_port, tcp_flags = row
+                packet_info = {
+                    'timestamp': timestamp,
+                    'src': src.decode(),
+                    'dst': dst.decode(),
+                    'protocol': protocol,
+                    'size': size
+                }
+                if src_port >= 0:
+                    packet_info['src_port'] = src_port
+                if dst_port >= 0:
+                    packet_info['dst_port'] = dst_port
+                if tcp_flags >= 0:
+                    packet_info['tcp_flags'] = tcp_flags
+                packets.append(packet_info)
+        return packets
@@ -0,0 +1,193 @@
+import math
+import sqlite3
+import threading
+import time
+
+from db_writer import BatchedPacketWriter
+
+PROTOCOL_COLUMNS = {1: 'icmp', 6: 'tcp', 17: 'udp', 58: 'icmpv6'}  # Other protocols share the 'other' columns
+PROTOCOL_NAMES = ('icmp', 'tcp', 'udp', 'icmpv6', 'other')
+VALUE_COLUMNS = ('packets', 'bytes') + tuple(f'{name}_{metric}' for name in PROTOCOL_NAMES
+                                             for metric in ('packets', 'bytes'))
+TABLES = {1: 'rollup_1s', 60: 'rollup_1m', 3600: 'rollup_1h'}  # resolution in seconds -> table
+DEFAULT_RETENTION = {1: 86400, 60: 30 * 86400, 3600: 365 * 86400}
+
+
+def create_rollup_tables(cursor):
+    """Create the per-second, per-minute and per-hour rollup tables"""
+    columns = ', '.join(f'{column} INTEGER NOT NULL DEFAULT 0' for column in VALUE_COLUMNS)
+    for table in TABLES.values():
+        cursor.execute(f'CREATE TABLE IF NOT EXISTS {table} (ts INTEGER PRIMARY KEY, {columns})')
+
+
+def second_row(second, packets, size, protocols):
+    """Row for rollup_1s from totals and {protocol: (packets, bytes)}"""
+    values = dict.fromkeys(VALUE_COLUMNS, 0)
+    values['packets'] = packets
+    values['bytes'] = size
+    for protocol, (protocol_packets, protocol_bytes) in protocols.items():
+        name = PROTOCOL_COLUMNS.get(protocol, 'other')
+        values[f'{name}_packets'] += protocol_packets
+        values[f'{name}_bytes'] += protocol_bytes
+    return (second,) + tuple(values[column] for column in VALUE_COLUMNS)
+
+
+class RollupWriter(BatchedPacketWriter):
+    """Background writer that adds per-second deltas to rollup_1s"""
+
+    INSERT_SQL = (
+        f'INSERT INTO rollup_1s (ts, {", ".join(VALUE_COLUMNS)}) VALUES ({", ".join("?" * (len(VALUE_COLUMNS) + 1))}) '
+        f'ON CONFLICT(ts) DO UPDATE SET {", ".join(f"{column} = {column} + excluded.{column}" for column in VALUE_COLUMNS)}'
+    )
+    THREAD_NAME = 'rollup-writer'
+
+
+class RollupStore:
+    """Traffic deltas at one-second, one-minute and one-hour resolution in SQLite.
+
+    add_second() queues one row per second with traffic for the background
+    writer. A compaction thread sums completed minutes into rollup_1m and
+    completed hours into rollup_1h every compact_interval seconds, then
+    deletes rows older than each resolution's retention (seconds). query()
+    reads the coarsest table that still answers a range with at most
+    max_rows rows scanned, topping up its not-yet-compacted tail from the
+    finer tables, and sums rows into at most max_points buckets.
+    """
+
+    def __init__(self, db_path='nta_data.db', retention=None, compact_interval=60, settle=5, max_rows=5000):
+        self.db_path = db_path
+        self.retention = dict(DEFAULT_RETENTION)
+        self.retention.update(retention or {})
+        self.compact_interval = compact_interval
+        self.settle = settle  # Seconds the writer may lag behind the clock
+        self.max_rows = max_rows
+        self.writer = RollupWriter(db_path, batch_size=60, flush_interval=1.0)
+        self.last_second = None
+        self.thread = None
+        self.running = False
+        self.wake = threading.Event()
+        self.compactions = 0
+        self.last_compaction_seconds = 0.0
+
+    def start(self):
+        """Start the writer and compaction threads"""
+        if self.running:
+            return
+        self.running = True
+        self.writer.start()
+        self.thread = threading.Thread(target=self._run, name='rollup-compactor')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self, timeout=5):
+        """Stop the compaction thread and flush the writer"""
+        self.running = False
+        self.wake.set()
+        if self.thread:
+            self.thread.join(timeout)
+            self.thread = None
+        self.writer.stop(timeout)
+
+    def add_second(self, second, packets, size, protocols):
+        """Queue one closed second's traffic ({protocol: (packets, bytes)}); each second is added once"""
+        if self.last_second is not None and second <= self.last_second:
+            return
+        self.last_second = second
+        if packets:
+            self.writer.submit(second_row(second, packets, size, protocols))
+
+    def compact(self, now=None):
+        """Downsample completed minutes and hours, then apply retention"""
+        started = time.time()
+        now = started if now is None else now
+        sums = ', '.join(f'SUM({column})' for column in VALUE_COLUMNS)
+        conn = sqlite3.connect(self.db_path)
+        try:
+            cursor = conn.cursor()
+            for fine, coarse in ((1, 60), (60, 3600)):
+                fine_table, coarse_table = TABLES[fine], TABLES[coarse]
+                end = int(now - self.settle) // coarse * coarse
+                last = cursor.execute(f'SELECT MAX(ts) FROM {coarse_table}').fetchone()[0]
+                if last is not None:
+                    begin = last + coarse
+                else:
+                    first = cursor.execute(f'SELECT MIN(ts) FROM {fine_table}').fetchone()[0]
+                    if first is None:
+                        continue
+                    begin = first // coarse * coarse
+                if begin < end:
+                    cursor.execute(f'''
+                        INSERT OR REPLACE INTO {coarse_table} (ts, {", ".join(VALUE_COLUMNS)})
+                        SELECT ts / {coarse} * {coarse}, {sums} FROM {fine_table}
+                        WHERE ts >= ? AND ts < ? GROUP BY ts / {coarse}
+                    ''', (begin, end))
+            for resolution, table in TABLES.items():
+                cursor.execute(f'DELETE FROM {table} WHERE ts < ?', (int(now - self.retention[resolution]),))
+            conn.commit()
+        finally:
+            conn.close()
+        self.compactions += 1
+        self.last_compaction_seconds = time.time() - started
+
+    def pick_resolution(self, start, end, now=None):
+        """Coarsest-needed resolution for a range: the finest one retained that scans at most max_rows rows"""
+        now = time.time() if now is None else now
+        for resolution in sorted(TABLES):
+            if start >= now - self.retention[resolution] and (end - start) / resolution <= self.max_rows:
+                return resolution
+        return max(TABLES)
+
+    def query(self, start, end, max_points=500, resolution=None):
+        """(resolution, step, rows) for [start, end), start rounded down to a step: dicts of summed deltas per bucket"""
+        start, end = int(start), int(math.ceil(end))
+        if resolution is None:
+            resolution = self.pick_resolution(start, end)
+        elif resolution not in TABLES:
+            raise ValueError(f'Unknown resolution: {resolution}')
+        step = max(resolution, math.ceil((end - start) / max(1, max_points) / resolution) * resolution)
+        start = start // step * step  # Whole buckets only, so coarse rows are never cut in half
+        sums = ', '.join(f'SUM({column})' for column in VALUE_COLUMNS)
+
+        buckets = {}
+        conn = sqlite3.connect(self.db_path)
+        try:
+            cursor = conn.cursor()
+            begin = start
+            for table_resolution in sorted((r for r in TABLES if r <= resolution), reverse=True):
+                if begin >= end:
+                    break
+                table = TABLES[table_resolution]
+                cursor.execute(f'''
+                    SELECT ts / {step} * {step}, {sums} FROM {table}
+                    WHERE ts >= ? AND ts < ? GROUP BY ts / {step}
+                ''', (begin, end))
+                for bucket, *values in cursor.fetchall():
+                    current = buckets.get(bucket)
+                    buckets[bucket] = values if current is None else [a + b for a, b in zip(current, values)]
+                # Whatever this table has not compacted yet comes from the next finer one
+                last = cursor.execute(f'SELECT MAX(ts) FROM {table} WHERE ts < ?', (end,)).fetchone()[0]
+                if last is not None:
+                    begin = max(begin, last + table_resolution)
+        finally:
+            conn.close()
+
+        rows = [dict(zip(('timestamp',) + VALUE_COLUMNS, (bucket, *values))) for bucket, values in sorted(buckets.items())]
+        return resolution, step, rows
+
+    def get_stats(self):
+        return {
+            'writer': self.writer.get_stats(),
+            'compactions': self.compactions,
+            'last_compaction_ms': self.last_compaction_seconds * 1000,
+            'retention': {TABLES[resolution]: seconds for resolution, seconds in self.retention.items()}
+        }
+
+    def _run(self):
+        while self.running:
+            self.wake.wait(self.compact_interval)
+            if not self.running:
+                break
+            try:
+                self.compact()
+            except Exception as e:
+                print(f"Error compacting rollups: {e}")
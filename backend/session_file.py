@@ -0,0 +1,241 @@
+import gzip
+import io
+import json
+import os
+import queue
+import threading
+import time
+
+# zstandard is optional; gzip is always available
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    zstandard = None
+    ZSTD_AVAILABLE = False
+
+COMPRESSION_EXTENSIONS = {None: '', 'gzip': '.gz', 'zstd': '.zst'}
+
+
+def session_file_path(directory, session_info, compression=None):
+    """Build the file name used for a saved session"""
+    name = session_info['name'].replace(' ', '_')
+    return os.path.join(directory, f"session_{name}_{int(session_info['start_time'])}.ndjson"
+                        + COMPRESSION_EXTENSIONS[compression])
+
+
+def open_session_file(path, mode='rb'):
+    """Open a session file, picking the decompressor from the file extension"""
+    if path.endswith('.gz'):
+        return gzip.open(path, mode)
+    if path.endswith('.zst'):
+        if not ZSTD_AVAILABLE:
+            raise RuntimeError('zstandard is required for .zst session files (pip install zstandard)')
+        raw = open(path, mode)
+        if 'r' in mode:
+            return zstandard.ZstdDecompressor().stream_reader(raw, closefd=True)
+        return zstandard.ZstdCompressor().stream_writer(raw, closefd=True)
+    return open(path, mode)
+
+
+def packet_to_dict(packet):
+    """Convert a (timestamp, src, dst, protocol, size, src_port, dst_port, tcp_flags) tuple to a packet dict"""
+    timestamp, src, dst, protocol, size, src_port, dst_port, tcp_flags = packet
+    packet_info = {'timestamp': timestamp, 'src': src, 'dst': dst, 'protocol': protocol, 'size': size}
+    if src_port is not None:
+        packet_info['src_port'] = src_port
+    if dst_port is not None:
+        packet_info['dst_port'] = dst_port
+    if tcp_flags is not None:
+        packet_info['tcp_flags'] = tcp_flags
+    return packet_info
+
+
+def read_session_file(path):
+    """Read a saved session; returns (session_info, packet iterator).
+
+    Handles NDJSON session files (plain, .gz or .zst) and the older
+    single-document JSON files. For an NDJSON file whose writer did not
+    finish (e.g. after a crash), session_info only holds the header fields.
+    """
+    with io.TextIOWrapper(open_session_file(path), encoding='utf-8') as f:
+        first_line = f.readline()
+    try:
+        header = json.loads(first_line)
+    except ValueError:
+        header = None
+
+    if not isinstance(header, dict) or 'packets' in header or 'session_info' not in header:
+        # Older single-document {"session_info": ..., "packets": [...]} file
+        with open_session_file(path) as f:
+            document = json.load(f)
+        return document.get('session_info', {}), iter(document.get('packets', []))
+
+    session_info = header['session_info']
+
+    def iter_packets():
+        with io.TextIOWrapper(open_session_file(path), encoding='utf-8') as f:
+            try:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        return  # Truncated last line of an unfinished file
+                    if 'session_info' in entry:
+                        continue
+                    if 'session_end' in entry:
+                        session_info.update(entry['session_end'])
+                        continue
+                    yield entry
+            except EOFError:
+                return  # Compressed stream cut off by a crash
+
+    return session_info, iter_packets()
+
+
+class SessionFileWriter:
+    """Background writer that appends session packets to an NDJSON file as they arrive.
+
+    The first line holds session_info, each following line one packet, and a
+    final session_end line holds the end time and packet count. The file is
+    flushed and fsynced every fsync_interval seconds, so a crash only loses
+    the last interval.
+    """
+
+    def __init__(self, path, session_info, compression=None, fsync_interval=5.0, max_queue_size=100000):
+        if compression not in COMPRESSION_EXTENSIONS:
+            raise ValueError(f'Unknown session compression: {compression}')
+        if compression == 'zstd' and not ZSTD_AVAILABLE:
+            raise RuntimeError('zstandard is required for zstd session files (pip install zstandard)')
+        self.path = path
+        self.session_info = dict(session_info)
+        self.compression = compression
+        self.fsync_interval = fsync_interval
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.thread = None
+        self.running = False
+        self.end_info = None
+
+        # Counters exposed through the stats API
+        self.packets_written = 0
+        self.packets_dropped = 0
+        self.bytes_written = 0
+        self.last_fsync = None
+        self.errors = 0
+
+    def start(self):
+        """Open the file, write the header and start the writer thread"""
+        self.raw_file = open(self.path, 'wb')
+        if self.compression == 'gzip':
+            self.file = gzip.GzipFile(fileobj=self.raw_file, mode='wb')
+        elif self.compression == 'zstd':
+            self.file = zstandard.ZstdCompressor().stream_writer(self.raw_file)
+        else:
+            self.file = self.raw_file
+        self._write_line({'session_info': self.session_info})
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name='session-file-writer')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, packet):
+        """Queue a packet tuple without blocking; returns False if it was dropped"""
+        try:
+            self.queue.put_nowait(packet)
+            return True
+        except queue.Full:
+            self.packets_dropped += 1
+            return False
+
+    def stop(self, end_info=None, wait=False, timeout=5):
+        """Ask the writer to drain, write the footer and close the file.
+
+        Returns immediately unless wait is set; the writer thread finishes the
+        file in the background.
+        """
+        self.end_info = dict(end_info or {})
+        self.running = False
+        if wait and self.thread:
+            self.thread.join(timeout)
+
+    def get_stats(self):
+        """Get writer counters"""
+        return {
+            'path': self.path,
+            'running': self.running,
+            'compression': self.compression,
+            'queue_depth': self.queue.qsize(),
+            'packets_written': self.packets_written,
+            'packets_dropped': self.packets_dropped,
+            'bytes_written': self.bytes_written,
+            'last_fsync': self.last_fsync,
+            'errors': self.errors
+        }
+
+    def _write_line(self, entry):
+        """Append one NDJSON line"""
+        line = (json.dumps(entry, separators=(',', ':')) + '\n').encode()
+        self.file.write(line)
+        self.bytes_written += len(line)
+
+    def _sync(self):
+        """Flush the compressor and the OS buffers to disk"""
+        if self.compression == 'zstd':
+            self.file.flush(zstandard.FLUSH_BLOCK)
+        else:
+            self.file.flush()
+        self.raw_file.flush()
+        os.fsync(self.raw_file.fileno())
+        self.last_fsync = time.time()
+
+    def _write_pending(self, block_timeout, limit=10000):
+        """Write up to limit queued packets; waits up to block_timeout for the first one"""
+        try:
+            packet = self.queue.get(timeout=block_timeout) if block_timeout else self.queue.get_nowait()
+        except queue.Empty:
+            return 0
+        written = 0
+        while True:
+            self._write_line(packet_to_dict(packet))
+            written += 1
+            if limit and written >= limit:
+                break
+            try:
+                packet = self.queue.get_nowait()
+            except queue.Empty:
+                break
+        self.packets_written += written
+        return written
+
+    def _run(self):
+        """Writer loop"""
+        next_sync = time.time() + self.fsync_interval
+        try:
+            while self.running:
+                try:
+                    self._write_pending(0.5)
+                    if time.time() >= next_sync:
+                        self._sync()
+                        next_sync = time.time() + self.fsync_interval
+                except Exception as e:
+                    self.errors += 1
+                    print(f"Error writing session file {self.path}: {e}")
+                    time.sleep(0.5)
+
+            # Drain, then close the session with its footer
+            while self._write_pending(0):
+                pass
+            end_info = self.end_info or {}
+            end_info['packet_count'] = self.packets_written
+            end_info['packets_dropped'] = self.packets_dropped
+            self._write_line({'session_end': end_info})
+            self._sync()
+        except Exception as e:
+            self.errors += 1
+            print(f"Error finishing session file {self.path}: {e}")
+        finally:
+            if self.file is not self.raw_file:
+                self.file.close()
+            self.raw_file.close()
@@ -0,0 +1,182 @@
+import json
+import struct
+import tempfile
+import threading
+
+# Per-packet entry: timestamp, original length, captured length, linktype, protocol,
+# source/destination address lengths; followed by the addresses and the frame bytes
+ENTRY_HEADER = struct.Struct('<dIIHhBB')
+
+PCAP_MAGIC = 0xA1B2C3D4  # Microsecond timestamps
+PCAPNG_SHB = 0x0A0D0D0A
+PCAPNG_IDB = 0x00000001
+PCAPNG_EPB = 0x00000006
+PCAPNG_BYTE_ORDER_MAGIC = 0x1A2B3C4D
+
+READ_CHUNK_SIZE = 1 << 20
+
+
+class SessionPacketStore:
+    """Append-only store of captured session packets with their raw frame bytes.
+
+    Entries are packed into a SpooledTemporaryFile, so small sessions stay in
+    memory and large ones spill to disk. Exports read the file back in chunks
+    and never hold the whole session in memory.
+    """
+
+    def __init__(self, snaplen=65535, spool_size=16 * 1024 * 1024):
+        self.snaplen = int(snaplen)
+        self.file = tempfile.SpooledTemporaryFile(max_size=spool_size, prefix='nta-session-')
+        self.lock = threading.Lock()
+        self.count = 0
+        self.end = 0  # Bytes written so far
+        self.linktypes = []  # Distinct link-layer types, in order of first appearance
+        self.closed = False
+
+    def __len__(self):
+        return self.count
+
+    def append(self, timestamp, src, dst, protocol, size, frame=None, linktype=1):
+        """Add one packet; frame is truncated to snaplen"""
+        src = (src or '').encode()
+        dst = (dst or '').encode()
+        frame = frame[:self.snaplen] if frame else b''
+        entry = ENTRY_HEADER.pack(timestamp, size, len(frame), linktype, protocol, len(src), len(dst)) + src + dst + frame
+        with self.lock:
+            if self.closed:
+                return
+            self.file.seek(self.end)
+            self.file.write(entry)
+            self.end += len(entry)
+            self.count += 1
+            if linktype not in self.linktypes:
+                self.linktypes.append(linktype)
+
+    def close(self):
+        """Discard the stored packets"""
+        with self.lock:
+            self.closed = True
+            self.file.close()
+
+    def is_spilled(self):
+        """Whether the store has rolled over from memory to a file on disk"""
+        return bool(getattr(self.file, '_rolled', False))
+
+    def get_stats(self):
+        """Get store counters"""
+        return {
+            'packets': self.count,
+            'bytes': self.end,
+            'snaplen': self.snaplen,
+            'spilled_to_disk': self.is_spilled(),
+            'linktypes': list(self.linktypes)
+        }
+
+    def _read(self, offset, size):
+        """Read bytes at offset without disturbing appends"""
+        with self.lock:
+            if self.closed:
+                return b''
+            self.file.seek(offset)
+            return self.file.read(size)
+
+    def iter_entries(self):
+        """Yield (timestamp, src, dst, protocol, size, frame, linktype) for packets stored so far"""
+        end = self.end
+        offset = 0
+        buffer = b''
+        position = 0
+        while True:
+            # Parse every complete entry in the buffer, then read the next chunk
+            while len(buffer) - position >= ENTRY_HEADER.size:
+                timestamp, size, caplen, linktype, protocol, src_len, dst_len = ENTRY_HEADER.unpack_from(buffer, position)
+                entry_end = position + ENTRY_HEADER.size + src_len + dst_len + caplen
+                if entry_end > len(buffer):
+                    break
+                start = position + ENTRY_HEADER.size
+                src = buffer[start:start + src_len].decode()
+                dst = buffer[start + src_len:start + src_len + dst_len].decode()
+                frame = buffer[start + src_len + dst_len:entry_end]
+                position = entry_end
+                yield timestamp, src, dst, protocol, size, frame, linktype
+            if offset >= end:
+                return
+            chunk = self._read(offset, min(READ_CHUNK_SIZE, end - offset))
+            if not chunk:
+                return
+            offset += len(chunk)
+            buffer = buffer[position:] + chunk
+            position = 0
+
+    def iter_pcap(self):
+        """Stream the session as a classic libpcap file.
+
+        A pcap file has a single link-layer type; packets of any other type
+        are skipped (use pcapng for mixed captures).
+        """
+        linktype = self.linktypes[0] if self.linktypes else 1
+        yield struct.pack('<IHHiIII', PCAP_MAGIC, 2, 4, 0, 0, self.snaplen, linktype)
+        pending = []
+        pending_size = 0
+        for timestamp, _, _, _, size, frame, entry_linktype in self.iter_entries():
+            if entry_linktype != linktype:
+                continue
+            seconds = int(timestamp)
+            pending.append(struct.pack('<IIII', seconds, int((timestamp - seconds) * 1000000), len(frame), size))
+            pending.append(frame)
+            pending_size += 16 + len(frame)
+            if pending_size >= READ_CHUNK_SIZE:
+                yield b''.join(pending)
+                pending = []
+                pending_size = 0
+        if pending:
+            yield b''.join(pending)
+
+    def iter_pcapng(self):
+        """Stream the session as a pcapng file, with one interface block per link-layer type"""
+        # Section header: byte-order magic, version 1.0, unknown section length
+        yield struct.pack('<IIIHHqI', PCAPNG_SHB, 28, PCAPNG_BYTE_ORDER_MAGIC, 1, 0, -1, 28)
+        interface_ids = {}
+        pending = []
+        pending_size = 0
+        for timestamp, _, _, _, size, frame, linktype in self.iter_entries():
+            interface_id = interface_ids.get(linktype)
+            if interface_id is None:
+                interface_id = interface_ids[linktype] = len(interface_ids)
+                pending.append(struct.pack('<IIHHII', PCAPNG_IDB, 20, linktype, 0, self.snaplen, 20))
+            padding = -len(frame) % 4
+            block_length = 32 + len(frame) + padding
+            microseconds = int(timestamp * 1000000)
+            pending.append(struct.pack('<IIIIIII', PCAPNG_EPB, block_length, interface_id,
+                                       microseconds >> 32, microseconds & 0xFFFFFFFF, len(frame), size))
+            pending.append(frame + b'\x00' * padding + struct.pack('<I', block_length))
+            pending_size += block_length
+            if pending_size >= READ_CHUNK_SIZE:
+                yield b''.join(pending)
+                pending = []
+                pending_size = 0
+        if pending:
+            yield b''.join(pending)
+
+    def iter_csv(self):
+        """Stream the session packet summaries as CSV lines"""
+        from datetime import datetime
+        yield 'Timestamp,Source IP,Destination IP,Protocol,Size\r\n'
+        for timestamp, src, dst, protocol, size, _, _ in self.iter_entries():
+            yield f"{datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')},{src},{dst},{protocol},{size}\r\n"
+
+    def iter_json(self, session_info):
+        """Stream the session as the {'session_info': ..., 'packets': [...]} JSON document"""
+        yield '{"session_info": ' + json.dumps(session_info) + ', "packets": ['
+        separator = ''
+        for timestamp, src, dst, protocol, size, frame, _ in self.iter_entries():
+            yield separator + json.dumps({
+                'timestamp': timestamp,
+                'src': src,
+                'dst': dst,
+                'protocol': protocol,
+                'size': size,
+                'raw': frame.hex()
+            })
+            separator = ', '
+        yield ']}'
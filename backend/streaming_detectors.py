@@ -0,0 +1,283 @@
+import heapq
+import math
+from collections import deque
+
+SCOPES = ('global', 'ip', 'port', 'protocol')
+CLOCKED_SCOPES = ('global', 'protocol')  # Scopes whose bins tick() also closes
+PARAMS = {  # name -> type; max_rate may also be None (no absolute limit)
+    'alpha': float,
+    'z_threshold': float,
+    'cusum_k': float,
+    'cusum_h': float,
+    'warmup': int,
+    'min_count': float,
+    'max_rate': float,
+    'cooldown': float
+}
+SCOPE_DEFAULTS = {  # Per-scope overrides of the detector defaults
+    'global': {'min_count': 100},
+    'ip': {'min_count': 50, 'max_rate': 1000},  # A flood from a new source has no baseline yet
+    'port': {'min_count': 50},
+    'protocol': {'min_count': 100}
+}
+
+# Per-key state list layout
+BIN_END, COUNT, BIN, MEAN, VARIANCE, OBSERVATIONS, CUSUM_HIGH, CUSUM_LOW, LAST_ALERT = range(9)
+
+
+class EWMADetector:
+    """Streaming rate anomaly detector for every key of one scope (IPs, ports, ...).
+
+    Packets are counted into interval-second bins per key. When a key's bin
+    closes (its first packet in a later bin arrives, or close_ended() is
+    called by a clock), the bin's count is compared with the key's
+    exponentially weighted mean and variance:
+
+    - a z-score above z_threshold is a SPIKE,
+    - a CUSUM of the z-scores (slack cusum_k) above cusum_h is a
+      LEVEL_SHIFT up or down, catching sustained changes too small for the
+      z-score,
+    - a rate above max_rate, if set, is HIGH_TRAFFIC regardless of history.
+
+    Then the bin updates the baseline. Skipped (empty) bins are scored and
+    folded in the same way as zeros, up to max_idle_bins of them, so a
+    drop to zero is a downward LEVEL_SHIFT. Keys alert only after warmup
+    bins, for bins of at least min_count packets (or, downwards, a
+    baseline of at least min_count), and at most once per cooldown
+    seconds. Every update is O(1); the bin times come from packet
+    timestamps, so replays behave like live capture. At most max_keys keys
+    are tracked. Callers serialize access.
+    """
+
+    def __init__(self, scope, interval=1.0, alpha=0.1, z_threshold=4.0, cusum_k=0.5, cusum_h=8.0, warmup=10,
+                 min_count=20, max_rate=None, cooldown=60.0, max_keys=100000, max_idle_bins=30, alerts=None):
+        self.scope = scope
+        self.interval = interval
+        self.alpha = alpha
+        self.z_threshold = z_threshold
+        self.cusum_k = cusum_k
+        self.cusum_h = cusum_h
+        self.warmup = warmup
+        self.min_count = min_count
+        self.max_rate = max_rate
+        self.cooldown = cooldown
+        self.max_keys = max_keys
+        self.max_idle_bins = max_idle_bins
+        self.alerts = alerts if alerts is not None else deque(maxlen=1000)
+        self.states = {}  # key -> [bin end, count, bin, mean, variance, observations, cusum high, cusum low, last alert]
+        self.alert_count = 0
+
+    def observe(self, key, timestamp, amount=1):
+        """Count amount packets for a key at timestamp"""
+        state = self.states.get(key)
+        if state is not None and timestamp < state[BIN_END]:
+            # Late packets count towards the open bin too
+            state[COUNT] += amount
+            return
+        bin_index = timestamp // self.interval
+        if state is None:
+            if len(self.states) >= self.max_keys:
+                self._prune(bin_index)
+            self.states[key] = [(bin_index + 1) * self.interval, amount, bin_index, 0.0, 0.0, 0, 0.0, 0.0, -math.inf]
+            return
+        self._close(key, state, bin_index)
+        state[COUNT] += amount
+
+    def baseline(self, key):
+        """(mean, standard deviation) packets per bin for a key, or None"""
+        state = self.states.get(key)
+        if state is None:
+            return None
+        return state[MEAN], math.sqrt(state[VARIANCE])
+
+    def close_ended(self, now):
+        """Close the open bin of every key whose bin ended before now, for keys that stopped receiving packets"""
+        bin_index = now // self.interval
+        for key, state in self.states.items():
+            if state[BIN_END] <= now:
+                self._close(key, state, bin_index)
+
+    def params(self):
+        return {name: getattr(self, name) for name in PARAMS}
+
+    def configure(self, **params):
+        """Change detector parameters (see PARAMS); raises ValueError for unknown or invalid values"""
+        for name, value in params.items():
+            if name not in PARAMS:
+                raise ValueError(f'Unknown detector parameter: {name}')
+            if not (name == 'max_rate' and value is None):
+                value = PARAMS[name](value)
+                if value < 0 or (name == 'alpha' and not 0 < value <= 1):
+                    raise ValueError(f'Invalid value for {name}: {value}')
+            setattr(self, name, value)
+
+    def get_stats(self):
+        return {'keys': len(self.states), 'alerts': self.alert_count}
+
+    def _close(self, key, state, bin_index):
+        """Score and fold in the finished bin, then each empty bin up to bin_index"""
+        idle = min(int(bin_index - state[BIN]) - 1, self.max_idle_bins)
+        self._score(key, state, state[COUNT], state[BIN])
+        for offset in range(1, idle + 1):
+            self._score(key, state, 0, state[BIN] + offset)
+        state[BIN] = bin_index
+        state[BIN_END] = (bin_index + 1) * self.interval
+        state[COUNT] = 0
+
+    def _score(self, key, state, count, bin_index):
+        """Check one bin's count against the key's baseline, then update the baseline with it"""
+        mean = state[MEAN]
+        alert = None
+        if self.max_rate is not None and count / self.interval > self.max_rate:
+            alert = 'HIGH_TRAFFIC'
+        if state[OBSERVATIONS] >= self.warmup:
+            # Poisson floor so near-constant keys do not alert on tiny changes
+            deviation = max(math.sqrt(state[VARIANCE]), math.sqrt(mean), 1.0)
+            z = (count - mean) / deviation
+            cusum_high = max(0.0, state[CUSUM_HIGH] + z - self.cusum_k)
+            cusum_low = max(0.0, state[CUSUM_LOW] - z - self.cusum_k)
+            if alert is None:
+                if z > self.z_threshold and count >= self.min_count:
+                    alert = 'SPIKE'
+                elif cusum_high > self.cusum_h and count >= self.min_count:
+                    alert = 'LEVEL_SHIFT'
+                elif cusum_low > self.cusum_h and mean >= self.min_count:
+                    alert = 'LEVEL_SHIFT'
+            if alert:
+                self._alert(key, state, alert, count, mean, z, bin_index * self.interval)
+                cusum_high = cusum_low = 0.0
+            state[CUSUM_HIGH] = cusum_high
+            state[CUSUM_LOW] = cusum_low
+        elif alert:
+            self._alert(key, state, alert, count, mean, None, bin_index * self.interval)
+
+        alpha = self.alpha
+        diff = count - mean
+        increment = alpha * diff
+        state[MEAN] = mean + increment
+        state[VARIANCE] = (1 - alpha) * (state[VARIANCE] + diff * increment)
+        state[OBSERVATIONS] += 1
+
+    def _alert(self, key, state, kind, count, mean, z, timestamp):
+        if timestamp - state[LAST_ALERT] < self.cooldown:
+            return
+        state[LAST_ALERT] = timestamp
+        self.alert_count += 1
+        rate = count / self.interval
+        if kind == 'HIGH_TRAFFIC' and self.scope == 'global':
+            message = f'High traffic detected: {rate:.2f} packets/second'
+        else:
+            direction = 'above' if count >= mean else 'below'
+            subject = 'Total traffic' if self.scope == 'global' else f'Traffic for {self.scope} {key}'
+            message = (f'{subject} at {rate:.2f} packets/second, {direction} its baseline of '
+                       f'{mean / self.interval:.2f} ({kind.lower().replace("_", " ")})')
+        self.alerts.append({
+            'type': kind if self.scope == 'global' and kind == 'HIGH_TRAFFIC' else f'{self.scope.upper()}_{kind}',
+            'message': message,
+            'severity': 'WARNING',
+            'timestamp': timestamp,
+            'scope': self.scope,
+            'key': key,
+            'rate': rate,
+            'baseline': mean / self.interval,
+            'z_score': z
+        })
+
+    def _prune(self, bin_index):
+        """Drop keys idle for longer than max_idle_bins, or else the least recently active half"""
+        states = self.states
+        idle_before = bin_index - self.max_idle_bins
+        stale = [key for key, state in states.items() if state[BIN] < idle_before]
+        if len(stale) < len(states) // 10:
+            # By last active bin, not insertion order, so long-lived busy keys keep their baselines
+            stale = heapq.nsmallest(len(states) // 2, states, key=lambda key: states[key][BIN])
+        for key in stale:
+            del states[key]
+
+
+class StreamingDetectors:
+    """EWMA/CUSUM detectors for total traffic and per source IP, destination port and protocol.
+
+    observe_packet() costs four dict lookups per packet; alerts collect in
+    a bounded queue drained by the stats loop. tick() closes global and
+    protocol bins from a clock. Callers serialize access.
+    """
+
+    def __init__(self, interval=1.0, max_keys=100000, **params):
+        self.alerts = deque(maxlen=1000)
+        self.detectors = {}
+        for scope in SCOPES:
+            scope_params = dict(params)
+            scope_params.update(SCOPE_DEFAULTS[scope])
+            self.detectors[scope] = EWMADetector(scope, interval, max_keys=max_keys, alerts=self.alerts, **scope_params)
+        self._clock_signature = None  # (bin, count) of the global key at the last tick
+        self._clock_anchor = (0.0, 0.0)  # (stream time, now) when packets were last seen
+        # Bound methods for the per-packet path
+        self._global = self.detectors['global'].observe
+        self._ip = self.detectors['ip'].observe
+        self._port = self.detectors['port'].observe
+        self._protocol = self.detectors['protocol'].observe
+
+    def tick(self, now):
+        """Close ended bins of total traffic and of each protocol; call about once a second.
+
+        Without packets a key's bins never close, so a global outage or a
+        protocol going silent would never be scored. Bins follow packet
+        timestamps, so the clock does too: while packets arrive, stream
+        time is the start of the newest global bin, and once they stop it
+        advances with now from the last time they were seen.
+        """
+        state = self.detectors['global'].states.get('all')
+        if state is None:
+            return
+        interval = self.detectors['global'].interval
+        if (state[BIN], state[COUNT]) != self._clock_signature:
+            self._clock_anchor = (state[BIN] * interval, now)
+            stream_now = state[BIN] * interval
+        else:
+            stream_now = self._clock_anchor[0] + now - self._clock_anchor[1]
+        for scope in CLOCKED_SCOPES:
+            self.detectors[scope].close_ended(stream_now)
+        # Bins closed here are not packet activity
+        self._clock_signature = (state[BIN], state[COUNT])
+
+    def observe_packet(self, timestamp, src, dst_port, protocol):
+        """Account one packet"""
+        self._global('all', timestamp)
+        self._ip(src, timestamp)
+        if dst_port:
+            self._port(dst_port, timestamp)
+        self._protocol(protocol, timestamp)
+
+    def observe(self, scope, key, timestamp, amount=1):
+        """Account amount packets for a key of one scope ('all' for global)"""
+        self.detectors[scope].observe(key, timestamp, amount)
+
+    def drain(self):
+        """Return and clear the alerts raised since the last call"""
+        alerts = list(self.alerts)
+        self.alerts.clear()
+        return alerts
+
+    def configure(self, settings):
+        """Apply {param: value} to every scope and/or {scope: {param: value}} to one.
+
+        Validates everything before changing anything; raises ValueError.
+        """
+        shared = {name: value for name, value in settings.items() if name not in SCOPES}
+        for scope in SCOPES:
+            if scope in settings and not isinstance(settings[scope], dict):
+                raise ValueError(f'Settings for scope {scope} must be an object')
+        for scope, detector in self.detectors.items():
+            trial = EWMADetector(scope)
+            trial.configure(**shared)
+            trial.configure(**settings.get(scope, {}))
+        for scope, detector in self.detectors.items():
+            detector.configure(**shared)
+            detector.configure(**settings.get(scope, {}))
+
+    def get_config(self):
+        return {scope: detector.params() for scope, detector in self.detectors.items()}
+
+    def get_stats(self):
+        return {scope: detector.get_stats() for scope, detector in self.detectors.items()}
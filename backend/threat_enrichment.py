@@ -0,0 +1,94 @@
+import queue
+import threading
+import time
+
+
+class ThreatIntelEnricher:
+    """Worker pool that resolves threat intelligence off the capture path"""
+
+    def __init__(self, check_fn, on_result=None, num_workers=4, max_queue_size=10000):
+        self.check_fn = check_fn
+        self.on_result = on_result
+        self.num_workers = num_workers
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.pending = set()
+        self.pending_lock = threading.Lock()
+        self.workers = []
+        self.running = False
+
+        # Counters exposed through the status API
+        self.submitted = 0
+        self.completed = 0
+        self.dropped = 0
+        self.errors = 0
+        self.total_latency = 0.0
+
+    def start(self):
+        """Start the worker threads"""
+        if self.running:
+            return
+        self.running = True
+        for i in range(self.num_workers):
+            worker = threading.Thread(target=self._run, name=f'threat-intel-worker-{i}')
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def stop(self, timeout=5):
+        """Stop the worker threads"""
+        self.running = False
+        for worker in self.workers:
+            worker.join(timeout)
+        self.workers = []
+
+    def submit(self, ip):
+        """Queue an IP for enrichment; duplicates already in flight are ignored"""
+        with self.pending_lock:
+            if ip in self.pending:
+                return False
+            self.pending.add(ip)
+        try:
+            self.queue.put_nowait(ip)
+        except queue.Full:
+            with self.pending_lock:
+                self.pending.discard(ip)
+            self.dropped += 1
+            return False
+        self.submitted += 1
+        return True
+
+    def get_stats(self):
+        """Get enrichment counters"""
+        return {
+            'running': self.running,
+            'workers': self.num_workers,
+            'queue_depth': self.queue.qsize(),
+            'in_flight': len(self.pending),
+            'submitted': self.submitted,
+            'completed': self.completed,
+            'dropped': self.dropped,
+            'errors': self.errors,
+            'avg_latency_ms': (self.total_latency / self.completed * 1000) if self.completed else 0.0
+        }
+
+    def _run(self):
+        """Worker loop"""
+        while self.running:
+            try:
+                ip = self.queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+
+            started = time.time()
+            try:
+                result = self.check_fn(ip)
+                self.completed += 1
+                self.total_latency += time.time() - started
+                if self.on_result:
+                    self.on_result(ip, result)
+            except Exception as e:
+                self.errors += 1
+                print(f"Error enriching {ip}: {e}")
+            finally:
+                with self.pending_lock:
+                    self.pending.discard(ip)